@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+"""
+Measure the start-up time of poppy modules and scripts
+
+Every target is run in a fresh interpreter (best of `--repeat` runs),
+e.g.
+
+    python benchmarks/import_time.py
+    python benchmarks/import_time.py --modules pandas poppy.metrics --limit 1
+"""
+from __future__ import print_function
+import argparse
+import glob
+import os
+import subprocess
+import sys
+import timeit
+
+here = os.path.dirname(os.path.abspath(__file__))
+root = os.path.dirname(here)
+
+default_modules = ['numpy', 'netCDF4', 'pandas', 'poppy', 'poppy.metrics',
+        'poppy.grid', 'poppy.do_reader', 'poppy.pyramid', 'poppy.animators']
+
+
+def _run(cmd):
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([root, os.environ.get('PYTHONPATH', '')]))
+    with open(os.devnull, 'w') as devnull:
+        return subprocess.call(cmd, stdout=devnull, stderr=devnull, env=env)
+
+
+def time_command(cmd, repeat=3):
+    """Best wall time of `repeat` runs of `cmd` and its return code"""
+    times = []
+    for _ in range(repeat):
+        start = timeit.default_timer()
+        status = _run(cmd)
+        times.append(timeit.default_timer() - start)
+    return min(times), status
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure import and start-up times")
+    parser.add_argument('--modules', nargs='*', default=default_modules,
+            help='modules to import')
+    parser.add_argument('--scripts', nargs='*', 
+            default=sorted(glob.glob(os.path.join(root, 'scripts', '*'))),
+            help='scripts to run with --help')
+    parser.add_argument('-r', '--repeat', type=int, default=3,
+            help='number of runs per target')
+    parser.add_argument('--limit', type=float, default=None,
+            help='exit with an error if any poppy target takes longer (seconds)')
+    args = parser.parse_args()
+
+    baseline, _ = time_command([sys.executable, '-c', 'pass'], args.repeat)
+    print('{:<45s} {:>8.3f} s'.format('python (interpreter start-up)', baseline))
+
+    slow = []
+    targets = ([('import ' + m, [sys.executable, '-c', 'import ' + m]) for m in args.modules] +
+               [(os.path.basename(s) + ' --help', [sys.executable, s, '--help']) for s in args.scripts])
+    for name, cmd in targets:
+        elapsed, status = time_command(cmd, args.repeat)
+        note = '' if status == 0 else '  (failed: exit code {})'.format(status)
+        print('{:<45s} {:>8.3f} s{}'.format(name, elapsed, note))
+        if args.limit is not None and elapsed > args.limit and (
+                'poppy' in name or name.endswith('--help')):
+            slow.append(name)
+    if slow:
+        print('Slower than {} s: {}'.format(args.limit, ', '.join(slow)))
+        sys.exit(1)
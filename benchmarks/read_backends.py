@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+"""
+Compare the read backends on a hyperslab of one variable
+
+Every backend reads `--index` of `--varn` from all files (best of
+`--repeat` passes over the files), once letting the backend allocate the
+result and once into a preallocated buffer. Handles are opened once, so
+later passes may be served from the chunk caches; `--reopen` opens the
+files in every pass (and includes the open in the timing), e.g.
+
+    python benchmarks/read_backends.py /data/hist/*.pop.h.*.nc --varn MOC --index 0,1,0,:,:
+    python benchmarks/read_backends.py hist.nc --varn TEMP --index 0,0 --backends netcdf4 h5py
+
+`--threads` sets the number of threads of the h5py-threads backend.
+`--stats` prints the bytes requested vs the bytes decompressed per backend.
+The h5py backend only reads netCDF-4 (HDF5) files.
+"""
+from __future__ import print_function
+import argparse
+import os
+import sys
+import timeit
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from poppy import backends
+from poppy import chunks
+from poppy import decompress
+
+
+def parse_index(s):
+    """Index tuple from a string like '0,1,0,10:20,:'"""
+    index = []
+    for item in s.split(','):
+        item = item.strip()
+        if item == '...':
+            index.append(Ellipsis)
+        elif ':' in item:
+            index.append(slice(*[int(i) if i else None for i in item.split(':')]))
+        else:
+            index.append(int(item))
+    return tuple(index)
+
+
+def time_backend(backend, ncfiles, varn, index, repeat=3, buffered=False, reopen=False):
+    """Best time of `repeat` passes reading `index` from all files and the bytes read per pass"""
+    with backends.open_file(ncfiles[0], backend) as f:
+        out = f.read(varn, index) if buffered else None
+    handles = None if reopen else [backends.open_file(fname, backend) for fname in ncfiles]
+    try:
+        times = []
+        for _ in range(repeat):
+            start = timeit.default_timer()
+            for n, fname in enumerate(ncfiles):
+                f = backends.open_file(fname, backend) if reopen else handles[n]
+                data = f.read(varn, index, out=out)
+                if reopen:
+                    f.close()
+            times.append(timeit.default_timer() - start)
+        return min(times), data.nbytes * len(ncfiles)
+    finally:
+        for f in (handles or []):
+            f.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare read backends")
+    parser.add_argument('ncfiles', nargs='+', help='input files')
+    parser.add_argument('--varn', default='MOC', help='variable to read')
+    parser.add_argument('--index', default='...',
+            help='hyperslab, comma-separated ints and start:stop:step slices')
+    parser.add_argument('--backends', nargs='*', default=sorted(backends.backends),
+            help='backends to compare')
+    parser.add_argument('-r', '--repeat', type=int, default=3,
+            help='number of passes over the files')
+    parser.add_argument('--reopen', action='store_true',
+            help='open the files in every pass')
+    parser.add_argument('--threads', type=int,
+            help='threads decompressing chunks (h5py-threads, default: number of CPUs)')
+    parser.add_argument('--stats', action='store_true',
+            help='report bytes requested vs bytes decompressed')
+    args = parser.parse_args()
+
+    index = parse_index(args.index)
+    print('Reading {}[{}] from {} files'.format(args.varn, args.index, len(args.ncfiles)))
+    print('{:<12s} {:<10s} {:>12s} {:>12s}'.format('backend', 'buffer', 'ms/file', 'MB/s'))
+    decompress.threads = args.threads
+    chunks.stats.enabled = args.stats
+    for backend in args.backends:
+        chunks.stats.reset()
+        for buffered in [False, True]:
+            try:
+                t, nbytes = time_backend(backend, args.ncfiles, args.varn, index,
+                        repeat=args.repeat, buffered=buffered, reopen=args.reopen)
+            except Exception as err:
+                print('{:<12s} failed: {}'.format(backend, err))
+                break
+            print('{:<12s} {:<10s} {:>12.3f} {:>12.1f}'.format(backend, ['new', 'reused'][buffered],
+                t / len(args.ncfiles) * 1e3, nbytes / t / 1e6))
+        if args.stats:
+            print(chunks.stats.report())
@@ -1,33 +1,46 @@
 import numpy as np
-import matplotlib.pyplot as plt
-import matplotlib.ticker as mticker
-import matplotlib.patheffects as mpatheffects
-from mpl_toolkits.axes_grid1 import make_axes_locatable
 import netCDF4
 import time
 import datetime
+import os
+import shutil
+import subprocess
+import multiprocessing
+import functools
 
-import pyutils.dates as pud
-import pycpt.modify
-import pycpt.load
-pycpt.load.register_cptcity_cmaps('http://soliton.vm.bytemark.co.uk/pub/cpt-city/gmt/GMT_ocean.cpt')
-
-def _update_time(ani,fname):
-    with netCDF4.Dataset(fname) as ds:
-        timevar = ds.variables['time']
-        ani.date = pud.pseudo_to_proper_datetime(
-                netCDF4.num2date(timevar[0],timevar.units,timevar.calendar))
-        ani.date -= datetime.timedelta(days=1)
-        newyear = pud.datetime_to_decimal_year(ani.date)
-        try:
-            ani.elapsed = newyear - ani.initialyear
-        except AttributeError:
-            ani.elapsed = 0.
-            ani.initialyear = newyear
-        ani.year = newyear
-
-def _update_timestamp(ani, fname):
-    _update_time(ani, fname)
+from .frames import FrameSource, CubeFrameSource
+from . import decimate as poppydecimate
+from . import sketch as poppysketch
+from . import colormaps
+from . import ncpool
+from . import chunks
+from .lazy import LazyModule
+
+plt = LazyModule('matplotlib.pyplot')
+mticker = LazyModule('matplotlib.ticker')
+mpatheffects = LazyModule('matplotlib.patheffects')
+axes_grid1 = LazyModule('mpl_toolkits.axes_grid1')
+pud = LazyModule('pyutils.dates')
+pycpt_modify = LazyModule('pycpt.modify')
+
+def _read_date(dsvar):
+    timevar = dsvar['time']
+    date = pud.pseudo_to_proper_datetime(
+            netCDF4.num2date(timevar[0],timevar.units,timevar.calendar))
+    return date - datetime.timedelta(days=1)
+
+def _update_time(ani, date):
+    ani.date = date
+    newyear = pud.datetime_to_decimal_year(ani.date)
+    try:
+        ani.elapsed = newyear - ani.initialyear
+    except AttributeError:
+        ani.elapsed = 0.
+        ani.initialyear = newyear
+    ani.year = newyear
+
+def _update_timestamp(ani, date):
+    _update_time(ani, date)
     text = 'model year: {0.year:04d}-{0.month:02d}\nelapsed: {1:.2f} years'.format(ani.date,ani.elapsed)
     try:
         ani.timestamp.set_text(text)
@@ -36,12 +49,57 @@ def _update_timestamp(ani, fname):
                 ha='right',va='bottom',transform=ani.ax.transAxes,
                 path_effects=([mpatheffects.withStroke(linewidth=3, foreground='white')]))
 
+def _tolist(a):
+    return None if a is None else np.asarray(a).tolist()
+
+def _get_frame_source(ani, lookahead=4, cache=None, sketch=None):
+    """Frame source reading the input files or replaying from the cube `cache`
+
+    `sketch` is updated if the cube is extracted.
+    """
+    if cache is None:
+        return FrameSource(ani.ncfiles, ani._read_frame, lookahead=lookahead)
+    meta = dict(animator=type(ani).__name__, varname=ani.varname, t=ani.t, 
+            k=_tolist(getattr(ani, 'k', None)), maxk=_tolist(getattr(ani, 'maxk', None)),
+            ii=_tolist(ani.ii), jj=_tolist(ani.jj), scale=ani.scale,
+            decimate=getattr(ani, 'decimate', None), factor=_tolist(getattr(ani, 'factor', None)))
+    return CubeFrameSource.open_or_extract(cache, ani.ncfiles, ani._read_frame, 
+            meta=meta, lookahead=lookahead, sketch=sketch)
+
+def _get_levels(ani, levels, sketch, nprocs=1):
+    """Levels from the last frame (None) or robust levels from all frames ('robust')
+
+    Robust levels come from `sketch` if it was updated while extracting
+    the frame cube, from the frames of an existing cube, or else from an
+    extra pass over all files in `nprocs` processes (the levels are
+    needed before the first frame is drawn).
+    """
+    if levels is None:
+        sample_data = ani.frames.read(len(ani.frames)-1)[0]
+        ticker = mticker.MaxNLocator(nbins=21, symmetric=True)
+        return ticker.tick_values(sample_data.min(), sample_data.max()) 
+    elif isinstance(levels, str) and levels == 'robust':
+        if sketch.count == 0 and isinstance(ani.frames, CubeFrameSource):
+            sketch = poppysketch.sketch_frames(ani.frames, sketch)
+        elif sketch.count == 0:
+            sketch = poppysketch.sketch_files(ani.ncfiles, ani._data_reader(), nprocs=nprocs)
+        return poppysketch.robust_levels(sketch)
+    return levels
+
+def _read_field(dsvar, varname, index, scale=1., reducer=None, aligned=False):
+    """`varname`[index] * `scale` of one file, reduced by `reducer` (picklable frame reader)"""
+    var = dsvar[varname]
+    data = (chunks.read_aligned(var, index) if aligned else var[index]) * scale
+    if reducer is not None:
+        data = reducer(data)
+    return data
+
 def _find_depth_level(fname, depth):
-    with netCDF4.Dataset(fname) as ds:
+    with ncpool.dataset(fname) as ds:
         return np.argmin(np.abs(ds.variables['z_w'][:]*1e-2 - depth))
 
 def _get_level_depth(fname, k):
-    with netCDF4.Dataset(fname) as ds:
+    with ncpool.dataset(fname) as ds:
         return ds.variables['z_w'][k]*1e-2
 
 
@@ -60,6 +118,11 @@ class Layer:
             ii=None, jj=None,
             pause = 0,
             with_timestamp = True,
+            lookahead = 4,
+            decimate = None,
+            npixels = None,
+            cache = None,
+            nprocs = 1,
             ):
         """
         Create a new horizontal layer animation
@@ -74,8 +137,11 @@ class Layer:
            netCDF variable name
         scale : float
            scale the data by this factor
-        levels : sequence, optional
+        levels : sequence or 'robust', optional
            data levels for plotting
+           default: symmetric levels spanning the last frame
+           'robust': symmetric levels spanning the 1-99 percentiles of all frames
+           (without `cache`, all files are read once more before the animation)
         cmap : str or plt.cm
             color map
         k : int
@@ -88,6 +154,21 @@ class Layer:
             indices for subregion
         pause : float, optional
             pause during each iteration step
+        lookahead : int, optional
+            number of frames read ahead in the background
+        cache : str, optional
+            path to a frame cube (.npy); the frames are extracted into it
+            once and replayed from it afterwards (see `frames.CubeFrameSource`)
+        decimate : str, optional
+            reduce the data to about the resolution of the axis before plotting:
+            'mean', 'max' or 'min' for NaN-aware block statistics or
+            'stride' to read only every n-th point from disk
+        npixels : int or tuple, optional
+            target (ny,nx) resolution for decimation
+            (default: size of the axis in pixels)
+        nprocs : int, optional
+            number of processes reading the files for levels='robust'
+            without `cache`
         """
         self.ax = ax
         self.ncfiles = ncfiles
@@ -116,29 +197,29 @@ class Layer:
         self.pause = pause
         self.with_timestamp = with_timestamp
         self._make_axes()
+        self._setup_decimation(decimate, npixels)
         self._update_long_name(ncfiles[0])
         self.ax.autoscale(axis='both',tight=True)
         # levels
-        if levels is None:
-            sample_data = self._get_data(self.ncfiles[-1])
-            ticker = mticker.MaxNLocator(nbins=21, symmetric=True)
-            levels = ticker.tick_values(sample_data.min(), sample_data.max()) 
-        self.cmap, self.norm = pycpt.modify.generate_cmap_norm(levels=levels, cm=cmap)
+        self.sketch = poppysketch.QuantileSketch()
+        self.frames = _get_frame_source(self, lookahead, cache, sketch=self.sketch)
+        self.levels = levels = _get_levels(self, levels, self.sketch, nprocs)
+        colormaps.register_cmaps()
+        self.cmap, self.norm = pycpt_modify.generate_cmap_norm(levels=levels, cm=cmap)
     
     def _update_long_name(self,fname):
-        with netCDF4.Dataset(fname) as ds:
+        with ncpool.dataset(fname) as ds:
             self.long_name = '{0.long_name} ({0.units})'.format(ds.variables[self.varname])
             if len(self.datashape) == 4:
                 self.long_name += ' at {:.0f} m'.format(self.depth_k)
 
     def init(self,cbarpos='right'):
-        fname = self.ncfiles[0]
-        self.data = self._get_data(fname)
+        self.data, date = self.frames.read(0)
         self.img = self.ax.pcolormesh(
                 self.xax,self.yax,
                 self.data,
                 cmap=self.cmap,norm=self.norm)
-        divider = make_axes_locatable(self.ax)
+        divider = axes_grid1.make_axes_locatable(self.ax)
         cax = divider.append_axes(cbarpos, size="5%", pad=0.05)
         self.cb = self.fig.colorbar(self.img, cax=cax, orientation='vertical',
                 #format='%.1e',
@@ -146,23 +227,54 @@ class Layer:
                 )
         self.cb.ax.yaxis.set_ticks_position(cbarpos)
         #self.cb.ax.yaxis.set_label_position(cbarpos)
-        if self.with_timestamp: _update_timestamp(self,fname)
+        if self.with_timestamp: _update_timestamp(self, date)
         self.ax.set_xticklabels(['{:.0f}'.format(np.mod(i,self.nx)) for i in self.ax.get_xticks()])
         self.ax.set_title(self.long_name)
         return self.img
 
     def _get_datashape(self, fname=None):
         fname = fname or self.ncfiles[0]
-        with netCDF4.Dataset(fname) as ds:
+        with ncpool.dataset(fname) as ds:
             self.datashape = ds.variables[self.varname].shape
             return self.datashape
 
+    def _setup_decimation(self, decimate, npixels):
+        """Set up the block reduction or strided reading once for all frames"""
+        self.decimate = decimate
+        self.reducer = None
+        if decimate is None:
+            return
+        shape = (len(self.jj), len(self.ii))
+        if npixels is None:
+            bbox = self.ax.get_window_extent()
+            npixels = (int(bbox.height), int(bbox.width))
+        self.factor = fy, fx = poppydecimate.get_factor(shape, npixels)
+        if decimate == 'stride':
+            self.jj = self.jj[::fy]
+            self.ii = self.ii[::fx]
+        else:
+            self.reducer = poppydecimate.BlockReducer(shape, self.factor, how=decimate)
+        self.xax = poppydecimate.coarse_edges(self.xax, fx, shape[1])
+        self.yax = poppydecimate.coarse_edges(self.yax, fy, shape[0])
+
+    def _data_reader(self):
+        """Picklable reader of the plotted field, reader(dsvar)"""
+        if self.ndim == 4:
+            index = (self.t,self.k,self.jj,self.ii)
+        elif self.ndim == 3:
+            index = (self.t,self.jj,self.ii)
+        return functools.partial(_read_field, varname=self.varname, index=index,
+                scale=self.scale, reducer=self.reducer)
+
+    def _read_data(self, dsvar):
+        return self._data_reader()(dsvar)
+
+    def _read_frame(self, dsvar):
+        return self._read_data(dsvar), _read_date(dsvar)
+
     def _get_data(self, fname):
-        with netCDF4.Dataset(fname) as ds:
-            if self.ndim == 4:
-                return ds.variables[self.varname][self.t,self.k,self.jj,self.ii] * self.scale
-            elif self.ndim == 3:
-                return ds.variables[self.varname][self.t,self.jj,self.ii] * self.scale
+        with ncpool.dataset(fname) as ds:
+            return self._read_data(ds.variables)
 
     def _make_axes(self):
         try:
@@ -173,11 +285,10 @@ class Layer:
             self.yax = np.arange(len(self.jj)+1,dtype=float)-0.5
 
     def __call__(self, i):
-        fname = self.ncfiles[i]
-        self.data = self._get_data(fname)
+        self.data, date = self.frames[i]
         time.sleep(self.pause)
         self.img.set_array(self.data.ravel())
-        if self.with_timestamp: _update_timestamp(self,fname)
+        if self.with_timestamp: _update_timestamp(self, date)
         return self.img
 
 
@@ -195,6 +306,9 @@ class VerticalSection:
             pause = 0,
             with_timestamp = True,
             limit_k = True,
+            lookahead = 4,
+            cache = None,
+            nprocs = 1,
             ):
         """
         Create a new vertical section animation
@@ -211,14 +325,25 @@ class VerticalSection:
             indices for subregion
         scale : float
            scale the data by this factor
-        levels : sequence, optional
+        levels : sequence or 'robust', optional
            data levels for plotting
+           default: symmetric levels spanning the last frame
+           'robust': symmetric levels spanning the 1-99 percentiles of all frames
+           (without `cache`, all files are read once more before the animation)
         cmap : str or plt.cm
             color map
         t : int
             time level for each file
         pause : float, optional
             pause during each iteration step
+        lookahead : int, optional
+            number of frames read ahead in the background
+        cache : str, optional
+            path to a frame cube (.npy); the frames are extracted into it
+            once and replayed from it afterwards (see `frames.CubeFrameSource`)
+        nprocs : int, optional
+            number of processes reading the files for levels='robust'
+            without `cache`
         """
         self.ax = ax
         self.t = t
@@ -246,40 +371,52 @@ class VerticalSection:
         self.ax.autoscale(axis='x',tight=True)
         self.ax.invert_yaxis()
         # levels
-        if levels is None:
-            sample_data = self._get_data(self.ncfiles[-1])
-            ticker = mticker.MaxNLocator(nbins=21, symmetric=True)
-            levels = ticker.tick_values(sample_data.min(), sample_data.max()) 
-        self.cmap, self.norm = pycpt.modify.generate_cmap_norm(levels=levels, cm=cmap)
+        self.sketch = poppysketch.QuantileSketch()
+        self.frames = _get_frame_source(self, lookahead, cache, sketch=self.sketch)
+        self.levels = levels = _get_levels(self, levels, self.sketch, nprocs)
+        colormaps.register_cmaps()
+        self.cmap, self.norm = pycpt_modify.generate_cmap_norm(levels=levels, cm=cmap)
     
     def _update_long_name(self,fname):
-        with netCDF4.Dataset(fname) as ds:
+        with ncpool.dataset(fname) as ds:
             self.long_name = '{0.long_name} ({0.units})'.format(ds.variables[self.varname])
 
     def init(self,cbarpos='right'):
-        fname = self.ncfiles[0]
-        self.data = self._get_data(fname)
+        self.data, date = self.frames.read(0)
         self.img = self.ax.pcolormesh(
                 self.xax,self.zax,
                 self.data,
                 cmap=self.cmap,norm=self.norm)
-        divider = make_axes_locatable(self.ax)
+        divider = axes_grid1.make_axes_locatable(self.ax)
         cax = divider.append_axes(cbarpos, size="5%", pad=0.05)
         self.cb = self.fig.colorbar(self.img, cax=cax, orientation='vertical', 
                 label = self.long_name)
-        if self.with_timestamp: _update_timestamp(self, fname)
+        if self.with_timestamp: _update_timestamp(self, date)
         return self.img
 
     def _get_datashape(self, fname):
-        with netCDF4.Dataset(fname) as ds:
+        with ncpool.dataset(fname) as ds:
             return ds.variables[self.varname].shape
 
+    def _data_reader(self):
+        """Picklable reader of the plotted field, reader(dsvar)"""
+        # section columns are read one chunk at a time
+        return functools.partial(_read_field, varname=self.varname,
+                index=(self.t, slice(None, self.maxk), self.jj, self.ii),
+                scale=self.scale, aligned=True)
+
+    def _read_data(self, dsvar):
+        return self._data_reader()(dsvar)
+
+    def _read_frame(self, dsvar):
+        return self._read_data(dsvar), _read_date(dsvar)
+
     def _get_data(self, fname):
-        with netCDF4.Dataset(fname) as ds:
-            return ds.variables[self.varname][self.t,:self.maxk,self.jj,self.ii] * self.scale
+        with ncpool.dataset(fname) as ds:
+            return self._read_data(ds.variables)
 
     def _make_axes(self,fname):
-        with netCDF4.Dataset(fname) as ds:
+        with ncpool.dataset(fname) as ds:
             dsvar = ds.variables
             self.zax = np.concatenate([[0],dsvar['z_w_bot'][:self.maxk]*1e-2])
             try:
@@ -287,18 +424,18 @@ class VerticalSection:
             except:
                 self.xax = np.arange(len(self.jj)+1, dtype=float)-0.5
 
-    def __call__(self,i):
-        fname = self.ncfiles[i]
-        self.data = self._get_data(fname)
+    def __call__(self, i):
+        self.data, date = self.frames[i]
         time.sleep(self.pause)
         self.img.set_array(self.data.ravel())
-        if self.with_timestamp: _update_timestamp(self,fname)
+        if self.with_timestamp: _update_timestamp(self, date)
         return self.img
 
     def plot_map(self):
+        colormaps.register_cmaps()
         self.mapfig = plt.figure()
         self.mapax = self.mapfig.add_subplot(111)
-        with netCDF4.Dataset(self.ncfiles[0])as ds:
+        with ncpool.dataset(self.ncfiles[0]) as ds:
             depth = ds.variables['HU'][:]*1e-2
             depth = np.ma.masked_where(depth<=0,depth)
         self.mapimg = self.mapax.pcolormesh(depth,cmap='GMT_ocean_r')
@@ -311,3 +448,122 @@ class VerticalSection:
         return self.mapfig
 
 
+### OFFLINE RENDERING
+
+def _render_chunk(frames, animator, kwargs, outdir, prefix, figsize, dpi, init_kwargs):
+    """Render `frames` with a new figure and animator in this process"""
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    fig = Figure(figsize=figsize)
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot(111)
+    ani = animator(ax, **kwargs)
+    ani.init(**init_kwargs)
+    fnames = []
+    for i in frames:
+        ani(i)
+        fname = os.path.join(outdir, '{}_{:05d}.png'.format(prefix, i))
+        fig.savefig(fname, dpi=dpi)
+        fnames.append(fname)
+    ani.frames.stop()
+    return fnames
+
+
+def render_frames(animator, kwargs, outdir, frames=None, nprocs=1,
+        figsize=None, dpi=100, prefix='frame', init_kwargs={},
+        movie=None, framerate=10):
+    """Render an animation to numbered PNG files, in parallel
+
+    Every process renders a contiguous range of frames on its own figure,
+    so the frames are identical to the ones shown by the interactive
+    animation (the levels are determined once, before distributing).
+
+    Parameters
+    ----------
+    animator : class
+        Layer or VerticalSection
+    kwargs : dict
+        arguments to the animator (without `ax`), 
+        e.g. dict(ncfiles=ncfiles, varname='TEMP', k=0)
+    outdir : str
+        output directory
+    frames : list of int, optional
+        frames to render (default: all)
+    nprocs : int
+        number of processes (also reading the files for robust levels,
+        unless `kwargs` sets nprocs)
+    figsize : tuple, optional
+        figure size in inches
+    dpi : int
+        resolution of the images
+    prefix : str
+        file name prefix, files are named prefix_00000.png, ...
+    init_kwargs : dict
+        arguments to the animator's init (e.g. cbarpos)
+    movie : str, optional
+        assemble the frames into this movie file with ffmpeg (if available)
+    framerate : int
+        frames per second of the movie
+
+    Returns
+    -------
+    list of image file names
+    """
+    kwargs = dict(kwargs)
+    if frames is None:
+        frames = list(range(len(kwargs['ncfiles'])))
+    if (kwargs.get('levels') is None or isinstance(kwargs['levels'], str)
+            or kwargs.get('cache') is not None):
+        # levels and frame cube are set up here once, not by every worker
+        from matplotlib.figure import Figure
+        parent_kwargs = dict(kwargs)
+        parent_kwargs.pop('lookahead', None)
+        parent_kwargs.setdefault('nprocs', nprocs)
+        ani = animator(Figure().add_subplot(111), lookahead=0, **parent_kwargs)
+        ani.frames.stop()
+        kwargs['levels'] = ani.levels
+    if not os.path.isdir(outdir):
+        os.makedirs(outdir)
+    nprocs = max(1, min(nprocs, len(frames)))
+    frame_ranges = [frames[n*len(frames)//nprocs:(n+1)*len(frames)//nprocs] for n in range(nprocs)]
+    render = functools.partial(_render_chunk, animator=animator, kwargs=kwargs, 
+            outdir=outdir, prefix=prefix, figsize=figsize, dpi=dpi, init_kwargs=init_kwargs)
+    if nprocs > 1:
+        pool = multiprocessing.Pool(nprocs)
+        try:
+            results = pool.map(render, frame_ranges)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [render(frame_range) for frame_range in frame_ranges]
+    fnames = [fname for result in results for fname in result]
+    if movie is not None:
+        make_movie(fnames, movie, framerate=framerate)
+    return fnames
+
+
+def make_movie(fnames, movie, framerate=10):
+    """Assemble numbered PNG files into `movie` with ffmpeg
+
+    Returns True on success, False if ffmpeg is not available.
+    """
+    try:
+        ffmpeg = shutil.which('ffmpeg')
+    except AttributeError:
+        from distutils.spawn import find_executable
+        ffmpeg = find_executable('ffmpeg')
+    if ffmpeg is None:
+        print('ffmpeg not found, frames are kept in {}'.format(os.path.dirname(fnames[0])))
+        return False
+    listfile = movie + '.frames.txt'
+    with open(listfile, 'w') as f:
+        for fname in fnames:
+            f.write("file '{}'\nduration {}\n".format(os.path.abspath(fname), 1./framerate))
+    try:
+        subprocess.check_call([ffmpeg, '-y', '-loglevel', 'error', '-f', 'concat', '-safe', '0', 
+            '-i', listfile, '-r', str(framerate), '-pix_fmt', 'yuv420p', 
+            '-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2', movie])
+    finally:
+        os.remove(listfile)
+    return True
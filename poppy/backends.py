@@ -0,0 +1,400 @@
+"""
+Read backends for POP history files
+
+All backends present a file through the same small interface:
+
+    >>> with open_file(fname, backend='h5py') as f:
+    ...     f.variables['MOC'].shape, f.attributes('MOC')['units']
+    ...     moc = f.read('MOC', (0, 1, 0, slice(10, 40)), out=buf)
+
+`read` returns a plain ndarray (missing values of floating point variables
+are NaN, no masked arrays) and fills the caller-owned buffer `out` if one
+is given. `f.variables[name][index]` does the same and lets backend files
+stand in for a netCDF4.Dataset wherever poppy reads `ds.variables`.
+
+Backends
+--------
+netcdf4 : netCDF4-python (any netCDF format)
+xarray : xarray, decoding disabled (any format xarray can open)
+h5py : h5py on netCDF-4/HDF5 files; hyperslabs are read with `read_direct`
+    straight into the output buffer, without intermediate copies
+h5py-threads : h5py, decompressing the chunks of a hyperslab in parallel
+    threads (see `poppy.decompress`)
+
+Open files are pooled per backend (see `poppy.ncpool`), so `dataset`
+reuses handles across calls.
+"""
+import numpy as np
+import netCDF4
+
+from .lazy import LazyModule
+from . import ncpool
+from . import chunks
+from . import decompress
+from .chunks import normalize_index, index_shape
+
+h5py = LazyModule('h5py')
+xr = LazyModule('xarray')
+
+default_backend = 'netcdf4'
+
+# attributes netCDF-4 uses internally in the HDF5 file
+_hdf5_internal_attrs = set(['DIMENSION_LIST', 'REFERENCE_LIST', 'CLASS', 'NAME',
+    '_Netcdf4Dimid', '_Netcdf4Coordinates', '_nc3_strict', '_NCProperties'])
+
+
+def _fill_missing(data, fillvalues):
+    """Replace `fillvalues` in floating point `data` by NaN, in place"""
+    if data.dtype.kind == 'f':
+        for fv in fillvalues:
+            data[data == np.asarray(fv).astype(data.dtype)] = np.nan
+    return data
+
+
+def filled(a, value):
+    """Fill masked values and NaN (missing values of backend reads) with `value`"""
+    a = np.ma.filled(a, value)
+    if a.dtype.kind == 'f':
+        a[np.isnan(a)] = value
+    return a
+
+
+def fill0(a):
+    """Fill missing values (masked or NaN) with 0"""
+    return filled(a, 0.)
+
+
+def _to_out(data, out):
+    if out is None:
+        return data
+    out[...] = data
+    return out
+
+
+class BackendVariable:
+    """Variable of a backend file, indexable like a netCDF4.Variable"""
+    def __init__(self, f, name, shape, dtype, dimensions):
+        self._file = f
+        self.name = name
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.dimensions = tuple(dimensions)
+        self.ndim = len(self.shape)
+
+    def __repr__(self):
+        return '<{} variable {} {}>'.format(type(self._file).__name__, self.name, self.shape)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, index):
+        return self._file.read(self.name, index)
+
+    def read(self, index=Ellipsis, out=None):
+        return self._file.read(self.name, index, out=out)
+
+    def chunking(self):
+        """Chunk shape as list, 'contiguous' if not chunked (like netCDF4.Variable)"""
+        return self._file.chunking(self.name)
+
+    def get_var_chunk_cache(self):
+        """(size, nelems, preemption) of the chunk cache"""
+        return self._file.get_chunk_cache(self.name)
+
+    def set_var_chunk_cache(self, size=None, nelems=None, preemption=None):
+        self._file.set_chunk_cache(self.name, size=size, nelems=nelems, preemption=preemption)
+
+    def ncattrs(self):
+        return list(self._file.attributes(self.name))
+
+    def __getattr__(self, attr):
+        # netCDF attributes (units, calendar, long_name, ...)
+        if attr.startswith('_'):
+            raise AttributeError(attr)
+        try:
+            return self._file.attributes(self.name)[attr]
+        except KeyError:
+            raise AttributeError(attr)
+
+
+class BackendFile:
+    """Open file of a read backend
+
+    Subclasses set `variables` (dict name -> BackendVariable) and
+    implement `read`, `attributes` and `close`.
+    """
+    name = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __repr__(self):
+        return '<{} {}>'.format(type(self).__name__, self.fname)
+
+    def read(self, varn, index=Ellipsis, out=None):
+        """Hyperslab `index` of variable `varn` as ndarray (in `out` if given)"""
+        raise NotImplementedError
+
+    def attributes(self, varn=None):
+        """dict of the attributes of variable `varn` (global attributes if None)"""
+        raise NotImplementedError
+
+    def chunking(self, varn):
+        """Chunk shape of `varn` as list, 'contiguous' if not chunked"""
+        return 'contiguous'
+
+    def get_chunk_cache(self, varn):
+        """(size, nelems, preemption) of the chunk cache of `varn`"""
+        return (0, 0, 0.)
+
+    def set_chunk_cache(self, varn, size=None, nelems=None, preemption=None):
+        """Resize the chunk cache of `varn` (no-op if the backend has none)"""
+        pass
+
+    def close(self):
+        raise NotImplementedError
+
+
+class Netcdf4File(BackendFile):
+    """netCDF4-python backend"""
+    name = 'netcdf4'
+
+    def __init__(self, fname):
+        self.fname = fname
+        self._ds = ncpool.open_dataset(fname)
+        self.dimensions = dict((name, len(dim)) for name, dim in self._ds.dimensions.items())
+        self.variables = dict((name, BackendVariable(self, name, var.shape, var.dtype, var.dimensions))
+                for name, var in self._ds.variables.items())
+
+    def read(self, varn, index=Ellipsis, out=None):
+        chunks.stats.record(self.variables[varn], index)
+        with ncpool.netcdf_lock:
+            data = self._ds.variables[varn][index]
+        if np.ma.isMaskedArray(data):
+            if data.dtype.kind == 'f':
+                data = data.filled(np.nan)
+            else:
+                data = data.filled()
+        return _to_out(np.asarray(data), out)
+
+    def attributes(self, varn=None):
+        obj = self._ds if varn is None else self._ds.variables[varn]
+        with ncpool.netcdf_lock:
+            return dict((attr, obj.getncattr(attr)) for attr in obj.ncattrs())
+
+    def chunking(self, varn):
+        with ncpool.netcdf_lock:
+            return self._ds.variables[varn].chunking() or 'contiguous'
+
+    def get_chunk_cache(self, varn):
+        try:
+            with ncpool.netcdf_lock:
+                return self._ds.variables[varn].get_var_chunk_cache()
+        except RuntimeError:
+            # netCDF-3 file
+            return (0, 0, 0.)
+
+    def set_chunk_cache(self, varn, size=None, nelems=None, preemption=None):
+        try:
+            with ncpool.netcdf_lock:
+                self._ds.variables[varn].set_var_chunk_cache(size=size, nelems=nelems, preemption=preemption)
+        except RuntimeError:
+            pass
+
+    def close(self):
+        with ncpool.netcdf_lock:
+            self._ds.close()
+
+
+class XarrayFile(BackendFile):
+    """xarray backend (values masked but not otherwise decoded)"""
+    name = 'xarray'
+
+    def __init__(self, fname):
+        self.fname = fname
+        self._ds = xr.open_dataset(fname, decode_times=False, decode_coords=False)
+        self.dimensions = dict(self._ds.sizes)
+        self.variables = dict((name, BackendVariable(self, name, var.shape, var.dtype, var.dims))
+                for name, var in self._ds.variables.items())
+
+    def read(self, varn, index=Ellipsis, out=None):
+        chunks.stats.record(self.variables[varn], index)
+        return _to_out(np.asarray(self._ds.variables[varn][index].values), out)
+
+    def chunking(self, varn):
+        return list(self._ds.variables[varn].encoding.get('chunksizes') or []) or 'contiguous'
+
+    def attributes(self, varn=None):
+        obj = self._ds if varn is None else self._ds.variables[varn]
+        attrs = dict(obj.attrs)
+        if varn is not None:
+            for attr in ['_FillValue', 'missing_value']:
+                if attr in obj.encoding:
+                    attrs[attr] = obj.encoding[attr]
+        return attrs
+
+    def close(self):
+        self._ds.close()
+
+
+def _decode_attr(value):
+    if isinstance(value, bytes):
+        return value.decode('utf-8')
+    if isinstance(value, np.ndarray) and value.size == 1 and value.dtype.kind != 'O':
+        return value[0]
+    return value
+
+
+class H5pyFile(BackendFile):
+    """h5py backend for netCDF-4 (HDF5) files, reading directly into the output buffer"""
+    name = 'h5py'
+    threads = 1
+
+    def __init__(self, fname, threads=None):
+        self.fname = fname
+        self.threads = threads or self.threads
+        self._f = h5py.File(fname, 'r')
+        self._attrs = {}
+        self._dsets = {}
+        self.dimensions = {}
+        self.variables = {}
+        for name, dset in self._f.items():
+            if not isinstance(dset, h5py.Dataset):
+                continue
+            if dset.attrs.get('CLASS') == b'DIMENSION_SCALE':
+                self.dimensions[name] = len(dset)
+                # dimension without coordinate variable
+                if str(_decode_attr(dset.attrs.get('NAME', b''))).startswith(
+                        'This is a netCDF dimension but not a netCDF variable'):
+                    continue
+                # coordinate variable, the scale of its own dimension
+                dims = [name]
+            else:
+                dims = [dim[0].name.lstrip('/') if len(dim) else 'dim{}'.format(i)
+                        for i, dim in enumerate(dset.dims)]
+            self.variables[name] = BackendVariable(self, name, dset.shape, dset.dtype, dims)
+
+    def attributes(self, varn=None):
+        if varn not in self._attrs:
+            obj = self._f if varn is None else self._dataset(varn)
+            self._attrs[varn] = dict((attr, _decode_attr(value)) for attr, value in obj.attrs.items()
+                    if attr not in _hdf5_internal_attrs)
+        return self._attrs[varn]
+
+    def _dataset(self, varn):
+        # keep the dataset open, so its chunk cache persists between reads
+        if varn not in self._dsets:
+            self._dsets[varn] = self._f[varn]
+        return self._dsets[varn]
+
+    def read(self, varn, index=Ellipsis, out=None):
+        dset = self._dataset(varn)
+        attrs = self.attributes(varn)
+        if dset.dtype.kind == 'S' or dset.ndim == 0:
+            return _to_out(dset[()][index], out)
+        nindex = normalize_index(index, dset.shape)
+        if nindex is None and any(isinstance(i, (list, np.ndarray))
+                for i in (index if isinstance(index, tuple) else (index,))):
+            # points along some axes: one hyperslab per chunk
+            return _to_out(chunks.read_aligned(self.variables[varn], index), out)
+        if nindex is None:
+            data = dset[index]
+            if out is None:
+                out = data.astype(np.promote_types(data.dtype, 'f4')) if 'scale_factor' in attrs else data
+            else:
+                out[...] = data
+        else:
+            chunks.stats.record(self.variables[varn], nindex)
+            shape = index_shape(nindex)
+            if out is None:
+                dtype = dset.dtype if 'scale_factor' not in attrs else np.promote_types(dset.dtype, 'f4')
+                out = np.empty(shape, dtype=dtype)
+            elif out.shape != shape:
+                raise ValueError('Output buffer has shape {}, selection has shape {}'.format(out.shape, shape))
+            if out.size:
+                # ints become length-1 slices in the source selection
+                source = tuple(slice(i, i+1, 1) if not isinstance(i, slice) else i for i in nindex)
+                sshape = index_shape(source)
+                if self.threads > 1 and decompress.supported(dset):
+                    decompress.read_hyperslab(dset, nindex, out, threads=self.threads)
+                elif out.flags.c_contiguous:
+                    dset.read_direct(out.reshape(sshape), source_sel=source)
+                else:
+                    tmp = np.empty(sshape, dtype=out.dtype)
+                    dset.read_direct(tmp, source_sel=source)
+                    out[...] = tmp.reshape(shape)
+        _fill_missing(out, [attrs[a] for a in ['_FillValue', 'missing_value'] if a in attrs])
+        if 'scale_factor' in attrs:
+            out *= attrs['scale_factor']
+        if 'add_offset' in attrs:
+            out += attrs['add_offset']
+        return out
+
+    def chunking(self, varn):
+        return list(self._dataset(varn).chunks or []) or 'contiguous'
+
+    def get_chunk_cache(self, varn):
+        nslots, nbytes, w0 = self._dataset(varn).id.get_access_plist().get_chunk_cache()
+        return (nbytes, nslots, w0)
+
+    def set_chunk_cache(self, varn, size=None, nelems=None, preemption=None):
+        # the chunk cache is a dataset access property: reopen the dataset
+        # (HDF5 shares the cache of a dataset that is still open)
+        nbytes, nslots, w0 = self.get_chunk_cache(varn)
+        self._dsets.pop(varn).id.close()
+        dapl = h5py.h5p.create(h5py.h5p.DATASET_ACCESS)
+        dapl.set_chunk_cache(nelems or nslots, size or nbytes, w0 if preemption is None else preemption)
+        self._dsets[varn] = h5py.Dataset(h5py.h5d.open(self._f.id, varn.encode('utf-8'), dapl=dapl))
+
+    def close(self):
+        self._dsets.clear()
+        self._f.close()
+
+
+class H5pyThreadedFile(H5pyFile):
+    """h5py backend decompressing chunks in parallel (`decompress.default_threads()` threads)"""
+    name = 'h5py-threads'
+
+    def __init__(self, fname, threads=None):
+        H5pyFile.__init__(self, fname, threads=threads or decompress.default_threads())
+
+
+backends = {
+    'netcdf4' : Netcdf4File,
+    'xarray' : XarrayFile,
+    'h5py' : H5pyFile,
+    'h5py-threads' : H5pyThreadedFile,
+    }
+
+
+def get_backend(backend=None):
+    """Backend class by name (default: `default_backend`)"""
+    backend = backend or default_backend
+    try:
+        return backends[backend]
+    except KeyError:
+        raise ValueError('Unknown backend {}. Choose from {}.'.format(backend, sorted(backends)))
+
+
+def open_file(fname, backend=None):
+    """Open `fname` with `backend` (not pooled, close it yourself)"""
+    return get_backend(backend)(fname)
+
+
+_pools = {}
+
+
+def get_pool(backend=None):
+    """Shared handle pool of `backend`"""
+    cls = get_backend(backend)
+    if cls.name not in _pools:
+        _pools[cls.name] = ncpool.HandlePool(opener=cls)
+    return _pools[cls.name]
+
+
+def dataset(fname, backend=None):
+    """Borrow `fname` opened with `backend` from the shared pool (context manager)"""
+    return get_pool(backend).borrow(fname)
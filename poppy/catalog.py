@@ -0,0 +1,290 @@
+"""
+Catalog of POP history files in a local SQLite database
+
+Scanning a history directory once records, for every file, the case and
+stream (parsed from CESM file names like <case>.pop.h.nday1.0300-01-01.nc),
+the time span, the variables with their dimensions and shapes, the grid,
+the size and modification time. Rescans only open new or modified files.
+
+    >>> with Catalog('hist.db') as cat:
+    ...     cat.scan('/data/ctrl/ocn/hist', nprocs=8)
+    ...     files = cat.query(case='ctrl', stream='h', yearlim=(300,400))
+
+Metrics accept a `Query` wherever they accept a list of files:
+
+    >>> metrics.get_amoc(Query('hist.db', case='ctrl', yearlim=(300,400)))
+"""
+from __future__ import print_function
+import os
+import re
+import glob
+import json
+import sqlite3
+import multiprocessing
+import numpy as np
+import netCDF4
+
+from . import utils
+
+filename_pattern = re.compile(
+        r'^(?P<case>.+)\.pop\.(?P<stream>h(?:\.[A-Za-z][A-Za-z0-9_]*)*)\.(?P<date>[0-9-]+)\.nc$')
+
+_schema = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    casename TEXT,
+    stream TEXT,
+    tstart REAL,
+    tend REAL,
+    ntime INTEGER,
+    grid TEXT,
+    dims TEXT,
+    size INTEGER,
+    mtime REAL
+);
+CREATE TABLE IF NOT EXISTS variables (
+    path TEXT,
+    name TEXT,
+    dims TEXT,
+    shape TEXT,
+    units TEXT,
+    long_name TEXT,
+    PRIMARY KEY (path, name)
+);
+CREATE INDEX IF NOT EXISTS files_case_time ON files (casename, stream, tstart);
+CREATE INDEX IF NOT EXISTS variables_name ON variables (name);
+"""
+
+
+def parse_filename(fname):
+    """(case, stream) from a CESM POP history file name, (None, None) if it does not match"""
+    match = filename_pattern.match(os.path.basename(fname))
+    if match is None:
+        return None, None
+    return match.group('case'), match.group('stream')
+
+
+def scan_file(fname):
+    """Metadata of one history file
+
+    Returns
+    -------
+    dict(path, casename, stream, tstart, tend, ntime, grid, dims, size, mtime, variables)
+    where `variables` is a list of (name, dims, shape, units, long_name)
+    and `tstart`, `tend` are the starts (decimal years) of the first and
+    last time-averaging periods
+    """
+    stat = os.stat(fname)
+    casename, stream = parse_filename(fname)
+    info = dict(path=os.path.abspath(fname), casename=casename, stream=stream,
+            size=stat.st_size, mtime=stat.st_mtime, tstart=None, tend=None, ntime=0, grid=None)
+    with netCDF4.Dataset(fname) as ds:
+        dsvar = ds.variables
+        info['dims'] = json.dumps({name : len(dim) for name, dim in ds.dimensions.items()})
+        if 'time' in dsvar and len(dsvar['time']):
+            timevar = dsvar['time']
+            # POP stamps averages at the end of their period, so the
+            # starts of the periods are indexed (from the time bounds)
+            bounds = getattr(timevar, 'bounds', 'time_bound')
+            if bounds in dsvar:
+                timeax = np.atleast_1d(utils.time_to_decimal_year(
+                    dsvar[bounds][:, 0], timevar.units, getattr(timevar, 'calendar', 'standard')))
+            else:
+                timeax = np.atleast_1d(utils.get_time_decimal_year(timevar))
+            info.update(tstart=float(timeax[0]), tend=float(timeax[-1]), ntime=len(timeax))
+        if 'nlat' in ds.dimensions and 'nlon' in ds.dimensions:
+            info['grid'] = '{}x{}'.format(len(ds.dimensions['nlat']), len(ds.dimensions['nlon']))
+        info['variables'] = [(name, json.dumps(var.dimensions), json.dumps(var.shape),
+            getattr(var, 'units', ''), getattr(var, 'long_name', ''))
+            for name, var in dsvar.items()]
+    return info
+
+
+def _scan_file(fname):
+    try:
+        return scan_file(fname)
+    except (IOError, OSError, RuntimeError) as err:
+        print('Warning: Unable to scan {}: {}'.format(fname, err))
+        return None
+
+
+class Catalog:
+    """SQLite catalog of history files"""
+    def __init__(self, dbfile):
+        self.dbfile = dbfile
+        self.conn = sqlite3.connect(dbfile)
+        self.conn.executescript(_schema)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.conn.close()
+
+    def __len__(self):
+        return self.conn.execute('SELECT COUNT(*) FROM files').fetchone()[0]
+
+    def scan(self, paths, pattern='*.nc', case=None, nprocs=1, prune=True):
+        """Add new and modified files to the catalog
+
+        Parameters
+        ----------
+        paths : str or list of str
+            directories (searched for `pattern`), files or glob patterns
+        pattern : str
+            file name pattern within directories
+        case : str, optional
+            case name for files whose names do not follow the CESM convention
+        nprocs : int
+            number of processes opening files
+        prune : bool
+            remove cataloged files within the scanned directories that no longer exist
+
+        Returns
+        -------
+        number of files (re)scanned, number of files removed
+        """
+        if isinstance(paths, str):
+            paths = [paths]
+        fnames = []
+        dirs = []
+        for path in paths:
+            if os.path.isdir(path):
+                dirs.append(os.path.abspath(path))
+                fnames += glob.glob(os.path.join(path, pattern))
+            else:
+                fnames += glob.glob(path)
+        fnames = sorted(set(os.path.abspath(f) for f in fnames))
+        known = dict((row[0], (row[1], row[2])) for row in
+                self.conn.execute('SELECT path, size, mtime FROM files'))
+        todo = []
+        for fname in fnames:
+            stat = os.stat(fname)
+            if known.get(fname) != (stat.st_size, stat.st_mtime):
+                todo.append(fname)
+        if nprocs > 1 and len(todo) > 1:
+            pool = multiprocessing.Pool(min(nprocs, len(todo)))
+            try:
+                infos = pool.map(_scan_file, todo, chunksize=max(1, len(todo)//(4*nprocs)))
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            infos = [_scan_file(fname) for fname in todo]
+        removed = []
+        if prune:
+            present = set(fnames)
+            removed = [path for path in known if path not in present
+                    and os.path.dirname(path) in dirs]
+        with self.conn:
+            for info in infos:
+                if info is None:
+                    continue
+                if info['casename'] is None:
+                    info['casename'] = case
+                self._remove(info['path'])
+                variables = info.pop('variables')
+                keys = sorted(info)
+                self.conn.execute('INSERT INTO files ({}) VALUES ({})'.format(
+                    ', '.join(keys), ', '.join('?'*len(keys))), [info[k] for k in keys])
+                self.conn.executemany('INSERT INTO variables VALUES (?, ?, ?, ?, ?, ?)',
+                        [(info['path'],) + tuple(v) for v in variables])
+            for path in removed:
+                self._remove(path)
+        return len([info for info in infos if info is not None]), len(removed)
+
+    def _remove(self, path):
+        self.conn.execute('DELETE FROM files WHERE path = ?', (path,))
+        self.conn.execute('DELETE FROM variables WHERE path = ?', (path,))
+
+    def query(self, case=None, stream=None, yearlim=None, variables=None, grid=None):
+        """Files matching all criteria, sorted by time
+
+        Parameters
+        ----------
+        case : str, optional
+            case name
+        stream : str, optional
+            history stream, e.g. 'h' or 'h.nday1'
+        yearlim : tuple, optional
+            (first, last) model year; files with averaging periods starting
+            within [first, last+1) are selected, either may be None
+        variables : list of str, optional
+            variables that must be present
+        grid : str, optional
+            grid ('nlatxnlon')
+        """
+        clauses = []
+        args = []
+        for column, value in [('casename', case), ('stream', stream), ('grid', grid)]:
+            if value is not None:
+                clauses.append('{} = ?'.format(column))
+                args.append(value)
+        if yearlim is not None:
+            if yearlim[0] is not None:
+                clauses.append('tend >= ?')
+                args.append(float(yearlim[0]))
+            if yearlim[1] is not None:
+                clauses.append('tstart < ?')
+                args.append(float(yearlim[1]) + 1)
+        for varn in (variables or []):
+            clauses.append('path IN (SELECT path FROM variables WHERE name = ?)')
+            args.append(varn)
+        sql = 'SELECT path FROM files'
+        if clauses:
+            sql += ' WHERE ' + ' AND '.join(clauses)
+        sql += ' ORDER BY tstart, path'
+        return [row[0] for row in self.conn.execute(sql, args)]
+
+    def info(self, path):
+        """Cataloged metadata of `path` (as returned by `scan_file`)"""
+        cursor = self.conn.execute('SELECT * FROM files WHERE path = ?', (os.path.abspath(path),))
+        row = cursor.fetchone()
+        if row is None:
+            raise KeyError(path)
+        info = dict(zip([d[0] for d in cursor.description], row))
+        info['dims'] = json.loads(info['dims'])
+        info['variables'] = {name : dict(dims=tuple(json.loads(dims)), shape=tuple(json.loads(shape)),
+            units=units, long_name=long_name) for name, dims, shape, units, long_name in
+            self.conn.execute('SELECT name, dims, shape, units, long_name FROM variables WHERE path = ?',
+                (info['path'],))}
+        return info
+
+    def cases(self):
+        """(case, stream, number of files, first year, last year) of all cataloged cases"""
+        return self.conn.execute('SELECT casename, stream, COUNT(*), MIN(tstart), MAX(tend) '
+                'FROM files GROUP BY casename, stream ORDER BY casename, stream').fetchall()
+
+
+class Query:
+    """Deferred catalog query, accepted by metrics instead of a list of files"""
+    def __init__(self, dbfile, **criteria):
+        """
+        Parameters
+        ----------
+        dbfile : str
+            catalog database
+        criteria : dict
+            see `Catalog.query`
+        """
+        self.dbfile = dbfile
+        self.criteria = criteria
+
+    def __repr__(self):
+        return 'Query({!r}, {})'.format(self.dbfile, self.criteria)
+
+    def files(self):
+        with Catalog(self.dbfile) as cat:
+            return cat.query(**self.criteria)
+
+
+def resolve_files(ncfiles):
+    """List of files from a list, a glob pattern or a `Query`"""
+    if isinstance(ncfiles, Query):
+        return ncfiles.files()
+    if isinstance(ncfiles, str):
+        return sorted(glob.glob(ncfiles))
+    return list(ncfiles)
@@ -0,0 +1,337 @@
+"""
+Chunk-aware reading of compressed netCDF-4 variables
+
+POP history files are written with chunk shapes that rarely match how
+poppy reads them (level by level in `stream_functions`, column sections
+in `animators.VerticalSection`). Every chunk touched by a read is
+decompressed in full, so misaligned reads decompress the same chunk many
+times unless it stays in the chunk cache. This module
+
+- inspects the chunking of a variable (`get_chunking`),
+- splits level loops into chunk-aligned blocks (`level_blocks`),
+- reads integer-array (section) indices as one hyperslab per chunk
+  (`read_aligned`),
+- sizes per-variable chunk caches to the working set of a read
+  (`tune_cache`), and
+- records bytes requested vs bytes decompressed (`stats`):
+
+    >>> chunks.stats.enabled = True
+    >>> zax, latax, latlim, psi = get_vertical_stream_function(ds)
+    >>> print(chunks.stats.report())
+
+Variables may be netCDF4.Variable or `poppy.backends.BackendVariable`;
+anything else (e.g. xarray) is treated as unchunked.
+"""
+import itertools
+import collections
+import numpy as np
+import netCDF4
+
+# largest block of levels read at once, and largest chunk cache set by `tune_cache`
+max_block_bytes = 256 * 2**20
+max_cache_bytes = 1024 * 2**20
+
+
+def expand_index(index, ndim):
+    """`index` as tuple of length `ndim`, with Ellipsis expanded (None if invalid)"""
+    if not isinstance(index, tuple):
+        index = (index,)
+    ellipsis = [e for e, i in enumerate(index) if i is Ellipsis]
+    if len(ellipsis) > 1:
+        return None
+    if ellipsis:
+        e = ellipsis[0]
+        index = index[:e] + (slice(None),)*(ndim - len(index) + 1) + index[e+1:]
+    if len(index) > ndim:
+        return None
+    return index + (slice(None),)*(ndim - len(index))
+
+
+def normalize_index(index, shape):
+    """Full-length tuple of ints and slices for `index`, None if `index` is not a hyperslab
+
+    Ints are made non-negative and slices get explicit (start, stop, step>0).
+    """
+    index = expand_index(index, len(shape))
+    if index is None:
+        return None
+    normalized = []
+    for i, n in zip(index, shape):
+        if isinstance(i, slice):
+            start, stop, step = i.indices(n)
+            if step < 1:
+                return None
+            normalized.append(slice(start, max(start, stop), step))
+        elif isinstance(i, (int, np.integer)):
+            if not -n <= i < n:
+                raise IndexError('index {} is out of bounds for axis with size {}'.format(i, n))
+            normalized.append(int(i) % n)
+        else:
+            return None
+    return tuple(normalized)
+
+
+def index_shape(index):
+    """Shape of the result of a normalized index (ints drop their axis)"""
+    return tuple(len(range(i.start, i.stop, i.step)) for i in index if isinstance(i, slice))
+
+
+def _axis_elements(index, shape):
+    """Elements selected along each axis by an (outer) index"""
+    elements = []
+    for i, n in zip(expand_index(index, len(shape)), shape):
+        if isinstance(i, slice):
+            elements.append(np.arange(*i.indices(n)))
+        elif isinstance(i, (int, np.integer)):
+            elements.append(np.array([i % n]))
+        else:
+            i = np.asarray(i)
+            if i.dtype == bool:
+                i = np.flatnonzero(i)
+            elements.append(np.unique(i % n))
+    return elements
+
+
+def get_chunking(var):
+    """Chunk shape of `var`, None if it is contiguous or not a netCDF-4 variable"""
+    try:
+        chunking = var.chunking()
+    except (AttributeError, RuntimeError):
+        return None
+    if chunking is None or chunking == 'contiguous':
+        return None
+    return tuple(int(c) for c in chunking)
+
+
+def touched_chunks(var, index):
+    """Chunks touched by reading `index` from `var`
+
+    Returns
+    -------
+    list of (chunk coordinates, uncompressed bytes of the chunk),
+    None if `var` is not chunked
+    """
+    chunks = get_chunking(var)
+    if chunks is None:
+        return None
+    shape = var.shape
+    itemsize = np.dtype(var.dtype).itemsize
+    ids = [np.unique(e // c) for e, c in zip(_axis_elements(index, shape), chunks)]
+    touched = []
+    for coord in itertools.product(*ids):
+        nbytes = itemsize
+        for ci, c, n in zip(coord, chunks, shape):
+            nbytes *= min(c, n - ci*c)
+        touched.append((coord, nbytes))
+    return touched
+
+
+def requested_bytes(var, index):
+    """Bytes of the result of reading `index` from `var`"""
+    nitems = 1
+    for e in _axis_elements(index, var.shape):
+        nitems *= len(e)
+    return nitems * np.dtype(var.dtype).itemsize
+
+
+def tune_cache(var, index, maxbytes=None):
+    """Enlarge the chunk cache of `var` to hold all chunks touched by reading `index`
+
+    The cache is never shrunk and never set above `maxbytes`
+    (default `max_cache_bytes`). Returns the resulting cache size in bytes
+    (0 if `var` has no chunk cache).
+    """
+    touched = touched_chunks(var, index)
+    if touched is None:
+        return 0
+    try:
+        size, nelems, preemption = var.get_var_chunk_cache()
+    except (AttributeError, RuntimeError):
+        return 0
+    working_set = sum(nbytes for _, nbytes in touched)
+    wanted = min(working_set, maxbytes or max_cache_bytes)
+    if wanted > size:
+        # more hash slots than chunks, as recommended by HDF5
+        nelems = max(nelems, 4*len(touched) + 1)
+        var.set_var_chunk_cache(size=int(wanted), nelems=int(nelems), preemption=preemption)
+        return int(wanted)
+    return int(size)
+
+
+def level_blocks(var, kza, kzo, axis=1, maxbytes=None, tune=True):
+    """Chunk-aligned ranges [k0, k1) of levels covering range(kza, kzo)
+
+    Levels that share a chunk are read together, as long as a block stays
+    below `maxbytes` (default `max_block_bytes`). Otherwise single levels
+    are returned and (if `tune`) the chunk cache of `var` is sized to keep
+    the chunks of one level read, so that the next levels hit the cache.
+    """
+    chunks = get_chunking(var)
+    if chunks is None or chunks[axis] == 1:
+        return [(k, k+1) for k in range(kza, kzo)]
+    c = chunks[axis]
+    level_bytes = np.dtype(var.dtype).itemsize
+    for n in var.shape[axis+1:]:
+        level_bytes *= n
+    if c * level_bytes > (maxbytes or max_block_bytes):
+        if tune:
+            tune_cache(var, (0,)*axis + (kza,))
+        return [(k, k+1) for k in range(kza, kzo)]
+    blocks = []
+    k0 = kza
+    while k0 < kzo:
+        k1 = min(kzo, (k0 // c + 1) * c)
+        blocks.append((k0, k1))
+        k0 = k1
+    return blocks
+
+
+def read(var, index):
+    """var[index], recorded in `stats` (backend variables record their own reads)"""
+    if isinstance(var, netCDF4.Variable):
+        stats.record(var, index)
+    return var[index]
+
+
+def read_aligned(var, index):
+    """Read an outer index with integer arrays as one hyperslab per chunk
+
+    Integer-array (or boolean) entries of `index` select points along their
+    axis like netCDF4 outer indexing (e.g. the columns of a section). The
+    points are grouped by chunk and every group is read as one slice, so
+    every chunk is read (and decompressed) once instead of once per point.
+    The result has the order of the requested points.
+    """
+    index = expand_index(index, len(var.shape))
+    arrays = [d for d, i in enumerate(index)
+            if not isinstance(i, (slice, int, np.integer))]
+    if not arrays:
+        return read(var, index)
+    chunks = get_chunking(var) or var.shape
+    groups = []
+    points = {}
+    for d in arrays:
+        a = np.asarray(index[d])
+        if a.dtype == bool:
+            a = np.flatnonzero(a)
+        a = a % var.shape[d]
+        points[d] = a
+        uniq = np.unique(a)
+        groups.append(np.split(uniq, np.flatnonzero(np.diff(uniq // chunks[d])) + 1))
+    # position of every axis of `index` in the result
+    outdims = {}
+    shape = []
+    for d, i in enumerate(index):
+        if isinstance(i, slice):
+            outdims[d] = len(shape)
+            shape.append(len(range(*i.indices(var.shape[d]))))
+        elif d in points:
+            outdims[d] = len(shape)
+            shape.append(len(points[d]))
+    result = None
+    mask = None
+    for combination in itertools.product(*groups):
+        block_index = list(index)
+        outpos = []
+        for d, group in zip(arrays, combination):
+            block_index[d] = slice(group[0], group[-1] + 1)
+        block = read(var, tuple(block_index))
+        for d, group in zip(arrays, combination):
+            pos = np.flatnonzero(np.isin(points[d], group))
+            block = np.take(block, points[d][pos] - group[0], axis=outdims[d])
+            outpos.append(pos)
+        if result is None:
+            result = np.empty(shape, dtype=block.dtype)
+        if np.ma.isMaskedArray(block) and mask is None:
+            mask = np.zeros(shape, dtype=bool)
+        target = [outdims[d] for d in arrays]
+        ends = list(range(-len(arrays), 0))
+        sel = (Ellipsis,) + np.ix_(*outpos)
+        np.moveaxis(result, target, ends)[sel] = np.moveaxis(np.ma.getdata(block), target, ends)
+        if mask is not None:
+            np.moveaxis(mask, target, ends)[sel] = np.moveaxis(np.ma.getmaskarray(block), target, ends)
+    if mask is not None:
+        return np.ma.array(result, mask=mask)
+    return result
+
+
+class _CacheModel:
+    """LRU model of a chunk cache, to tell chunk cache hits from decompressions"""
+    def __init__(self, nbytes):
+        self.nbytes = nbytes
+        self.used = 0
+        self.chunks = collections.OrderedDict()
+
+    def access(self, coord, nbytes):
+        """Whether chunk `coord` had to be decompressed"""
+        if coord in self.chunks:
+            self.chunks[coord] = self.chunks.pop(coord)
+            return False
+        if nbytes <= self.nbytes:
+            self.chunks[coord] = nbytes
+            self.used += nbytes
+            while self.used > self.nbytes:
+                self.used -= self.chunks.popitem(last=False)[1]
+        return True
+
+
+class ReadStats:
+    """Bytes requested vs bytes decompressed by reads, per variable
+
+    Decompressed bytes are the uncompressed sizes of the chunks touched
+    that are not in the (modelled) chunk cache of the variable. Reads of
+    unchunked variables count their requested bytes.
+    """
+    def __init__(self):
+        self.enabled = False
+        self.reset()
+
+    def reset(self):
+        self.variables = collections.OrderedDict()  # name -> [reads, requested, decompressed, chunks]
+        self._caches = {}
+
+    def record(self, var, index, name=None):
+        if not self.enabled:
+            return
+        name = name or getattr(var, 'name', '?')
+        requested = requested_bytes(var, index)
+        touched = touched_chunks(var, index)
+        if touched is None:
+            decompressed, nchunks = requested, 0
+        else:
+            try:
+                cachesize = var.get_var_chunk_cache()[0]
+            except (AttributeError, RuntimeError):
+                cachesize = 0
+            key = id(var)
+            if key not in self._caches or self._caches[key].nbytes != cachesize:
+                self._caches[key] = _CacheModel(cachesize)
+            decompressed = 0
+            nchunks = 0
+            for coord, nbytes in touched:
+                if self._caches[key].access(coord, nbytes):
+                    decompressed += nbytes
+                    nchunks += 1
+        entry = self.variables.setdefault(name, [0, 0, 0, 0])
+        entry[0] += 1
+        entry[1] += requested
+        entry[2] += decompressed
+        entry[3] += nchunks
+
+    def totals(self):
+        """(reads, bytes requested, bytes decompressed, chunks decompressed) of all variables"""
+        return tuple(sum(entry[i] for entry in self.variables.values()) for i in range(4))
+
+    def report(self):
+        """Table of reads, MB requested, MB decompressed and their ratio per variable"""
+        lines = ['{:<16s} {:>8s} {:>14s} {:>16s} {:>8s} {:>8s}'.format(
+            'variable', 'reads', 'requested MB', 'decompressed MB', 'ratio', 'chunks')]
+        rows = list(self.variables.items()) + [('total', self.totals())]
+        for name, (nreads, requested, decompressed, nchunks) in rows:
+            lines.append('{:<16s} {:>8d} {:>14.1f} {:>16.1f} {:>8.2f} {:>8d}'.format(
+                name, nreads, requested/1e6, decompressed/1e6,
+                decompressed/float(requested) if requested else 0., nchunks))
+        return '\n'.join(lines)
+
+
+stats = ReadStats()
@@ -0,0 +1,69 @@
+"""
+Colormaps bundled with poppy
+
+The colormaps are read from GMT color palette tables (.cpt) in
+`poppy/data` and registered with matplotlib (with reversed versions)
+on the first call of `register_cmaps`, e.g. 'GMT_ocean' and 'GMT_ocean_r'.
+"""
+import os
+import numpy as np
+
+datadir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+cptfiles = {
+    'GMT_ocean' : os.path.join(datadir, 'GMT_ocean.cpt'),
+    }
+
+_registered = False
+
+
+def read_cpt(fname):
+    """Read a continuous RGB GMT color palette table
+
+    Returns
+    -------
+    positions : ndarray
+        normalized (0..1) positions of the colors
+    colors : ndarray (n, 3)
+        RGB colors (0..1) at the positions
+    """
+    positions = []
+    colors = []
+    with open(fname) as f:
+        for line in f:
+            fields = line.split()
+            if not fields or fields[0].startswith('#') or fields[0] in 'BFN':
+                continue
+            z0, r0, g0, b0, z1, r1, g1, b1 = map(float, fields[:8])
+            positions += [z0, z1]
+            colors += [(r0, g0, b0), (r1, g1, b1)]
+    positions = np.array(positions)
+    positions = (positions - positions[0]) / (positions[-1] - positions[0])
+    return positions, np.array(colors) / 255.
+
+
+def get_cmap(name):
+    """Bundled colormap `name` (e.g. 'GMT_ocean' or 'GMT_ocean_r')"""
+    import matplotlib.colors as mcolors
+    reverse = name.endswith('_r')
+    positions, colors = read_cpt(cptfiles[name[:-2] if reverse else name])
+    cmap = mcolors.LinearSegmentedColormap.from_list(name[:-2] if reverse else name, 
+            list(zip(positions, colors)))
+    return cmap.reversed() if reverse else cmap
+
+
+def register_cmaps():
+    """Register the bundled colormaps with matplotlib (once)"""
+    global _registered
+    if _registered:
+        return
+    import matplotlib
+    for name in cptfiles:
+        for cmapname in [name, name + '_r']:
+            cmap = get_cmap(cmapname)
+            try:
+                matplotlib.colormaps.register(cmap, name=cmapname, force=True)
+            except AttributeError:
+                import matplotlib.cm
+                matplotlib.cm.register_cmap(name=cmapname, cmap=cmap)
+    _registered = True
@@ -0,0 +1,91 @@
+"""
+Level-of-detail reduction of 2D fields for plotting
+
+High-resolution fields (e.g. 3600x2400 on tx0.1) have many more cells than
+a figure has pixels. `BlockReducer` reduces a field by integer factors
+with NaN-aware block statistics; the block layout is set up once for a
+given field shape and reused for every frame.
+
+    >>> factor = get_factor((2400, 3600), (600, 800))
+    >>> reduce = BlockReducer((2400, 3600), factor, how='mean')
+    >>> coarse = reduce(data)
+"""
+import warnings
+import numpy as np
+
+methods = ['mean', 'max', 'min']
+
+
+def get_factor(shape, npixels):
+    """Integer reduction factors (fy, fx) that bring `shape` down to at most `npixels`
+
+    Parameters
+    ----------
+    shape : tuple
+        (ny, nx) of the field
+    npixels : int or tuple
+        target (ny, nx) in pixels
+    """
+    npixels = np.broadcast_to(npixels, 2)
+    return tuple(max(1, int(np.ceil(float(n) / max(npix, 1)))) for n, npix in zip(shape, npixels))
+
+
+def coarse_edges(edges, factor, n):
+    """Cell edges (or centres) of the reduced grid along one axis
+
+    Parameters
+    ----------
+    edges : ndarray
+        cell edges (length n+1) or coordinates (length n) of the full grid
+    factor : int
+        reduction factor
+    n : int
+        number of cells in the full grid
+    """
+    edges = np.asarray(edges)
+    if len(edges) == n + 1:
+        # last block may be narrower
+        return np.append(edges[:-1][::factor], edges[-1])
+    return edges[::factor]
+
+
+class BlockReducer:
+    """Reduce 2D fields by integer factors with NaN-aware block statistics"""
+    def __init__(self, shape, factor, how='mean'):
+        """
+        Parameters
+        ----------
+        shape : tuple
+            (ny, nx) of the fields to reduce
+        factor : int or tuple
+            reduction factor (fy, fx)
+        how : str
+            block statistic ('mean', 'max' or 'min'); masked and NaN cells
+            are ignored, blocks without valid cells are masked
+        """
+        if how not in methods:
+            raise ValueError('Unknown block statistic {}. Choose from {}.'.format(how, methods))
+        self.shape = tuple(shape)
+        self.factor = fy, fx = tuple(np.broadcast_to(factor, 2).astype(int))
+        self.how = how
+        ny, nx = self.shape
+        self.coarse_shape = nby, nbx = (-(-ny // fy), -(-nx // fx))
+        self.pad = ((0, nby*fy - ny), (0, nbx*fx - nx))
+        self._func = dict(mean=np.nanmean, max=np.nanmax, min=np.nanmin)[how]
+
+    def __call__(self, data):
+        """Reduce `data` (the last two dimensions must match `shape`)"""
+        if self.factor == (1, 1):
+            return data
+        data = np.ma.filled(np.ma.asarray(data, dtype='f8'), np.nan)
+        lead = data.shape[:-2]
+        if any(p[1] for p in self.pad):
+            data = np.pad(data, ((0, 0),)*len(lead) + self.pad, mode='constant', constant_values=np.nan)
+        nby, nbx = self.coarse_shape
+        fy, fx = self.factor
+        blocks = data.reshape(lead + (nby, fy, nbx, fx))
+        with warnings.catch_warnings():
+            # blocks without valid cells (land)
+            warnings.simplefilter('ignore', RuntimeWarning)
+            reduced = self._func(blocks, axis=(-3, -1))
+        return np.ma.masked_invalid(reduced)
@@ -0,0 +1,167 @@
+"""
+Parallel decompression of chunked netCDF-4 (HDF5) variables
+
+HDF5 inflates the chunks of a read one after the other on a single core,
+so a large zlib-compressed 3D read is CPU-bound. `read_hyperslab` fetches
+the raw chunks touched by a hyperslab with h5py's `read_direct_chunk`,
+undoes the shuffle and deflate filters in a pool of threads (zlib
+releases the GIL while inflating) and copies every chunk into its part of
+one output buffer:
+
+    >>> with h5py.File(fname, 'r') as f:
+    ...     temp = decompress.read_hyperslab(f['TEMP'], (0, slice(None)), threads=8)
+
+The `h5py-threads` read backend (see `poppy.backends`) reads all
+hyperslabs this way, e.g. for `ts_flux_budget` or `stream_functions`:
+
+    >>> with backends.dataset(fname, 'h5py-threads') as ds:
+    ...     zax, latax, latlim, psi = get_vertical_stream_function(ds)
+
+Only datasets filtered with shuffle and/or deflate are supported (see
+`supported`); the raw chunks bypass the HDF5 chunk cache.
+"""
+import os
+import zlib
+import itertools
+import threading
+import multiprocessing
+import multiprocessing.pool
+import numpy as np
+
+from .chunks import normalize_index, index_shape
+
+# HDF5 filter identifiers
+FILTER_DEFLATE = 1
+FILTER_SHUFFLE = 2
+
+# number of threads used by default (None: number of CPUs)
+threads = None
+
+
+def default_threads():
+    """`threads` if set, else the number of CPUs"""
+    if threads:
+        return threads
+    try:
+        return multiprocessing.cpu_count()
+    except NotImplementedError:
+        return 1
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(nthreads):
+    """Thread pool with `nthreads` workers, shared per process"""
+    key = (os.getpid(), nthreads)
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = multiprocessing.pool.ThreadPool(nthreads)
+        return _pools[key]
+
+
+def get_filters(dset):
+    """Filter identifiers of the filter pipeline of `dset`, in the order applied on write"""
+    plist = dset.id.get_create_plist()
+    return [plist.get_filter(i)[0] for i in range(plist.get_nfilters())]
+
+
+def supported(dset):
+    """Whether the chunks of `dset` can be decompressed by this module"""
+    return (dset.chunks is not None
+            and dset.dtype.kind in 'iuf'
+            and set(get_filters(dset)) <= set([FILTER_DEFLATE, FILTER_SHUFFLE]))
+
+
+def _axis_pieces(sl, size):
+    """(chunk start, slice within chunk, slice of output) for all chunks of size `size` touched by `sl`"""
+    start, stop, step = sl.start, sl.stop, sl.step
+    pieces = []
+    if stop <= start:
+        return pieces
+    last = start + (len(range(start, stop, step)) - 1) * step
+    for c0 in range(start // size * size, last + 1, size):
+        # first selected element in this chunk
+        first = start if c0 <= start else start + -(-(c0 - start) // step) * step
+        end = min(stop, c0 + size)
+        if first >= end:
+            continue
+        o = (first - start) // step
+        pieces.append((c0, slice(first - c0, end - c0, step), slice(o, o + len(range(first, end, step)))))
+    return pieces
+
+
+def _decode(raw, filter_mask, filters, dtype, chunkshape):
+    """Chunk array from the raw bytes of a chunk"""
+    data = raw
+    for i in reversed(range(len(filters))):
+        if filter_mask & (1 << i):
+            # filter was skipped for this chunk
+            continue
+        if filters[i] == FILTER_DEFLATE:
+            data = zlib.decompress(data)
+        elif filters[i] == FILTER_SHUFFLE and dtype.itemsize > 1:
+            data = np.frombuffer(data, dtype='u1').reshape(dtype.itemsize, -1).T.copy()
+    return np.frombuffer(data, dtype=dtype).reshape(chunkshape)
+
+
+def read_hyperslab(dset, index, out=None, threads=None):
+    """Read hyperslab `index` of h5py dataset `dset`, decompressing chunks in parallel
+
+    Parameters
+    ----------
+    dset : h5py.Dataset
+        chunked dataset with shuffle and/or deflate filters
+    index : tuple
+        ints and slices (negative steps and arrays are not supported)
+    out : ndarray, optional
+        output buffer with the shape of the result
+    threads : int, optional
+        number of threads (default: `default_threads()`)
+
+    Returns
+    -------
+    out
+    """
+    nindex = normalize_index(index, dset.shape)
+    if nindex is None:
+        raise ValueError('Index {} is not a hyperslab.'.format(index))
+    source = tuple(slice(i, i+1, 1) if not isinstance(i, slice) else i for i in nindex)
+    shape = index_shape(nindex)
+    if out is None:
+        out = np.empty(shape, dtype=dset.dtype.newbyteorder('='))
+    elif out.shape != shape:
+        raise ValueError('Output buffer has shape {}, selection has shape {}'.format(out.shape, shape))
+    if not out.size:
+        return out
+    target = out.reshape(index_shape(source))
+    if not np.may_share_memory(target, out):
+        # not a view, e.g. non-contiguous buffer
+        target = np.empty(index_shape(source), dtype=out.dtype)
+
+    filters = get_filters(dset)
+    chunkshape = dset.chunks
+    fillvalue = dset.fillvalue
+    pieces = list(itertools.product(*[_axis_pieces(sl, c) for sl, c in zip(source, chunkshape)]))
+
+    def read_chunk(piece):
+        offset = tuple(p[0] for p in piece)
+        csel = tuple(p[1] for p in piece)
+        osel = tuple(p[2] for p in piece)
+        if dset.id.get_chunk_info_by_coord(offset).byte_offset is None:
+            # chunk was never written
+            target[osel] = fillvalue
+            return
+        filter_mask, raw = dset.id.read_direct_chunk(offset)
+        target[osel] = _decode(raw, filter_mask, filters, dset.dtype, chunkshape)[csel]
+
+    nthreads = min(threads or default_threads(), len(pieces))
+    if nthreads > 1:
+        get_pool(nthreads).map(read_chunk, pieces, chunksize=1)
+    else:
+        for piece in pieces:
+            read_chunk(piece)
+    if not np.may_share_memory(target, out):
+        out[...] = target.reshape(shape)
+    return out
@@ -0,0 +1,175 @@
+"""
+Registry of derived POP variables
+
+A derived variable is an expression over POP output variables
+(e.g. the net salinity forcing or the freshwater anomaly (S0-SALT)/S0).
+Derived variables are requested by name and evaluated lazily: only their
+inputs are read, and only for the requested index (e.g. one time step and
+one level), so no full-field intermediates are built.
+
+    >>> fw = read(ds.variables, 'FRESHWATER', (0, k), S0=34.8)
+    >>> for k, layer in iter_levels(ds.variables, 'VVEL_TEMP', t=0): ...
+
+Names that are not registered are passed through to the dataset, so any
+function using `read` accepts both derived and plain POP variables.
+"""
+import numpy as np
+
+from . import chunks
+
+registry = {}
+
+
+class DerivedVariable:
+    """Named expression over POP variables"""
+    def __init__(self, name, inputs, func, constants=(), params={},
+            units='', long_name='', grid='T', metrics=()):
+        """
+        Parameters
+        ----------
+        name : str
+            name to register the variable under
+        inputs : list of str
+            names of the fields the expression depends on
+            (read with the requested index)
+        func : function
+            func(*inputs, *constants, **params) evaluating the expression
+        constants : list of str
+            names of scalar variables (read in full)
+        params : dict
+            default values of parameters passed to func
+        units, long_name : str
+            description of the result
+        grid : str ('T' or 'U')
+            which grid the result is on
+        metrics : list of str
+            grid metrics (e.g. 'TAREA', 'dz') needed to integrate the result,
+            checked by the integrating functions (e.g. surface fluxes are
+            integrated with 'TAREA' only)
+        """
+        self.name = name
+        self.inputs = list(inputs)
+        self.func = func
+        self.constants = list(constants)
+        self.params = dict(params)
+        self.units = units
+        self.long_name = long_name
+        self.grid = grid
+        self.metrics = list(metrics)
+
+    def __repr__(self):
+        return '{0.name} = f({1}) [{0.units}]'.format(self, ', '.join(self.inputs))
+
+    def read(self, dsvar, index=None, **params):
+        """Evaluate the expression on `dsvar` for `index`"""
+        kwargs = dict(self.params, **params)
+        args = [_get(dsvar[varn], index) for varn in self.inputs]
+        args += [_get(dsvar[varn], Ellipsis) for varn in self.constants]
+        return self.func(*args, **kwargs)
+
+
+def _get(var, index):
+    if index is None:
+        # keep lazy objects (e.g. xray.DataArray), but netCDF4 variables
+        # do not support arithmetic and must be read
+        if hasattr(var, '__add__'):
+            return var
+        index = Ellipsis
+    return chunks.read(var, index)
+
+
+def register(name, inputs, func, **kwargs):
+    """Register a derived variable (see `DerivedVariable` for arguments)"""
+    registry[name] = DerivedVariable(name, inputs, func, **kwargs)
+    return registry[name]
+
+
+def is_derived(varn):
+    return varn in registry
+
+
+def read(dsvar, varn, index=None, **params):
+    """Read variable `varn` from `dsvar`, evaluating it if it is derived
+
+    Parameters
+    ----------
+    dsvar : netCDF4.Dataset(fname).variables or xray.Dataset
+        mapping of POP variables
+    varn : str
+        name of POP or derived variable
+    index : tuple or int, optional
+        index applied to every input field, e.g. (t, k)
+        if None, lazy inputs (xray) are not indexed
+    params : dict
+        parameters of the derived variable, e.g. S0
+    """
+    if varn in registry:
+        return registry[varn].read(dsvar, index, **params)
+    else:
+        return _get(dsvar[varn], index)
+
+
+def iter_levels(dsvar, varn, t=0, kza=0, kzo=None, **params):
+    """Iterate over vertical levels of `varn` at time `t`, yielding (k, layer)
+
+    Levels are read in chunk-aligned blocks, so that compressed inputs are
+    decompressed once per chunk (see `chunks.level_blocks`); unchunked
+    inputs are read one level at a time.
+    """
+    if kzo is None:
+        kzo = len(dsvar['dz'])
+    inputs = registry[varn].inputs if varn in registry else [varn]
+    blocks = chunks.level_blocks(dsvar[inputs[0]], kza, kzo)
+    for varn_in in inputs[1:]:
+        chunks.level_blocks(dsvar[varn_in], kza, kzo)  # tunes the chunk cache
+    for k0, k1 in blocks:
+        if k1 - k0 == 1:
+            yield k0, read(dsvar, varn, (t, k0), **params)
+            continue
+        block = read(dsvar, varn, (t, slice(k0, k1)), **params)
+        for k in range(k0, k1):
+            yield k, block[...,k-k0,:,:]
+
+
+### BUILT-IN DERIVED VARIABLES
+
+register('NET_SALINITY_FORCING', ['SFWF', 'QFLUX'],
+        lambda sfwf, qflux, lhf: sfwf - qflux/lhf/1.e4,
+        constants=['latent_heat_fusion'],
+        units='kg FW m-2 s-1', long_name='net surface forcing of salinity',
+        metrics=['TAREA'])
+
+register('SALT_F_FW', ['SALT_F'],
+        lambda salt_f, sflux_factor, salinity_factor: salt_f*(sflux_factor/salinity_factor),
+        constants=['sflux_factor', 'salinity_factor'],
+        units='kg FW m-2 s-1', long_name='ice model salt flux as freshwater flux',
+        metrics=['TAREA'])
+
+register('SALINITY_RESTORING', ['SFWF', 'PREC_F', 'EVAP_F', 'ROFF_F', 'IOFF_F', 'MELT_F', 'SALT_F'],
+        lambda sfwf, prec, evap, roff, ioff, melt, salt_f, sflux_factor, salinity_factor: (
+            sfwf - (prec + evap + roff + ioff + melt) - salt_f*(sflux_factor/salinity_factor)),
+        constants=['sflux_factor', 'salinity_factor'],
+        units='kg FW m-2 s-1', long_name='implied salinity restoring',
+        metrics=['TAREA'])
+
+register('FRESHWATER', ['SALT'],
+        lambda salt, S0: (S0 - salt) / S0,
+        params=dict(S0=34.8),
+        units='1', long_name='freshwater fraction relative to S0',
+        metrics=['TAREA', 'dz'])
+
+register('VVEL_TEMP', ['VVEL', 'TEMP'],
+        lambda vvel, temp: vvel * 1e-2 * temp,
+        units='degC m s-1', long_name='meridional advective temperature flux',
+        grid='U', metrics=['DXU', 'dz'])
+
+register('VVEL_SALT', ['VVEL', 'SALT'],
+        lambda vvel, salt: vvel * 1e-2 * salt,
+        units='g kg-1 m s-1', long_name='meridional advective salt flux',
+        grid='U', metrics=['DXU', 'dz'])
+
+register('VVEL_FRESHWATER', ['VVEL', 'SALT'],
+        lambda vvel, salt, S0: vvel * 1e-2 * (S0 - salt) / S0,
+        params=dict(S0=34.8),
+        units='m s-1', long_name='meridional advective freshwater flux',
+        grid='U', metrics=['DXU', 'dz'])
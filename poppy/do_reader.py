@@ -1,18 +1,25 @@
 from __future__ import print_function
-import pandas as pd
-from io import StringIO
-import itertools
 import numpy as np
 import datetime
 import glob
-from collections import defaultdict
+import multiprocessing
+import functools
+import os
+import json
+import time
+import hashlib
 
+from .lazy import LazyModule
+from . import do_store
 
-def _add_index(df,year=1):
-    df['decyear'] = year + np.arange(len(df),dtype='f8')/len(df)
-    df.set_index('decyear',inplace=True)
-    df.index.name = 'ModelYear'
-    return df
+pd = LazyModule('pandas')
+
+
+def _decyear_index(year, n, nprev=0, nperyear=None):
+    """Decimal years of `n` records following `nprev` records,
+    assuming `nperyear` records per year (default `n`)"""
+    nperyear = nperyear or n
+    return year + (nprev + np.arange(n,dtype='f8'))/nperyear
 
 
 def _yr_from_fname(fname):
@@ -33,6 +40,112 @@ def _date_from_fname(fname):
         return datetime.datetime(year=0,month=1,day=1)
 
 
+# column names of the two record types in the do files
+cols = dict(
+        TS = ['n','Ti','Si','Ts','Ss','Te','Se','Tp','Sp'],
+        tr = ['n','phi','Ms','Me','Mp','m','zt'])
+
+# records start with e.g. ' ovf_TS:  <nstep>' (18 characters)
+_record_prefixes = dict(TS=b' ovf_TS', tr=b' ovf_tr')
+_record_offset = 18
+
+
+def _find_lines(buf):
+    """Start and end positions of the lines in byte array `buf`"""
+    ends = np.flatnonzero(buf == ord('\n'))
+    if len(buf) and buf[-1] != ord('\n'):
+        ends = np.append(ends, len(buf))
+    starts = np.concatenate([[0], ends[:-1]+1]).astype(ends.dtype)
+    return starts, ends
+
+
+def _select_records(buf, starts, ends, prefix):
+    """Select lines in `buf` starting with `prefix`"""
+    selected = (ends - starts) >= len(prefix)
+    starts, ends = starts[selected], ends[selected]
+    for i, char in enumerate(bytearray(prefix)):
+        selected = buf[starts+i] == char
+        starts, ends = starts[selected], ends[selected]
+    return starts, ends
+
+
+def _parse_fixed_width(records, ncols):
+    """Parse records of equal length (uint8 array (nrecords, width)) 
+    with right-aligned columns as written by Fortran
+    
+    Returns None if the records do not have `ncols` fixed-width columns.
+    """
+    nonspace = records[0] > 32
+    tokenends = np.flatnonzero(nonspace & ~np.append(nonspace[1:], False)) + 1
+    if len(tokenends) != ncols or not np.all(records[:,tokenends-1] > 32):
+        return None
+    data = np.empty((len(records), ncols))
+    for i, (a, b) in enumerate(zip(np.append(0, tokenends[:-1]), tokenends)):
+        field = np.ascontiguousarray(records[:,a:b])
+        try:
+            data[:,i] = field.view('S{}'.format(b-a))[:,0].astype('f8')
+        except ValueError:
+            return None
+    return data
+
+
+
+def _parse_whitespace(records, ncols):
+    """Parse whitespace-separated numbers in `records` (list of bytes) into array (nrecords, ncols)"""
+    values = np.array(b' '.join(records).split(), dtype='f8')
+    try:
+        return values.reshape((len(records), ncols))
+    except ValueError:
+        raise ValueError('Malformed records: expected {} columns per line.'.format(ncols))
+
+
+def _parse_records(contents, starts, ends, ncols):
+    """Parse the records located at `starts`, `ends` in `contents` into array (nrecords, ncols)"""
+    starts = starts + _record_offset
+    records = [contents[a:b] for a, b in zip(starts.tolist(), ends.tolist())]
+    widths = ends - starts
+    if len(starts) and np.all(widths == widths[0]) and widths[0] > 0:
+        data = _parse_fixed_width(
+                np.frombuffer(b''.join(records), dtype='u1').reshape((len(records), -1)),
+                ncols)
+        if data is not None:
+            return data
+    return _parse_whitespace(records, ncols)
+
+
+def _records_to_frame(data, names, straits, year, nprev=0, nperyear=None):
+    """Separate interleaved `straits` in `data` and build one frame indexed by (Strait, ModelYear)"""
+    nstraits = len(straits)
+    # take every (nstraits)th line starting from 0,1,2,3...
+    blocks = [data[i::nstraits] for i in range(nstraits)]
+    index = pd.MultiIndex.from_arrays([
+        np.repeat(straits, [len(block) for block in blocks]),
+        np.concatenate([_decyear_index(year, len(block), nprev, nperyear) for block in blocks])],
+        names=('Strait','ModelYear'))
+    return pd.DataFrame(np.concatenate(blocks), index=index, columns=names)
+
+
+def _parse_do_contents(contents, straits, year, nprev=0, nperyear=None):
+    """Parse the records in the do file `contents` (bytes) into one frame"""
+    buf = np.frombuffer(contents, dtype='u1')
+    starts, ends = _find_lines(buf)
+
+    dfs = []
+    for key in ['TS','tr']:
+        data = _parse_records(contents, 
+                *_select_records(buf, starts, ends, _record_prefixes[key]),
+                ncols=len(cols[key]))
+        dfs.append(_records_to_frame(data[:,1:], cols[key][1:], straits, year, nprev, nperyear))
+
+    if dfs[0].index.equals(dfs[1].index):
+        return pd.DataFrame(
+                np.hstack([df.values for df in dfs]),
+                index=dfs[0].index,
+                columns=list(dfs[0].columns)+list(dfs[1].columns))
+    else:
+        return pd.concat(dfs,axis=1)
+
+
 def read_do_file(fname,straits=['DS','FBC','RossSea','WeddellSea'],year=None):
     """Read a POP diagnostic overflow output (do) file
     
@@ -40,6 +153,10 @@ def read_do_file(fname,straits=['DS','FBC','RossSea','WeddellSea'],year=None):
     archived and in the `run` directory otherwise and match the 
     pattern `*pop.do.*`.
 
+    The file is read in one pass, the fixed-width records are parsed
+    into one array per record type and the straits are separated by 
+    strided slicing.
+
     Parameters
     ----------
     fname : str
@@ -50,60 +167,16 @@ def read_do_file(fname,straits=['DS','FBC','RossSea','WeddellSea'],year=None):
         The length of this list must match the number of respective
         columns in the do file
     """
-    nstraits = len(straits)
-    contents = ['TS','tr']
-    
-    ios = {}
-    lines = {}
-    for key in contents:
-        ios[key] = [StringIO() for s in straits]
-        lines[key] = []
-
-    # split lines into TS and tr
-    with open(fname,'r') as fin:
-        for line in fin:
-            if line.startswith(' ovf_TS'):
-                lines['TS'].append(line[18:])
-            elif line.startswith(' ovf_tr'):
-                lines['tr'].append(line[18:])
-
-    # separate out straits
-    for key in contents:
-        for i in range(nstraits):
-            # take every (nstraits)th line starting from 0,1,2,3...
-            ios[key][i].writelines(itertools.islice(lines[key],i,None,nstraits))
-            # rewind StringIOs
-            ios[key][i].seek(0)
+    with open(fname,'rb') as fin:
+        contents = fin.read()
 
     # get start day
     year = year or _yr_from_fname(fname)
 
-    cols = dict(
-            TS = ['n','Ti','Si','Ts','Ss','Te','Se','Tp','Sp'],
-            tr = ['n','phi','Ms','Me','Mp','m','zt'])
-    usecols = dict(
-            TS = np.arange(1,len(cols['TS'])),
-            tr = np.arange(1,len(cols['tr'])))
-
-    dfs = defaultdict(list)
-    for key in contents:
-        # select column names from usecols
-        names = np.array(cols[key])[usecols[key]]
-        # read separate straits into panda dfs
-        for i,strait in enumerate(straits):
-            df = pd.read_csv(ios[key][i],
-                    names=names,
-                    usecols=usecols[key],
-                    delim_whitespace=True)
-            _add_index(df,year)
-            dfs[key].append(df)
-
-    return pd.concat(
-            [pd.concat(dfs[key],keys=straits,names=('Strait','ModelYear')) 
-                for key in contents],axis=1)
-
-
-def read_do_multifile(files,**kwargs):
+    return _parse_do_contents(contents, straits, year)
+
+
+def read_do_multifile(files,nprocs=1,**kwargs):
     """Read multiple POP diagnostic overflow output (do) files 
     and concatenate their data.
     
@@ -111,6 +184,10 @@ def read_do_multifile(files,**kwargs):
     ----------
     files : list of str
         files to read and concatenate
+    nprocs : int
+        number of processes to read the files in parallel
+    kwargs : dict
+        keyword arguments passed to `read_do_file`
     """
     if isinstance(files, str):
         files = [files]
@@ -118,8 +195,169 @@ def read_do_multifile(files,**kwargs):
     if len(files) == 1:
         files = sorted(glob.glob(files[0]))
 
-    dfs = []
-    for fname in files:
-        df = read_do_file(fname,**kwargs)
-        dfs.append(df)
+    reader = functools.partial(read_do_file,**kwargs)
+    if nprocs > 1 and len(files) > 1:
+        pool = multiprocessing.Pool(min(nprocs,len(files)))
+        try:
+            dfs = pool.map(reader, files)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        dfs = [reader(fname) for fname in files]
     return pd.concat(dfs)
+
+
+# bytes at the start of a followed file hashed to detect its replacement
+_head_bytes = 4096
+
+
+def _head_hash(fname, length):
+    with open(fname, 'rb') as fin:
+        return hashlib.sha1(fin.read(length)).hexdigest()
+
+
+class DoFollower:
+    """Follow growing POP diagnostic overflow output (do) files
+
+    Remembers the byte offset and the number of parsed records of each
+    file, parses only newly appended complete records and appends them
+    to an HDF5 table store (see `do_store`). The state is kept in a JSON file next to the
+    store, so monitoring can be resumed and costs proportional to the
+    new data only.
+
+    Records are appended replacing the stored rows of their model years,
+    so records appended again after an interruption (before the state was
+    saved) are not duplicated. A file that is truncated or replaced
+    (detected by its inode and a hash of its first bytes) is parsed from
+    the start and its previously stored rows are removed.
+    """
+    def __init__(self, store, straits=['DS','FBC','RossSea','WeddellSea'],
+            nperyear=365, key=do_store.default_key, statefile=None):
+        """
+        Create a new do file follower
+
+        Parameters
+        ----------
+        store : str
+            path to HDF5 store to append the data to
+        straits : list of str
+            straits in the files (see `read_do_file`)
+        nperyear : int
+            number of records per strait and year (365 for daily output)
+            used to compute the model year of each record
+        key : str
+            key of the table in the store
+        statefile : str, optional
+            file to keep the parsing state in (default: store + '.follow.json')
+        """
+        self.store = store
+        self.straits = list(straits)
+        self.nperyear = nperyear
+        self.key = key
+        self.statefile = statefile or store + '.follow.json'
+        self.state = {}
+        # year ranges of the rows of replaced files, removed by `update`
+        self._stale = []
+        if os.path.isfile(self.statefile):
+            with open(self.statefile) as f:
+                self.state = json.load(f)
+
+    def _save_state(self):
+        tmpfile = self.statefile + '.tmp'
+        with open(tmpfile, 'w') as f:
+            json.dump(self.state, f, indent=1, sort_keys=True)
+        os.rename(tmpfile, self.statefile)
+
+    def _complete_length(self, contents):
+        """Length of `contents` that holds complete time steps only
+        (all TS and tr records of all straits)"""
+        contents = contents[:contents.rfind(b'\n')+1]
+        buf = np.frombuffer(contents, dtype='u1')
+        starts, ends = _find_lines(buf)
+        nstraits = len(self.straits)
+        recordends = [_select_records(buf, starts, ends, _record_prefixes[key])[1]
+                for key in ['TS','tr']]
+        ncomplete = min(len(e) for e in recordends) // nstraits * nstraits
+        if ncomplete == 0:
+            return 0
+        return int(max(e[ncomplete-1] for e in recordends)) + 1
+
+    def _replaced(self, fname, state):
+        """Whether `fname` is not the file described by `state` any more"""
+        stat = os.stat(fname)
+        if stat.st_size < state['offset'] or stat.st_ino != state.get('ino', stat.st_ino):
+            return True
+        if 'head' in state:
+            return _head_hash(fname, state['headlen']) != state['head']
+        return False
+
+    def read_new(self, fname):
+        """Parse the complete records appended to `fname` since the last call"""
+        fname = os.path.abspath(fname)
+        state = self.state.get(fname)
+        if state is not None and self._replaced(fname, state):
+            if state['nrecords']:
+                self._stale.append((state['year'],
+                    state['year'] + (state['nrecords'] - 0.5) / self.nperyear))
+            state = None
+        if state is None:
+            state = dict(offset=0, nrecords=0, year=_yr_from_fname(fname))
+        with open(fname, 'rb') as fin:
+            fin.seek(state['offset'])
+            contents = fin.read()
+        length = self._complete_length(contents)
+        state['ino'] = os.stat(fname).st_ino
+        state['headlen'] = min(state['offset'] + length, _head_bytes)
+        state['head'] = _head_hash(fname, state['headlen'])
+        if length == 0:
+            self.state[fname] = state
+            return None
+        df = _parse_do_contents(contents[:length], self.straits, state['year'],
+                nprev=state['nrecords'], nperyear=self.nperyear)
+        state['offset'] += length
+        state['nrecords'] += len(df) // len(self.straits)
+        self.state[fname] = state
+        return df
+
+    def update(self, files):
+        """Append new records from `files` (list or glob pattern) to the store
+
+        Returns the new data or None if there were no new records.
+        """
+        if isinstance(files, str):
+            files = [files]
+        if len(files) == 1:
+            files = sorted(glob.glob(files[0]))
+        dfs = [df for df in (self.read_new(fname) for fname in files) if df is not None]
+        for yearlim in self._stale:
+            do_store.remove(self.store, yearlim, strait=self.straits, key=self.key)
+        self._stale = []
+        # one file at a time, so only the years of its new records are replaced
+        for df in dfs:
+            do_store.append(self.store, df, key=self.key, replace=True)
+        self._save_state()
+        return pd.concat(dfs) if dfs else None
+
+    def follow(self, files, interval=60., maxiter=None, callback=None):
+        """Call `update` every `interval` seconds
+
+        Parameters
+        ----------
+        files : list of str or str
+            files or glob pattern (re-globbed each time, to catch new files)
+        interval : float
+            seconds between updates
+        maxiter : int, optional
+            stop after this many updates
+        callback : function, optional
+            called with the new data after each update with new records
+        """
+        niter = 0
+        while maxiter is None or niter < maxiter:
+            df = self.update(files)
+            if df is not None and callback is not None:
+                callback(df)
+            niter += 1
+            if maxiter is None or niter < maxiter:
+                time.sleep(interval)
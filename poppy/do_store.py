@@ -0,0 +1,171 @@
+"""
+Storage layer for POP diagnostic overflow output (do) data
+
+The data (as returned by `do_reader.read_do_file`) are kept in chunked,
+compressed HDF5 tables with `Strait` and `ModelYear` as indexed data
+columns, so that appends are cheap and queries like
+
+    >>> query('case.do.h5', strait='DS', yearlim=(300,400), columns=['Ms','Mp'])
+
+read only the matching rows. Annual means are maintained alongside the
+raw data (key + '_annual') for fast plotting; `write_pyramids` adds
+min/mean/max pyramids per strait (see `poppy.pyramid`).
+"""
+import numpy as np
+
+from .lazy import LazyModule
+from . import pyramid
+
+pd = LazyModule('pandas')
+
+default_key = 'do'
+
+
+def _annual_key(key):
+    return key + '_annual'
+
+
+def pyramid_key(strait, key=default_key):
+    return '{}_pyramid/{}'.format(key, strait)
+
+
+def _where(strait=None, yearlim=None):
+    """Build a where clause selecting `strait` and model years within `yearlim`"""
+    clauses = []
+    if strait is not None:
+        if isinstance(strait, str):
+            clauses.append('Strait == "{}"'.format(strait))
+        else:
+            clauses.append('Strait in {!r}'.format(list(strait)))
+    if yearlim is not None:
+        if yearlim[0] is not None:
+            clauses.append('ModelYear >= {!r}'.format(float(yearlim[0])))
+        if yearlim[1] is not None:
+            clauses.append('ModelYear <= {!r}'.format(float(yearlim[1])))
+    return ' & '.join(clauses) or None
+
+
+def annual_means(df):
+    """Annual means of do data indexed by (Strait, ModelYear)"""
+    years = np.floor(df.index.get_level_values('ModelYear'))
+    grouped = df.groupby([df.index.get_level_values('Strait'), years], sort=True)
+    annual = grouped.mean()
+    annual.index.names = ['Strait', 'ModelYear']
+    return annual
+
+
+def _yearlim(df):
+    years = df.index.get_level_values('ModelYear')
+    return years.min(), years.max()
+
+
+def _remove(hdf, key, strait, yearlim, with_annual=True):
+    if key not in hdf:
+        return
+    hdf.remove(key, where=_where(strait, yearlim))
+    if with_annual:
+        _update_annual(hdf, key, yearlim)
+
+
+def remove(store, yearlim, strait=None, key=default_key, with_annual=True):
+    """Remove the rows of `strait` (default: all) within `yearlim` from the table `key` in `store`
+
+    Parameters
+    ----------
+    store : str
+        path to HDF5 file
+    yearlim : tuple
+        (first, last) model year to remove
+    strait : str or list of str, optional
+        strait(s) to remove
+    key : str
+        table name
+    with_annual : bool
+        update the annual means of the years within `yearlim`
+    """
+    with pd.HDFStore(store, mode='a') as hdf:
+        _remove(hdf, key, strait, yearlim, with_annual)
+
+
+def append(store, df, key=default_key, complevel=5, complib='zlib', with_annual=True,
+        replace=False):
+    """Append do data to the table `key` in `store` and update the annual means
+
+    Parameters
+    ----------
+    store : str
+        path to HDF5 file
+    df : pandas.DataFrame
+        do data indexed by (Strait, ModelYear)
+    key : str
+        table name
+    complevel, complib
+        compression settings (see `pandas.HDFStore`)
+    with_annual : bool
+        update the annual means of the years touched by `df`
+    replace : bool
+        first remove the rows of the straits in `df` within its model year
+        range, so that appending the same data again adds no duplicates
+    """
+    if df is None or len(df) == 0:
+        return
+    with pd.HDFStore(store, mode='a', complevel=complevel, complib=complib) as hdf:
+        if replace:
+            straits = list(df.index.get_level_values('Strait').unique())
+            _remove(hdf, key, straits, _yearlim(df), with_annual=False)
+        hdf.append(key, df, format='table', data_columns=True,
+                min_itemsize={'Strait':32}, index=False)
+        hdf.create_table_index(key, columns=['Strait','ModelYear'], optlevel=6, kind='medium')
+        if with_annual:
+            _update_annual(hdf, key, _yearlim(df))
+
+
+def _update_annual(hdf, key, yearlim):
+    """Recompute the annual means of all years touched by `yearlim`"""
+    yearlim = (np.floor(yearlim[0]), np.floor(yearlim[1]) + 1)
+    where = _where(yearlim=yearlim) + ' & ModelYear < {!r}'.format(float(yearlim[1]))
+    data = hdf.select(key, where=where)
+    annualkey = _annual_key(key)
+    if annualkey in hdf:
+        hdf.remove(annualkey, where=where)
+    if len(data):
+        hdf.append(annualkey, annual_means(data), format='table', data_columns=True,
+                min_itemsize={'Strait':32})
+
+
+def write(store, df, key=default_key, **kwargs):
+    """Write do data to `store`, replacing existing tables `key`"""
+    with pd.HDFStore(store, mode='a') as hdf:
+        for k in [key, _annual_key(key)]:
+            if k in hdf:
+                hdf.remove(k)
+    append(store, df, key=key, **kwargs)
+
+
+def write_pyramids(store, df, key=default_key):
+    """Build aggregate pyramids for each strait in `df` (see `poppy.pyramid`)"""
+    for strait in df.index.get_level_values('Strait').unique():
+        pyramid.build_pyramid(df.loc[strait], store, pyramid_key(strait, key))
+
+
+def query(store, strait=None, yearlim=None, columns=None, key=default_key, annual=False):
+    """Read do data from `store`, reading only the matching rows
+
+    Parameters
+    ----------
+    store : str
+        path to HDF5 file
+    strait : str or list of str, optional
+        strait(s) to select
+    yearlim : tuple, optional
+        (first, last) model year to select, either may be None
+    columns : list of str, optional
+        columns to read
+    key : str
+        table name
+    annual : bool
+        read the annual means instead of the raw data
+    """
+    if annual:
+        key = _annual_key(key)
+    return pd.read_hdf(store, key, where=_where(strait, yearlim), columns=columns)
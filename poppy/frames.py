@@ -0,0 +1,201 @@
+"""
+Frame sources for animations
+
+A frame source maps a frame number to the data plotted in that frame.
+`FrameSource` reads one frame per input file with a user-supplied reader
+and reads ahead in a background thread, so that plotting frame i overlaps
+with reading frames i+1, ..., i+lookahead:
+
+    >>> frames = FrameSource(ncfiles, lambda dsvar: dsvar['TEMP'][0,0])
+    >>> for i in range(len(frames)):
+    ...     data = frames[i]
+
+Sequential access is served from the queue; any other access restarts
+the background reader at the requested frame. The netCDF library is not
+thread-safe, so every frame is read under `ncpool.netcdf_lock`, which the
+handle pools and the netcdf4 backend also hold for their opens and reads.
+
+`CubeFrameSource` serves the same frames from a memory-mapped cube that
+is extracted once, so that animations can be replayed (e.g. with other
+levels or colormaps) without reading the input files again.
+"""
+import threading
+import datetime
+import json
+import numpy as np
+import netCDF4
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from . import ncpool
+
+
+class FrameSource:
+    """Frames read from one file each, prefetched in a background thread"""
+    def __init__(self, ncfiles, reader, lookahead=4):
+        """
+        Parameters
+        ----------
+        ncfiles : list
+            input files, one per frame
+        reader : function
+            reader(dsvar) returning the frame from netCDF4.Dataset(fname).variables
+            (each file is opened once per frame)
+        lookahead : int
+            number of frames to read ahead
+            0 reads every frame synchronously
+        """
+        self.ncfiles = ncfiles
+        self.reader = reader
+        self.lookahead = lookahead
+        self._thread = None
+        self._next = None
+
+    def __len__(self):
+        return len(self.ncfiles)
+
+    def read(self, i):
+        """Read frame `i` synchronously (under `ncpool.netcdf_lock`)"""
+        with ncpool.netcdf_lock:
+            with netCDF4.Dataset(self.ncfiles[i]) as ds:
+                return self.reader(ds.variables)
+
+    def _start(self, i):
+        self.stop()
+        self._queue = queue.Queue(maxsize=self.lookahead)
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._work,
+                args=(i, self._queue, self._stopped))
+        self._thread.daemon = True
+        self._thread.start()
+        self._next = i
+
+    def _work(self, i, frames, stopped):
+        for j in range(i, len(self)):
+            try:
+                item = (j, self.read(j), None)
+            except Exception as err:
+                item = (j, None, err)
+            while not stopped.is_set():
+                try:
+                    frames.put(item, timeout=0.1)
+                    break
+                except queue.Full:
+                    continue
+            if stopped.is_set():
+                return
+
+    def stop(self):
+        """Stop the background reader"""
+        if self._thread is not None:
+            self._stopped.set()
+            self._thread.join()
+            self._thread = None
+            self._next = None
+
+    def __getitem__(self, i):
+        i = range(len(self))[i]
+        if self.lookahead < 1:
+            return self.read(i)
+        if i != self._next:
+            self._start(i)
+        j, frame, err = self._queue.get()
+        self._next = j + 1
+        if err is not None:
+            raise err
+        return frame
+
+    def __del__(self):
+        self.stop()
+
+
+class CubeFrameSource:
+    """Frames replayed from a memory-mapped float32 cube
+
+    The cube is stored as `path` (frames x field, NaN where masked) with
+    the frame times in `path`.time.npy and a description of what was
+    extracted in `path`.json. Frames are served without netCDF I/O and
+    the whole cube is available as `data` for quick-look plots.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.data = np.load(path, mmap_mode='r')
+        times = np.load(path + '.time.npy')
+        if np.issubdtype(times.dtype, np.datetime64):
+            times = times.astype('datetime64[us]').astype(object)
+        self.times = times
+        self.lookahead = 0
+
+    def __len__(self):
+        return len(self.data)
+
+    def read(self, i):
+        return np.ma.masked_invalid(self.data[i]), self.times[i]
+
+    def __getitem__(self, i):
+        return self.read(range(len(self))[i])
+
+    def stop(self):
+        pass
+
+    @staticmethod
+    def extract(path, ncfiles, reader, meta={}, lookahead=4, sketch=None):
+        """Extract all frames into a cube at `path`
+
+        Parameters
+        ----------
+        path : str
+            cube file (.npy)
+        ncfiles : list
+            input files, one per frame
+        reader : function
+            reader(dsvar) returning (data, time) for one frame
+            `time` may be a number or a datetime
+        meta : dict
+            description of the extracted frames (must be JSON serializable)
+        lookahead : int
+            number of frames read ahead while writing
+        sketch : sketch.QuantileSketch, optional
+            sketch updated with every frame in the same pass
+        """
+        frames = FrameSource(ncfiles, reader, lookahead=lookahead)
+        cube = None
+        times = []
+        try:
+            for i in range(len(frames)):
+                data, time = frames[i]
+                if cube is None:
+                    cube = np.lib.format.open_memmap(path, mode='w+', dtype='f4', 
+                            shape=(len(frames),) + np.shape(data))
+                cube[i] = np.ma.filled(np.ma.asarray(data, dtype='f4'), np.nan)
+                if sketch is not None:
+                    sketch.update(data)
+                times.append(time)
+        finally:
+            frames.stop()
+        cube.flush()
+        del cube
+        if isinstance(times[0], datetime.datetime):
+            times = np.array(times, dtype='datetime64[us]')
+        np.save(path + '.time.npy', np.asarray(times))
+        with open(path + '.json', 'w') as f:
+            json.dump(dict(meta, ncfiles=list(ncfiles)), f)
+        return CubeFrameSource(path)
+
+    @staticmethod
+    def open_or_extract(path, ncfiles, reader, meta={}, lookahead=4, sketch=None):
+        """Open the cube at `path` if it holds `ncfiles` and `meta`, otherwise extract it
+
+        `sketch` is only updated if the cube is extracted.
+        """
+        try:
+            with open(path + '.json') as f:
+                stored = json.load(f)
+            if stored == json.loads(json.dumps(dict(meta, ncfiles=list(ncfiles)))):
+                return CubeFrameSource(path)
+        except (IOError, OSError, ValueError):
+            pass
+        return CubeFrameSource.extract(path, ncfiles, reader, meta=meta, 
+                lookahead=lookahead, sketch=sketch)
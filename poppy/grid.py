@@ -1,7 +1,8 @@
 """POP grid handling"""
 import numpy as np
 import bisect
-import netCDF4
+
+from . import ncpool
 
 
 def find_k_depth(ds,depth):
@@ -116,7 +117,7 @@ def get_mask_lonlat(fname,lonlim=None,latlim=None,grid='T'):
     try:
         return _get_mask(fname,lonlim,latlim,grid)
     except AttributeError:
-        with netCDF4.Dataset(fname) as ds:
+        with ncpool.dataset(fname) as ds:
             return _get_mask(ds,lonlim,latlim,grid)
 
 
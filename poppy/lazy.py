@@ -0,0 +1,46 @@
+"""
+Deferred imports of heavy or optional dependencies
+
+    >>> pd = LazyModule('pandas')
+    >>> pd.Series          # pandas is imported here
+
+The module is only imported on first attribute access, so importing a
+poppy module costs little more than importing numpy.
+"""
+import importlib
+
+
+def available(name):
+    """Whether module `name` can be imported, without importing it"""
+    try:
+        from importlib.util import find_spec
+    except ImportError:
+        import imp
+        try:
+            imp.find_module(name.split('.')[0])
+            return True
+        except ImportError:
+            return False
+    try:
+        return find_spec(name) is not None
+    except (ImportError, ValueError):
+        return False
+
+
+class LazyModule:
+    """Proxy importing module `name` on first attribute access"""
+    def __init__(self, name):
+        self.__dict__['_name'] = name
+        self.__dict__['_module'] = None
+
+    def _load(self):
+        if self._module is None:
+            self.__dict__['_module'] = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __repr__(self):
+        state = 'loaded' if self._module is not None else 'not loaded'
+        return '<lazy module {!r} ({})>'.format(self._name, state)
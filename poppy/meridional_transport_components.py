@@ -4,7 +4,7 @@ from oceanpy.stats import central_differences
 def _fill0(a):
     return np.ma.filled(a,0.)
 
-def mean_velocity_component(ds,varn,regmask=1,kza=0,kzo=None,S0=34.8):
+def mean_velocity_component(ds,varn,regmask=1,kza=0,kzo=None,S0=34.8,t=0):
     """Mean velocity component using VNT or VNS
 
     From https://bb.cgd.ucar.edu/node/1000983 :
@@ -23,14 +23,14 @@ def mean_velocity_component(ds,varn,regmask=1,kza=0,kzo=None,S0=34.8):
     meanvel = np.zeros(regmask.shape[0])
     for k in range(kza,kzo):
         if varn == 'heat':
-            layer = dsvar['VNT'][0,k] # degC s-1
+            layer = dsvar['VNT'][t,k] # degC s-1
             layer *= dyu
         elif varn == 'salt':
-            layer = dsvar['VNS'][0,k] # PPT s-1
+            layer = dsvar['VNS'][t,k] # PPT s-1
             layer *= dyu
         elif varn == 'freshwater':
-            layer = (S0 - dsvar['SALT'][0,k]) / S0
-            layer *= dsvar['VVEL'][0,k]/100.
+            layer = (S0 - dsvar['SALT'][t,k]) / S0
+            layer *= dsvar['VVEL'][t,k]/100.
         layer *= dz[k]
         layer *= dxu
         layer *= regmask
@@ -42,7 +42,7 @@ def mean_velocity_component(ds,varn,regmask=1,kza=0,kzo=None,S0=34.8):
     return meanvel
 
 
-def diffusion_component(ds,varn,regmask=1,kza=0,kzo=None,S0=34.8):
+def diffusion_component(ds,varn,regmask=1,kza=0,kzo=None,S0=34.8,t=0):
     """Temperature/Salt diffusion"""
     dsvar = ds.variables
     dxt = dsvar['DXT'][:]/100.
@@ -51,13 +51,13 @@ def diffusion_component(ds,varn,regmask=1,kza=0,kzo=None,S0=34.8):
     if kzo is None: kzo = len(dz)
     diffusion = np.zeros(regmask.shape[0])
     for k in range(kza,kzo):
-        layer = _fill0(dsvar['KAPPA_ISOP'][0,k]/1e4) # m2 s-1
+        layer = _fill0(dsvar['KAPPA_ISOP'][t,k]/1e4) # m2 s-1
         if varn == 'heat':
-            scalar = _fill0(dsvar['TEMP'][0,k])
+            scalar = _fill0(dsvar['TEMP'][t,k])
         elif varn == 'salt':
-            scalar = _fill0(dsvar['SALT'][0,k])
+            scalar = _fill0(dsvar['SALT'][t,k])
         elif varn == 'freshwater':
-            scalar = (S0 - _fill0(dsvar['SALT'][0,k])) / S0
+            scalar = (S0 - _fill0(dsvar['SALT'][t,k])) / S0
         gradient = central_differences(scalar,dyt,axis=0) # [scalar] m s-1
         #gradient = np.zeros(scalar.shape)
         #gradient[1:,:] = np.diff(scalar,axis=0)
@@ -76,7 +76,7 @@ def diffusion_component(ds,varn,regmask=1,kza=0,kzo=None,S0=34.8):
     return diffusion
 
 
-def bolus_velocity_component_vnt_isop(ds,varn,regmask=1,kza=0,kzo=None,S0=0):
+def bolus_velocity_component_vnt_isop(ds,varn,regmask=1,kza=0,kzo=None,S0=0,t=0):
     """Eddy-induced velocity / bolus velocity using VNT_ISOP"""
     dsvar = ds.variables
     dxu = dsvar['DXU'][:]/100.
@@ -86,9 +86,9 @@ def bolus_velocity_component_vnt_isop(ds,varn,regmask=1,kza=0,kzo=None,S0=0):
     bolus = np.zeros(regmask.shape[0])
     for k in range(kza,kzo):
         if varn == 'heat':
-            layer = dsvar['VNT_ISOP'][0,k] # degC s-1
+            layer = dsvar['VNT_ISOP'][t,k] # degC s-1
         elif varn == 'salt':
-            layer = dsvar['VNS_ISOP'][0,k] # PPT s-1
+            layer = dsvar['VNS_ISOP'][t,k] # PPT s-1
         elif varn == 'freshwater':
             raise NotImplementedError('Salinity normalization does not work with this function.\n \
                     Use `_bolus_velocity_component_visop` instead.')
@@ -104,7 +104,7 @@ def bolus_velocity_component_vnt_isop(ds,varn,regmask=1,kza=0,kzo=None,S0=0):
     return bolus
 
 
-def bolus_velocity_component_visop(ds,varn,regmask=1,kza=0,kzo=None,S0=0):
+def bolus_velocity_component_visop(ds,varn,regmask=1,kza=0,kzo=None,S0=0,t=0):
     """Eddy-induced velocity / bolus velocity using VISOP variable"""
     dsvar = ds.variables
     dxu = dsvar['DXU'][:]/100.
@@ -112,13 +112,13 @@ def bolus_velocity_component_visop(ds,varn,regmask=1,kza=0,kzo=None,S0=0):
     if kzo is None: kzo = len(dz)
     bolus = np.zeros(regmask.shape[0])
     for k in range(kza,kzo):
-        layer = dsvar['VISOP'][0,k]/100.
+        layer = dsvar['VISOP'][t,k]/100.
         if varn == 'heat':
-            layer *= dsvar['TEMP'][0,k]
+            layer *= dsvar['TEMP'][t,k]
         elif varn == 'salt':
-            layer *= dsvar['SALT'][0,k]
+            layer *= dsvar['SALT'][t,k]
         elif varn == 'freshwater':
-            layer = (S0 - _fill0(dsvar['SALT'][0,k])) / S0
+            layer = (S0 - _fill0(dsvar['SALT'][t,k])) / S0
         layer *= dxu
         layer *= dz[k]
         layer *= regmask
@@ -1,33 +1,28 @@
 from __future__ import print_function
 import numpy as np
-import netCDF4
-import xray
-import scipy.ndimage
-import subprocess
-import traceback
-try:
-    import pandas as pd
-    use_pandas = True
-except ImportError:
-    use_pandas = False
+
+from .lazy import LazyModule, available
+ndimage = LazyModule('scipy.ndimage')
+pd = LazyModule('pandas')
+use_pandas = available('pandas')
+if not use_pandas:
     print('Pandas could not be imported. Functions will return data as tuple '
           '(tseries, timeaxis).')
-    pass
 
 from . import grid as poppygrid
-from . import utils
+from . import derived
+from . import catalog
+from . import mfdataset
+from . import ncpool
+from . import backends
+from . import rechunk
+from . import slabcache
 
 ### HELP FUNCTIONS
 
-def get_ulimitn(default=1e3):
-    """Try to get the maximum number of open files on the system. Works with Unix."""
-    return 100 # There are performance issues with netCDF4.MFDataset
-    try:
-        maxn = int(subprocess.check_output(['ulimit -n'],shell=True))
-    except:
-        maxn = default
-        traceback.print_exc()
-    return maxn
+def get_ulimitn(default=1024):
+    """Maximum number of open files on the system (see `ncpool.get_ulimitn`)"""
+    return ncpool.get_ulimitn(default=default)
 
 def _nfiles_diag(n):
     if n == 0:
@@ -56,12 +51,48 @@ def _pandas_copy_meta_data(source, target, addmeta={}):
 
 ### METRICS FUNCTIONS
 
-def get_amoc(ncfiles, latlim=(30,60), zlim=(500,9999), window_size=12):
+def running_mean(data, window_size):
+    """Centred running mean along the first axis, NaN where the window is incomplete"""
+    return ndimage.convolve1d(data, weights=np.ones(int(window_size))/float(window_size),
+            axis=0, mode='constant', cval=np.nan)
+
+
+def reduce_amoc(amoc, window_size=12):
+    """AMOC maximum of each time step of the MOC slab `amoc` (time, z, lat)
+
+    The slab is smoothed over `window_size` time steps first and the 
+    edges of the series are set to NaN (no smoothing if `window_size` <= 1).
+    """
+    if window_size > 1:
+        maxmeanamoc = np.max(np.max(running_mean(amoc, window_size), axis=-1), axis=-1)
+        maxmeanamoc[:window_size+1] = np.nan
+        maxmeanamoc[-window_size:] = np.nan
+        return maxmeanamoc
+    return np.max(np.max(amoc, axis=-1), axis=-1)
+
+
+def reduce_mht(nheat, window_size=12):
+    """Maximum over latitude of the northward heat transport `nheat` (time, lat),
+    smoothed over `window_size` time steps first"""
+    return np.max(running_mean(nheat, window_size), axis=-1)
+
+
+def reduce_mst(nsalt, window_size=12):
+    """Running mean of the northward salt transport series `nsalt`, NaN at the edges"""
+    meannsalt = np.convolve(nsalt, np.ones(int(window_size))/float(window_size), 'same')
+    meannsalt[:window_size+1] = np.nan
+    meannsalt[-window_size:] = np.nan
+    return meannsalt
+
+
+def get_amoc(ncfiles, latlim=(30,60), zlim=(500,9999), window_size=12,
+        backend=None, store=None, cachedir=None,
+        cachefile=None):
     """Retrieve AMOC time series from a set of CESM/POP model output files
 
     Parameters
     ----------
-    ncfiles : list of str
+    ncfiles : list of str, glob pattern or catalog.Query
         paths to input files
     latlim : tuple
         Latitude limits between which to find the maximum AMOC
@@ -69,6 +100,19 @@ def get_amoc(ncfiles, latlim=(30,60), zlim=(500,9999), window_size=12):
         Depth limits between which to find the maximum AMOC
     window_size : int
         Smoothing window width to apply before taking maximum
+    backend : str, optional
+        read backend (see `poppy.backends`)
+    store : str or False, optional
+        time-contiguous store to read from (see `poppy.rechunk`);
+        default: a store in `rechunk.stores` holding all files, if any;
+        False: read the files
+    cachedir : str, optional
+        directory of a memory-mapped cache of the full Atlantic MOC slab (see
+        `poppy.slabcache`), so that later calls with other parameters
+        do not read the files again
+    cachefile : str, optional
+        .npz file caching the time steps of the files between sessions
+        (see `mfdataset.open_pop_mfdataset`)
 
     Returns
     -------
@@ -80,45 +124,31 @@ def get_amoc(ncfiles, latlim=(30,60), zlim=(500,9999), window_size=12):
     Only works with POP data that has the diagnostic variable 'MOC' included.
 
     """
+    ncfiles = catalog.resolve_files(ncfiles)
     n = len(ncfiles)
     _nfiles_diag(n)
-    
-    maxn = get_ulimitn()
 
-    with netCDF4.Dataset(ncfiles[0]) as ds:
+    with backends.dataset(ncfiles[0], backend) as ds:
         dsvar = ds.variables
         zax = dsvar['moc_z'][:]/100.
         kza = np.argmin(np.abs(zax-zlim[0]))
         kzo = np.argmin(np.abs(zax-zlim[1]))
-        nz = kzo-kza+1
 
         latax = dsvar['lat_aux_grid'][:]
         ja = np.argmin(np.abs(latax-latlim[0]))
         jo = np.argmin(np.abs(latax-latlim[1]))        
-        nlat = jo-ja+1
         
-    if n <= maxn:
-        with netCDF4.MFDataset(ncfiles) as ds:
-            dsvar = ds.variables
-            timeax = utils.get_time_decimal_year(dsvar['time'])
-            amoc = dsvar['MOC'][:,1,0,kza:kzo+1,ja:jo+1]
+    if cachedir is not None:
+        slab, timeax = slabcache.get_slab(ncfiles, 'MOC', cachedir, backend=backend, store=store)
+        amoc = np.array(slab[:,kza:kzo+1,ja:jo+1])
     else:
-        timeax = np.zeros(n)
-        amoc = np.zeros((n,nz,nlat))
-        for i,fname in enumerate(ncfiles):
-            with netCDF4.Dataset(fname) as ds:
-                dsvar = ds.variables
-                timeax[i] = utils.get_time_decimal_year(dsvar['time'])
-                amoc[i] = dsvar['MOC'][0,1,0,kza:kzo+1,ja:jo+1]
+        store, tindex = rechunk.select_store(ncfiles, ['MOC'], backend=backend, store=store)
+        with store or mfdataset.open_pop_mfdataset(ncfiles, cachefile=cachefile, backend=backend) as ds:
+            dsvar = ds.variables
+            timeax = ds.get_time_decimal_year()[tindex]
+            amoc = dsvar['MOC'][tindex,1,0,kza:kzo+1,ja:jo+1]
                 
-    if window_size > 1:
-        maxmeanamoc = np.max(np.max(scipy.ndimage.convolve1d(
-            amoc,weights=np.ones(int(window_size))/float(window_size),
-            axis=0,mode='constant',cval=np.nan),axis=-1),axis=-1)
-        maxmeanamoc[:window_size+1] = np.nan
-        maxmeanamoc[-window_size:] = np.nan
-    else:
-        maxmeanamoc = np.max(np.max(amoc,axis=-1),axis=-1)
+    maxmeanamoc = reduce_amoc(amoc, window_size)
 
     if use_pandas:
         index = pd.Index(timeax, name='ModelYear')
@@ -141,46 +171,52 @@ componentnames = {
     }
 
 
-def get_mht(ncfiles, latlim=(30,60), component=0):
+def get_mht(ncfiles, latlim=(30,60), component=0, backend=None, store=None, cachedir=None,
+        cachefile=None):
     """Get MHT time series from CESM/POP data
     
     Parameters
     ----------
-    ncfiles : list of str
+    ncfiles : list of str, glob pattern or catalog.Query
         paths to input files
     latlim : tuple
         latitude limits for maximum
     component : int
         see metrics.componentnames
+    backend : str, optional
+        read backend (see `poppy.backends`)
+    store : str or False, optional
+        time-contiguous store to read from (see `poppy.rechunk`);
+        default: a store in `rechunk.stores` holding all files, if any;
+        False: read the files
+    cachedir : str, optional
+        directory of a memory-mapped cache of the full N_HEAT array (see
+        `poppy.slabcache`), so that later calls with other parameters
+        do not read the files again
+    cachefile : str, optional
+        .npz file caching the time steps of the files between sessions
+        (see `mfdataset.open_pop_mfdataset`)
     """
+    ncfiles = catalog.resolve_files(ncfiles)
     n = len(ncfiles)
     _nfiles_diag(n)
-    maxn = get_ulimitn()
 
-    with netCDF4.Dataset(ncfiles[0]) as ds:
+    with backends.dataset(ncfiles[0], backend) as ds:
         latax = ds.variables['lat_aux_grid'][:]
         ja = np.argmin(np.abs(latax-latlim[0]))
         jo = np.argmin(np.abs(latax-latlim[1]))
-        nlat = jo-ja+1
         
-    if n <= maxn:
-        with netCDF4.MFDataset(ncfiles) as ds:
-            dsvar = ds.variables
-            timeax = utils.get_time_decimal_year(dsvar['time'])
-            nheat = dsvar['N_HEAT'][:,0,component,ja:jo+1]
+    if cachedir is not None:
+        slab, timeax = slabcache.get_slab(ncfiles, 'N_HEAT', cachedir, backend=backend, store=store)
+        nheat = np.array(slab[:,0,component,ja:jo+1])
     else:
-        timeax = np.zeros(n)
-        nheat = np.zeros((n,nlat))
-        for i,fname in enumerate(ncfiles):
-            with netCDF4.Dataset(fname) as ds:
-                dsvar = ds.variables
-                timeax[i] = utils.get_time_decimal_year(dsvar['time'])
-                nheat[i,:] = dsvar['N_HEAT'][0,0,component,ja:jo+1]
+        store, tindex = rechunk.select_store(ncfiles, ['N_HEAT'], backend=backend, store=store)
+        with store or mfdataset.open_pop_mfdataset(ncfiles, cachefile=cachefile, backend=backend) as ds:
+            dsvar = ds.variables
+            timeax = ds.get_time_decimal_year()[tindex]
+            nheat = dsvar['N_HEAT'][tindex,0,component,ja:jo+1]
                 
-    window_size = 12
-    maxmeannheat = np.max(scipy.ndimage.convolve1d(
-        nheat,weights=np.ones(int(window_size))/float(window_size),
-        axis=0,mode='constant',cval=np.nan),axis=-1)
+    maxmeannheat = reduce_mht(nheat, window_size=12)
 
     if use_pandas:
         index = pd.Index(timeax, name='ModelYear')
@@ -194,46 +230,52 @@ def get_mht(ncfiles, latlim=(30,60), component=0):
         return maxmeannheat, timeax
 
 
-def get_mst(ncfiles, lat0=55, component=0):
+def get_mst(ncfiles, lat0=55, component=0, backend=None, store=None, cachedir=None,
+        cachefile=None):
     """Get MST time series from CESM/POP data
     
     Parameters
     ----------
-    ncfiles : list of str
+    ncfiles : list of str, glob pattern or catalog.Query
         paths to input files
     lat0 : float
         latitude to take the mean at
     component : int
         see metrics.componentnames
+    backend : str, optional
+        read backend (see `poppy.backends`)
+    store : str or False, optional
+        time-contiguous store to read from (see `poppy.rechunk`);
+        default: a store in `rechunk.stores` holding all files, if any;
+        False: read the files
+    cachedir : str, optional
+        directory of a memory-mapped cache of the full N_SALT array (see
+        `poppy.slabcache`), so that later calls with other parameters
+        do not read the files again
+    cachefile : str, optional
+        .npz file caching the time steps of the files between sessions
+        (see `mfdataset.open_pop_mfdataset`)
     """
+    ncfiles = catalog.resolve_files(ncfiles)
     n = len(ncfiles)
     _nfiles_diag(n)
-    maxn = get_ulimitn()
 
-    with netCDF4.Dataset(ncfiles[0]) as ds:
+    with backends.dataset(ncfiles[0], backend) as ds:
         dsvar = ds.variables
         latax = dsvar['lat_aux_grid'][:]
         j0 = np.argmin(np.abs(latax-lat0))
         
-    if n <= maxn:
-        with netCDF4.MFDataset(ncfiles) as ds:
-            dsvar = ds.variables
-            timeax = utils.get_time_decimal_year(dsvar['time'])
-            nsalt = dsvar['N_SALT'][:,0,component,j0]
+    if cachedir is not None:
+        slab, timeax = slabcache.get_slab(ncfiles, 'N_SALT', cachedir, backend=backend, store=store)
+        nsalt = np.array(slab[:,0,component,j0])
     else:
-        timeax = np.zeros(n)
-        nsalt = np.zeros(n)
-        for i,fname in enumerate(sorted(ncfiles)):
-            with netCDF4.Dataset(fname) as ds:
-                dsvar = ds.variables
-                timeax[i] = utils.get_time_decimal_year(dsvar['time'])
-                nsalt[i] = dsvar['N_SALT'][0,0,component,j0]
+        store, tindex = rechunk.select_store(ncfiles, ['N_SALT'], backend=backend, store=store)
+        with store or mfdataset.open_pop_mfdataset(ncfiles, cachefile=cachefile, backend=backend) as ds:
+            dsvar = ds.variables
+            timeax = ds.get_time_decimal_year()[tindex]
+            nsalt = dsvar['N_SALT'][tindex,0,component,j0]
                 
-    window_size=12
-    window = np.ones(int(window_size))/float(window_size)
-    meannsalt = np.convolve(nsalt,window,'same')
-    meannsalt[:window_size+1] = np.nan
-    meannsalt[-window_size:] = np.nan
+    meannsalt = reduce_mst(nsalt, window_size=12)
 
     if use_pandas:
         index = pd.Index(timeax, name='ModelYear')
@@ -249,15 +291,16 @@ def get_mst(ncfiles, lat0=55, component=0):
 
 def get_timeseries(ncfiles, varn, grid, 
         reducefunc=np.nanmean, 
-        latlim=None, lonlim=None, k=0):
+        latlim=None, lonlim=None, k=0, backend=None, store=None,
+        cachefile=None):
     """Get time series of any 2D POP field reduced by a numpy function
     
     Parameters
     ----------
-    ncfiles : list of str
+    ncfiles : list of str, glob pattern or catalog.Query
         paths to input files
     varn : str
-        variable name
+        variable name (POP or derived, see `poppy.derived`)
     grid : str ('T' or 'U')
         which grid the variable is on
     reducefunc : function
@@ -269,56 +312,61 @@ def get_timeseries(ncfiles, varn, grid,
         longitude limits for maximum
     k : int
         layer
+    backend : str, optional
+        read backend (see `poppy.backends`)
+    store : str or False, optional
+        time-contiguous store to read from (see `poppy.rechunk`);
+        default: a store in `rechunk.stores` holding all files, if any;
+        False: read the files
+    cachefile : str, optional
+        .npz file caching the time steps of the files between sessions
+        (see `mfdataset.open_pop_mfdataset`)
     """
+    ncfiles = catalog.resolve_files(ncfiles)
     n = len(ncfiles)
     _nfiles_diag(n)
-    maxn = get_ulimitn()
 
     # get mask
-    with xray.open_dataset(ncfiles[0], decode_times=False) as ds:
+    with backends.dataset(ncfiles[0], backend) as ds:
+        dsvar = ds.variables
         if latlim is None and lonlim is None:
             mask = None
         else:
             mask = poppygrid.get_grid_mask(
-                    lon = ds[grid+'LONG'], 
-                    lat = ds[grid+'LAT'],
+                    lon = dsvar[grid+'LONG'][:], 
+                    lat = dsvar[grid+'LAT'][:],
                     lonlim=lonlim, latlim=latlim)
-            mask &= ds.variables['KM'+grid][:]>0
-
-    # read data
-    if n <= maxn:
-        with xray.open_mfdataset(ncfiles, decode_times=False) as ds:
-            # select variable
-            ds = ds[varn]
-            # select level
-            try:
-                ds = ds.isel(z_t=k)
-            except ValueError:
-                pass
-            # apply mask
-            if mask is not None:
-                ds = ds.where(mask)
-            tseries = ds.reduce(reducefunc, ['nlon', 'nlat']).values
-            timevar = ds['time']
-            timeax = utils.get_time_decimal_year(timevar)
-    else:
-        timeax = np.zeros(n)
-        tseries = np.zeros((n))
-        for i,fname in enumerate(ncfiles):
-            with xray.open_dataset(fname, decode_times=False) as ds:
-                # select variable
-                ds = ds[varn]
-                # select level
-                try:
-                    ds = ds.isel(z_t=k)
-                except ValueError:
-                    pass
-                # apply mask
-                if mask is not None:
-                    ds = ds.where(mask)
-                tseries[i] = ds.reduce(reducefunc, ['nlon', 'nlat']).values
-                timevar = ds['time']
-                timeax[i] = utils.get_time_decimal_year(timevar)
+            mask &= dsvar['KM'+grid][:]>0
+        # select level
+        inputvarn = derived.registry[varn].inputs[0] if derived.is_derived(varn) else varn
+        if 'z_t' in dsvar[inputvarn].dimensions:
+            index = (slice(None), k)
+        else:
+            index = (slice(None),)
+    # read only the bounding box of the mask
+    if mask is not None and mask.any():
+        jj, ii = np.nonzero(mask)
+        box = (slice(jj.min(), jj.max()+1), slice(ii.min(), ii.max()+1))
+        index += box
+        mask = mask[box]
+
+    def _reduce(data):
+        data = np.array(data, dtype='f8')
+        # apply mask
+        if mask is not None:
+            data[:,~mask] = np.nan
+        return reducefunc(data.reshape((len(data), -1)), axis=-1)
+
+    # read data: all time steps of a file (or of a chunk of a store) at once
+    store, tindex = rechunk.select_store(ncfiles, [varn], backend=backend, store=store)
+    with store or mfdataset.open_pop_mfdataset(ncfiles, cachefile=cachefile, backend=backend) as ds:
+        timeax = ds.get_time_decimal_year()[tindex]
+        tseries = np.empty(len(timeax))
+        t0 = 0
+        for block in ds.time_blocks(tindex):
+            data = _reduce(derived.read(ds.variables, varn, (block,) + index[1:]))
+            tseries[t0:t0+len(data)] = data
+            t0 += len(data)
 
     # output
     if use_pandas:
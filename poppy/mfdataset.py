@@ -0,0 +1,245 @@
+"""
+Virtual dataset aggregating many POP history files along time
+
+    >>> ds = open_pop_mfdataset(ncfiles, cachefile='hist.agg.npz')
+    >>> amoc = ds.variables['MOC'][:,1,0,kza:kzo,ja:jo]
+    >>> moc = ds['MOC'][1200:2400]
+
+Opening only reads the `time` variable of each file (or nothing, for files
+listed unchanged in `cachefile`) to build a map from the aggregated time
+index to (file, local index). Variables without a time dimension (grid,
+coordinates) are taken from the first file. Reads of time-dependent
+variables open only the files they touch, through the shared handle pool of
+the read backend (`poppy.backends`) or a private pool of `maxopen` handles.
+Like the backends, reads return plain arrays with NaN for missing values;
+hyperslabs are read straight into one preallocated output array (see
+`AggregatedVariable.read`).
+"""
+import os
+import collections
+import numpy as np
+
+from . import utils
+from . import ncpool
+from . import backends
+from . import chunks
+
+
+def _read_times(fname, backend=None):
+    # through the shared pool, so the handle is reused by later reads
+    with backends.dataset(fname, backend) as f:
+        return np.atleast_1d(f.read('time')).astype('f8')
+
+
+def build_aggregation(ncfiles, cachefile=None, backend=None):
+    """Time values of all files, reusing the entries of unchanged files in `cachefile`
+
+    Files may hold any number of time steps (e.g. daily or yearly
+    concatenated output); the steps of all files are scanned up front.
+
+    Returns
+    -------
+    ntime : ndarray (nfiles,)
+        number of time steps per file
+    times : ndarray (sum(ntime),)
+        raw time values (in the units of each file)
+    """
+    cached = {}
+    if cachefile is not None and os.path.exists(cachefile):
+        with np.load(cachefile) as npz:
+            offsets = np.concatenate([[0], np.cumsum(npz['ntime'])])
+            for n, fname in enumerate(npz['files']):
+                cached[str(fname)] = (tuple(npz['signatures'][n]), npz['times'][offsets[n]:offsets[n+1]])
+    signatures = [ncpool.file_signature(fname) for fname in ncfiles]
+    times = []
+    changed = False
+    for fname, signature in zip(ncfiles, signatures):
+        try:
+            stored, filetimes = cached[os.path.abspath(fname)]
+            if stored != signature:
+                raise KeyError(fname)
+        except KeyError:
+            filetimes = _read_times(fname, backend)
+            changed = True
+        times.append(filetimes)
+    ntime = np.array([len(t) for t in times], dtype=int)
+    times = np.concatenate(times) if times else np.zeros(0)
+    if cachefile is not None and (changed or len(cached) != len(ncfiles)):
+        np.savez(cachefile, files=np.array([os.path.abspath(f) for f in ncfiles]),
+                signatures=np.array(signatures, dtype='f8').reshape((-1, 2)),
+                ntime=ntime, times=times)
+    return ntime, times
+
+
+class AggregatedVariable:
+    """Time-dependent variable spread over many files, read lazily"""
+    def __init__(self, name, mfds):
+        self.name = name
+        self._mfds = mfds
+        self._template = mfds._first.variables[name]
+        self.dimensions = self._template.dimensions
+        self.shape = (mfds.ntime,) + self._template.shape[1:]
+        self.dtype = self._template.dtype
+        self.ndim = len(self.shape)
+
+    def __repr__(self):
+        return '<aggregated variable {} {}>'.format(self.name, self.shape)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getattr__(self, attr):
+        # netCDF attributes (units, long_name, calendar, ...) of the first file
+        if attr.startswith('_'):
+            raise AttributeError(attr)
+        return getattr(self._template, attr)
+
+    def ncattrs(self):
+        return self._template.ncattrs()
+
+    def __getitem__(self, index):
+        return self.read(index)
+
+    def read(self, index=Ellipsis, out=None):
+        """Read `index` (in `out` if given), one hyperslab per run of consecutive steps in a file"""
+        index = chunks.expand_index(index, self.ndim)
+        if index is None:
+            raise IndexError('Invalid index for {}'.format(self))
+        tindex, rest = index[0], index[1:]
+        scalar = np.ndim(tindex) == 0 and not isinstance(tindex, slice)
+        tt = np.atleast_1d(np.arange(self.shape[0])[tindex])
+        mfds = self._mfds
+        fileidx = mfds.fileidx[tt]
+        localidx = mfds.localidx[tt]
+        breaks = np.flatnonzero((np.diff(fileidx) != 0) | (np.diff(localidx) != 1)) + 1
+        runs = [run for run in np.split(np.arange(len(tt)), breaks) if len(run)]
+        nrest = backends.normalize_index(rest, self.shape[1:])
+        if nrest is None:
+            # not a hyperslab: let the backend allocate every part
+            parts = []
+            for run in runs:
+                local = slice(localidx[run[0]], localidx[run[-1]]+1)
+                with mfds.handles.borrow(mfds.files[fileidx[run[0]]]) as f:
+                    parts.append(f.read(self.name, (local,) + rest))
+            data = np.concatenate(parts) if parts else self._template[(slice(0, 0),) + rest]
+            data = data[0] if scalar else data
+            if out is not None:
+                out[...] = data
+                return out
+            return data
+        shape = (len(tt),) + backends.index_shape(nrest)
+        if out is None:
+            full = np.empty(shape, dtype=self._outdtype())
+        elif scalar:
+            full = out[np.newaxis]
+        else:
+            full = out
+        for run in runs:
+            local = slice(localidx[run[0]], localidx[run[-1]]+1)
+            with mfds.handles.borrow(mfds.files[fileidx[run[0]]]) as f:
+                f.read(self.name, (local,) + nrest, out=full[run[0]:run[-1]+1])
+        if scalar:
+            return out if out is not None else full[0]
+        return full
+
+    def _outdtype(self):
+        if 'scale_factor' in self._template.ncattrs():
+            return np.promote_types(self.dtype, 'f4')
+        return self.dtype
+
+
+class PopMFDataset:
+    """Virtual dataset of many POP history files aggregated along time
+
+    Attributes
+    ----------
+    variables : dict
+        aggregated time-dependent variables and first-file grid variables
+    files : list of str
+        input files
+    ntime : int
+        total number of time steps
+    """
+    def __init__(self, ncfiles, cachefile=None, maxopen=None, backend=None):
+        """
+        Parameters
+        ----------
+        ncfiles : list of str
+            files, sorted in time
+        cachefile : str, optional
+            .npz file caching the aggregation map between sessions
+        maxopen : int, optional
+            maximum number of files kept open in a private handle pool
+            (default: use the shared pool of the backend)
+        backend : str, optional
+            read backend (see `poppy.backends`)
+        """
+        if len(ncfiles) == 0:
+            raise ValueError('No files found. Check your glob pattern.')
+        self.files = list(ncfiles)
+        self.backend = backends.get_backend(backend).name
+        if maxopen is None:
+            self.handles = backends.get_pool(self.backend)
+        else:
+            self.handles = ncpool.HandlePool(maxopen, opener=backends.get_backend(self.backend))
+        ntime, self._times = build_aggregation(self.files, cachefile=cachefile, backend=self.backend)
+        self.ntime = int(ntime.sum())
+        self.fileidx = np.repeat(np.arange(len(self.files)), ntime)
+        self.localidx = np.concatenate([np.arange(n) for n in ntime]) if len(ntime) else np.zeros(0, int)
+        self._first = backends.open_file(self.files[0], self.backend)
+        self.dimensions = self._first.dimensions
+        self.variables = collections.OrderedDict()
+        for name, var in self._first.variables.items():
+            if var.dimensions and var.dimensions[0] == 'time':
+                self.variables[name] = AggregatedVariable(name, self)
+            else:
+                self.variables[name] = var
+
+    def __repr__(self):
+        return '<PopMFDataset: {} files, {} time steps>'.format(len(self.files), self.ntime)
+
+    def __getitem__(self, name):
+        return self.variables[name]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        if self.handles is not backends.get_pool(self.backend):
+            self.handles.close()
+        self._first.close()
+
+    def get_time_decimal_year(self):
+        """Decimal model years of all time steps
+
+        Converted from the time values scanned on opening (or loaded from
+        `cachefile`) with the units and calendar of the first file, so no
+        file is read again.
+        """
+        timevar = self._first.variables['time']
+        return np.atleast_1d(utils.time_to_decimal_year(
+            self._times, timevar.units, getattr(timevar, 'calendar', 'standard')))
+
+    def time_blocks(self, tindex=slice(None)):
+        """Split `tindex` into one block per file (slices where consecutive)
+
+        Reading a block reads all its time steps of one file at once.
+        """
+        tt = np.arange(self.ntime)[tindex]
+        blocks = []
+        for block in np.split(tt, np.flatnonzero(np.diff(self.fileidx[tt])) + 1):
+            if not len(block):
+                continue
+            if np.all(np.diff(block) == 1):
+                blocks.append(slice(int(block[0]), int(block[-1]) + 1))
+            else:
+                blocks.append(block)
+        return blocks
+
+
+def open_pop_mfdataset(ncfiles, cachefile=None, maxopen=None, backend=None):
+    """Open many POP history files as one virtual dataset (see `PopMFDataset`)"""
+    return PopMFDataset(ncfiles, cachefile=cachefile, maxopen=maxopen, backend=backend)
@@ -0,0 +1,184 @@
+"""
+Shared pool of open netCDF4 datasets
+
+Opening a history file and parsing its metadata costs far more than
+reading a small variable from it. Functions that touch the same files
+repeatedly borrow handles from one process-wide LRU pool instead:
+
+    >>> with ncpool.dataset(fname) as ds:
+    ...     zax = ds.variables['z_w'][:]
+
+The handle stays open after the block and is reused by the next call.
+The number of open files is capped (by default a quarter of the soft
+limit on open files, see `get_ulimitn`); the least recently used handle
+that is not borrowed is closed when the cap is reached. Files modified
+on disk are reopened once they are no longer borrowed. After a fork, the
+child process starts with an empty pool and never touches the handles of
+its parent.
+
+The netCDF-C and HDF5 libraries are not thread-safe (and netCDF4-python
+releases the GIL), so all opens, reads and closes by poppy from more than
+one thread (e.g. the prefetch threads of `poppy.frames`) are serialized by
+`netcdf_lock`. Hold it as well when reading a pooled handle directly while
+frames are being prefetched.
+"""
+import os
+import threading
+import contextlib
+import collections
+import netCDF4
+
+
+def get_ulimitn(default=1024):
+    """Soft limit on the number of open files (`ulimit -n`), `default` if unknown"""
+    try:
+        import resource
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    except (ImportError, ValueError, OSError):
+        return default
+    if soft == resource.RLIM_INFINITY or soft <= 0:
+        return default
+    return int(soft)
+
+
+def default_maxopen():
+    """Default cap on pooled handles, leaving room for other open files"""
+    return max(1, min(get_ulimitn() // 4, 1024))
+
+
+# serializes calls into netCDF-C/HDF5 (see module docstring)
+netcdf_lock = threading.RLock()
+
+
+def open_dataset(fname):
+    """netCDF4.Dataset(fname) opened under `netcdf_lock`"""
+    with netcdf_lock:
+        return netCDF4.Dataset(fname)
+
+
+def _close(ds):
+    with netcdf_lock:
+        ds.close()
+
+
+def file_signature(fname):
+    """(size, mtime) of `fname`, changing whenever the file is rewritten"""
+    stat = os.stat(fname)
+    return stat.st_size, stat.st_mtime
+
+
+class HandlePool:
+    """Bounded LRU pool of open netCDF4 datasets, keyed by absolute path"""
+    def __init__(self, maxopen=None, opener=None):
+        """
+        Parameters
+        ----------
+        maxopen : int, optional
+            maximum number of files kept open (default: `default_maxopen()`)
+        opener : function, optional
+            opener(path) returning an object with a `close` method
+            (default: `open_dataset`)
+        """
+        self.maxopen = maxopen or default_maxopen()
+        self.opener = opener or open_dataset
+        self._lock = threading.RLock()
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._handles = collections.OrderedDict()  # path -> (ds, signature)
+        self._borrowed = collections.Counter()
+
+    def _check_fork(self):
+        if os.getpid() != self._pid:
+            # the parent's handles must not be used (or closed) in a child
+            self._reset()
+
+    def __len__(self):
+        return len(self._handles)
+
+    def __contains__(self, fname):
+        return os.path.abspath(fname) in self._handles
+
+    def get(self, fname):
+        """Open dataset `fname`, reusing a pooled handle if the file is unchanged
+
+        The handle may be closed by a later call once it is evicted; use
+        `borrow` (or `dataset`) to keep it open for the duration of a block.
+        """
+        path = os.path.abspath(fname)
+        with self._lock:
+            self._check_fork()
+            signature = file_signature(path)
+            try:
+                ds, stored = self._handles.pop(path)
+                if stored != signature and self._borrowed[path] == 0:
+                    _close(ds)
+                    raise KeyError(path)
+            except KeyError:
+                ds, stored = self.opener(path), signature
+            self._handles[path] = (ds, stored)
+            self._evict(keep=path)
+            return ds
+
+    def _evict(self, keep=None):
+        excess = len(self._handles) - self.maxopen
+        for path in list(self._handles):
+            if excess <= 0:
+                break
+            if self._borrowed[path] == 0 and path != keep:
+                _close(self._handles.pop(path)[0])
+                excess -= 1
+
+    @contextlib.contextmanager
+    def borrow(self, fname):
+        """Context manager yielding the pooled dataset, protected from eviction"""
+        path = os.path.abspath(fname)
+        with self._lock:
+            ds = self.get(path)
+            self._borrowed[path] += 1
+        try:
+            yield ds
+        finally:
+            with self._lock:
+                if os.getpid() == self._pid:
+                    self._borrowed[path] -= 1
+                    if self._borrowed[path] <= 0:
+                        del self._borrowed[path]
+                    self._evict()
+
+    def release(self, fname):
+        """Close the pooled handle of `fname` (e.g. before rewriting the file)"""
+        path = os.path.abspath(fname)
+        with self._lock:
+            self._check_fork()
+            if path in self._handles and self._borrowed[path] == 0:
+                _close(self._handles.pop(path)[0])
+
+    def close(self):
+        """Close all handles that are not borrowed"""
+        with self._lock:
+            self._check_fork()
+            for path in list(self._handles):
+                if self._borrowed[path] == 0:
+                    _close(self._handles.pop(path)[0])
+
+
+pool = HandlePool()
+
+
+def dataset(fname):
+    """Borrow `fname` from the shared pool (context manager, see `HandlePool.borrow`)"""
+    return pool.borrow(fname)
+
+
+def set_maxopen(maxopen):
+    """Change the cap of the shared pool"""
+    with pool._lock:
+        pool.maxopen = maxopen
+        pool._evict()
+
+
+def close_all():
+    """Close all handles of the shared pool"""
+    pool.close()
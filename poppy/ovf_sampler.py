@@ -0,0 +1,308 @@
+"""
+Sample POP output at the grid points of the overflow parameterization
+
+The points are taken from the overflow namelist parsed with
+`ovfparser.parse_ovf_file` or loaded with `ovfparser.load_ovf_table`. Points are read in batches: each set of
+points (e.g. the product points of one overflow) is split into compact
+clusters and every cluster is read as one hyperslab covering all its
+points and all time levels of a file, from which the points are picked.
+
+The regional boxes (inflow, src, ent) of each overflow are turned into
+volume-weighted averaging operators on the hyperslab covering all boxes
+of that overflow (`get_region_operators`, `get_region_timeseries`).
+"""
+from __future__ import print_function
+import numpy as np
+import netCDF4
+import warnings
+import multiprocessing
+import functools
+
+from . import utils
+from .lazy import LazyModule, available
+
+pd = LazyModule('pandas')
+use_pandas = available('pandas')
+gsw = LazyModule('gsw')
+use_gsw = available('gsw')
+
+settypes = ['src', 'ent', 'prd']
+regionnames = ['inflow', 'src', 'ent']
+
+
+def _as_dict(overflows):
+    """Nested dicts from an `ovfparser.OverflowTable`, dicts are passed through"""
+    if hasattr(overflows, 'to_dict'):
+        return overflows.to_dict()
+    return overflows
+
+
+def _map(func, items, nprocs):
+    """Map `func` over `items`, in a process pool if `nprocs` > 1"""
+    if nprocs > 1 and len(items) > 1:
+        pool = multiprocessing.Pool(min(nprocs, len(items)))
+        try:
+            return pool.map(func, items)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        return [func(item) for item in items]
+
+
+def _split_points(idx, pos, maxgap):
+    """Split points `idx` (npts, 3) into clusters without gaps larger than `maxgap`
+
+    Returns a list of (idx, pos) with `pos` the positions in the original set.
+    """
+    for dim in range(idx.shape[1]):
+        values = np.unique(idx[:,dim])
+        gaps = np.flatnonzero(np.diff(values) > maxgap)
+        if len(gaps):
+            lower = idx[:,dim] <= values[gaps[0]]
+            return (_split_points(idx[lower], pos[lower], maxgap) +
+                    _split_points(idx[~lower], pos[~lower], maxgap))
+    return [(idx, pos)]
+
+
+def get_point_batches(overflows, maxgap=8):
+    """Group the points of all overflows and set types into hyperslab reads
+
+    Parameters
+    ----------
+    overflows : dict
+        parsed overflows (see `ovfparser.parse_ovf_file`, zero-based indices)
+        or `ovfparser.OverflowTable`
+    maxgap : int
+        maximum gap between points in one hyperslab (in grid cells)
+
+    Returns
+    -------
+    list of dict(ovf, settype, npts, slices, local, pos)
+        where `slices` is the (k,j,i) hyperslab, `local` the point
+        indices within the hyperslab and `pos` the positions of the
+        points in the set
+    """
+    overflows = _as_dict(overflows)
+    batches = []
+    for ovf in sorted(overflows):
+        for settype in settypes:
+            try:
+                points = overflows[ovf][settype]
+            except KeyError:
+                continue
+            idx = np.column_stack([points['kk'], points['jj'], points['ii']])
+            pos = np.arange(len(idx))
+            for cidx, cpos in _split_points(idx, pos, maxgap):
+                lower = cidx.min(axis=0)
+                upper = cidx.max(axis=0) + 1
+                batches.append(dict(
+                    ovf=ovf, settype=settype, npts=len(idx),
+                    slices=tuple(slice(a, b) for a, b in zip(lower, upper)),
+                    local=tuple((cidx - lower).T),
+                    pos=cpos))
+    return batches
+
+
+def _sample_file(fname, batches, varns):
+    """Sample `varns` at the points in `batches` for all time levels in `fname`"""
+    with netCDF4.Dataset(fname) as ds:
+        dsvar = ds.variables
+        timeax = np.atleast_1d(utils.get_time_decimal_year(dsvar['time']))
+        nt = len(timeax)
+        samples = {}
+        for batch in batches:
+            sets = samples.setdefault(batch['ovf'], {})
+            for varn in varns:
+                if batch['settype'] not in sets:
+                    sets[batch['settype']] = {}
+                data = sets[batch['settype']].setdefault(
+                        varn, np.full((nt, batch['npts']), np.nan))
+                slab = dsvar[varn][(slice(None),) + batch['slices']]
+                slab = np.ma.filled(slab.astype('f8'), np.nan)
+                data[:,batch['pos']] = slab[(slice(None),) + batch['local']]
+    return timeax, samples
+
+
+def sample_overflow_points(overflows, ncfiles, varns=['TEMP','SALT','UVEL','VVEL'],
+        nprocs=1, maxgap=8):
+    """Sample variables at the overflow grid points for all time steps in `ncfiles`
+
+    Parameters
+    ----------
+    overflows : dict
+        parsed overflows (see `ovfparser.parse_ovf_file`, zero-based indices)
+        or `ovfparser.OverflowTable`
+    ncfiles : list of str
+        paths to input files
+    varns : list of str
+        3D variables to sample
+    nprocs : int
+        number of processes to read the files in parallel
+    maxgap : int
+        maximum gap between points read in one hyperslab
+
+    Returns
+    -------
+    timeax : ndarray
+        decimal years
+    samples : dict
+        samples[ovf][settype][varn] with shape (ntime, npoints),
+        points ordered as in the namelist, NaN on land
+    """
+    batches = get_point_batches(overflows, maxgap=maxgap)
+    sampler = functools.partial(_sample_file, batches=batches, varns=varns)
+    results = _map(sampler, ncfiles, nprocs)
+
+    timeax = np.concatenate([r[0] for r in results])
+    samples = {}
+    for ovf, sets in results[0][1].items():
+        samples[ovf] = {}
+        for settype, data in sets.items():
+            samples[ovf][settype] = {
+                    varn : np.concatenate([r[1][ovf][settype][varn] for r in results])
+                    for varn in data}
+    return timeax, samples
+
+
+def default_eos():
+    """'gsw' if installed, else 'linear' (with a warning)"""
+    if use_gsw:
+        return 'gsw'
+    warnings.warn('gsw not installed, using a linear equation of state for sigma0')
+    return 'linear'
+
+
+def sigma0(salt, temp, eos=None):
+    """Potential density anomaly [kg m-3] referenced to the surface
+
+    Parameters
+    ----------
+    salt, temp : ndarray
+        salinity and potential temperature
+    eos : str, optional
+        equation of state: 'gsw' (TEOS-10) or 'linear' (around T=0 degC,
+        S=34.9, appropriate for overflow waters only);
+        default: `default_eos()`
+    """
+    eos = eos or default_eos()
+    if eos == 'gsw':
+        if not use_gsw:
+            raise ImportError('eos=\'gsw\' requires the gsw package.')
+        return gsw.rho(salt, temp, 0) - 1e3
+    elif eos == 'linear':
+        rho0, alpha, beta = 1028.0, 5.2e-5, 7.8e-4
+        return rho0 * (1. - alpha*temp + beta*(salt - 34.9)) - 1e3
+    raise ValueError('Unknown equation of state \'{}\''.format(eos))
+
+
+def get_region_operators(overflows, ds):
+    """Volume-weighted averaging operators for the regional boxes of the overflows
+
+    Parameters
+    ----------
+    overflows : dict
+        parsed overflows (see `ovfparser.parse_ovf_file`, zero-based indices)
+        or `ovfparser.OverflowTable`
+    ds : netCDF4.Dataset
+        open dataset containing TAREA, dz and KMT
+
+    Returns
+    -------
+    list of dict(ovf, regions, slices, weights)
+        `slices` is the (k,j,i) hyperslab covering all boxes of the overflow
+        and `weights` (nregions, nk, nj, ni) the cell volumes [m^3] of the 
+        ocean cells in each box, 0 elsewhere
+    """
+    dsvar = ds.variables
+    overflows = _as_dict(overflows)
+    dz = dsvar['dz'][:] * 1e-2
+    operators = []
+    for ovf in sorted(overflows):
+        try:
+            boxes = [overflows[ovf]['regions'][name] for name in regionnames]
+        except KeyError:
+            continue
+        lower = [min(box[dim+'min'] for box in boxes) for dim in 'kji']
+        upper = [max(box[dim+'max'] for box in boxes) + 1 for dim in 'kji']
+        slices = tuple(slice(a, b) for a, b in zip(lower, upper))
+        tarea = np.ma.filled(dsvar['TAREA'][slices[1:]], 0.) * 1e-4
+        kmt = dsvar['KMT'][slices[1:]]
+        kk = np.arange(lower[0], upper[0])[:,np.newaxis,np.newaxis]
+        volume = (kk < kmt) * tarea * dz[slices[0]][:,np.newaxis,np.newaxis]
+        weights = np.zeros((len(boxes),) + volume.shape)
+        for r, box in enumerate(boxes):
+            inbox = tuple(slice(box[dim+'min']-a, box[dim+'max']+1-a)
+                    for dim, a in zip('kji', lower))
+            weights[(r,)+inbox] = volume[inbox]
+        operators.append(dict(ovf=ovf, regions=list(regionnames), slices=slices, weights=weights))
+    return operators
+
+
+def _region_means_file(fname, operators, eos=None):
+    """Volume-weighted mean T, S and density in the regions for all time levels in `fname`"""
+    with netCDF4.Dataset(fname) as ds:
+        dsvar = ds.variables
+        timeax = np.atleast_1d(utils.get_time_decimal_year(dsvar['time']))
+        means = []
+        for op in operators:
+            index = (slice(None),) + op['slices']
+            temp = dsvar['TEMP'][index]
+            salt = dsvar['SALT'][index]
+            valid = ~(np.ma.getmaskarray(temp) | np.ma.getmaskarray(salt))
+            temp, salt = np.ma.filled(temp, 0.), np.ma.filled(salt, 0.)
+            rho = sigma0(salt, temp, eos=eos)
+            weights = op['weights'][np.newaxis] * valid[:,np.newaxis]
+            nt, nreg = weights.shape[:2]
+            weights = weights.reshape((nt, nreg, -1))
+            volume = weights.sum(axis=-1)
+            for field in [temp, salt, rho]:
+                with np.errstate(invalid='ignore', divide='ignore'):
+                    # NaN for regions without ocean cells
+                    means.append(np.einsum('trn,tn->tr', weights, field.reshape((nt, -1))) / volume)
+    # (ntime, noverflows*nvariables, nregions)
+    return timeax, np.stack(means, axis=1)
+
+
+def get_region_timeseries(overflows, ncfiles, nprocs=1, eos=None):
+    """Volume-weighted T, S and density time series in the overflow regions
+
+    Reads one hyperslab of TEMP and SALT per overflow and file, covering
+    the inflow, source and entrainment boxes.
+
+    Parameters
+    ----------
+    overflows : dict
+        parsed overflows (see `ovfparser.parse_ovf_file`, zero-based indices)
+        or `ovfparser.OverflowTable`
+    ncfiles : list of str
+        paths to input files
+    nprocs : int
+        number of processes to read the files in parallel
+    eos : str, optional
+        equation of state of the density, 'gsw' or 'linear'
+        (see `sigma0`, default: `default_eos()`)
+
+    Returns
+    -------
+    pandas.DataFrame with columns (Overflow, Region, Variable) indexed by ModelYear
+    or tuple (data, timeax, columns) without Pandas
+    """
+    # decided once here, not in every process
+    eos = eos or default_eos()
+    with netCDF4.Dataset(ncfiles[0]) as ds:
+        operators = get_region_operators(overflows, ds)
+    results = _map(functools.partial(_region_means_file, operators=operators, eos=eos), ncfiles, nprocs)
+    timeax = np.concatenate([r[0] for r in results])
+    data = np.concatenate([r[1] for r in results])
+    variables = ['TEMP', 'SALT', 'SIGMA0']
+    columns = [(op['ovf'], region, varn) for op in operators for region in op['regions'] for varn in variables]
+    # order as (overflow, region, variable)
+    data = data.reshape((len(timeax), len(operators), len(variables), len(regionnames)))
+    data = data.transpose((0, 1, 3, 2)).reshape((len(timeax), -1))
+    if use_pandas:
+        index = pd.Index(timeax, name='ModelYear')
+        cols = pd.MultiIndex.from_tuples(columns, names=('Overflow', 'Region', 'Variable'))
+        return pd.DataFrame(data, index=index, columns=cols)
+    else:
+        return data, timeax, columns
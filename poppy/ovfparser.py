@@ -4,11 +4,16 @@ parameterization namelist files.
 
 These files exist for each ocean grid and contain information
 about the location of grid points used by the ovf parameterization.
+
+`load_ovf_table` returns the same information as compact record arrays,
+cached in binary files next to the namelist that are memory-mapped on
+subsequent loads.
 """
 from __future__ import print_function
 from collections import defaultdict
 import numpy as np
 import itertools
+import os
 
 verbose = False
 
@@ -53,6 +58,13 @@ def parse_ovf_file(fname, outof_into_offset=False, output_zerobased=True):
     output_zerobased : bool
         whether to return the indices zero-based (Python)
         if False, they are returned 1-based (original, Fortran)
+
+    Returns
+    -------
+    dict overflow name -> dict with the overflow `number`, the
+    `regions` (inflow, src, ent boxes) and the point sets
+    (src, ent, prd) with indices `ii`, `jj`, `kk`, sidewall 
+    orientations `dd` and (product) set numbers `set`
     """
     overflows = {}
     regionsdict = defaultdict(Struct)
@@ -75,7 +87,7 @@ def parse_ovf_file(fname, outof_into_offset=False, output_zerobased=True):
                 iovf = int(line[1])
                 ovfname = ''.join(line[2:32].split()).replace('\'','')
                 if verbose: print('Parsing overflow {}'.format(ovfname))
-                overflows[ovfname] = {}
+                overflows[ovfname] = {'number' : iovf}
                 continue
             elif line[:5].isspace() and '! regional' in line:
                 regions_def = True
@@ -101,13 +113,16 @@ def parse_ovf_file(fname, outof_into_offset=False, output_zerobased=True):
                 if '# prd sets' in line:
                     settype = 'prd'
                     nsets = int(line[3])
+                    iset = -1
                     setdict = defaultdict(list)
                     continue
                 elif 'prd' in line:
                     npts = int(line[3])
+                    iset += 1
                     continue
                 else:
                     nsets = 1
+                    iset = 0
                     npts = int(line[3])
                     settype = line[34:37]
                     setdict = defaultdict(list)
@@ -127,6 +142,8 @@ def parse_ovf_file(fname, outof_into_offset=False, output_zerobased=True):
                 setdict['ii'].append(i)
                 setdict['jj'].append(j)
                 setdict['kk'].append(k)
+                setdict['dd'].append(d)
+                setdict['set'].append(iset)
                 npts -= 1
                 if npts > 0:
                     continue
@@ -135,7 +152,7 @@ def parse_ovf_file(fname, outof_into_offset=False, output_zerobased=True):
                     if nsets == 0:
                         for key in setdict.keys():
                             ind = np.array(setdict[key])
-                            if output_zerobased: 
+                            if output_zerobased and key in ['ii','jj','kk']: 
                                 ind -= 1
                             setdict[key] = ind
                         overflows[ovfname][settype] = setdict
@@ -153,3 +170,122 @@ def parse_ovf_file(fname, outof_into_offset=False, output_zerobased=True):
     return overflows
 
 
+point_dtype = np.dtype([
+    ('ovf', 'i2'), ('kind', 'S3'), ('set', 'i2'),
+    ('i', 'i4'), ('j', 'i4'), ('k', 'i4'), ('d', 'i1')])
+
+region_dtype = np.dtype([
+    ('ovf', 'i2'), ('name', 'S32'), ('region', 'S6'),
+    ('imin', 'i4'), ('imax', 'i4'), ('jmin', 'i4'), ('jmax', 'i4'), ('kmin', 'i4'), ('kmax', 'i4')])
+
+_settypes = ['src', 'ent', 'prd']
+_regionnames = ['inflow', 'src', 'ent']
+_regionkeys = ['imin', 'imax', 'jmin', 'jmax', 'kmin', 'kmax']
+
+
+class OverflowTable:
+    """Overflow namelist as record arrays
+
+    Attributes
+    ----------
+    points : record array (point_dtype)
+        all overflow grid points with overflow number, kind (src, ent, prd),
+        product set number, indices and sidewall orientation
+    regions : record array (region_dtype)
+        regional boxes with overflow number and name
+    """
+    def __init__(self, points, regions):
+        self.points = points
+        self.regions = regions
+
+    def __repr__(self):
+        return '<OverflowTable: {} overflows, {} points>'.format(len(self.names), len(self.points))
+
+    @property
+    def names(self):
+        """Overflow names, ordered by overflow number"""
+        _, first = np.unique(self.regions['ovf'], return_index=True)
+        return [name.decode() for name in self.regions['name'][first]]
+
+    def sets(self, kind):
+        """Points of set type `kind` ('src', 'ent' or 'prd') of all overflows"""
+        return self.points[self.points['kind'] == kind.encode()]
+
+    @classmethod
+    def from_dict(cls, overflows):
+        """Build table from the output of `parse_ovf_file`"""
+        points = []
+        regions = []
+        for n, name in enumerate(sorted(overflows, key=lambda k: overflows[k].get('number', 0))):
+            ovf = overflows[name]
+            number = ovf.get('number', n+1)
+            for region in _regionnames:
+                box = ovf['regions'][region]
+                regions.append((number, name, region) + tuple(box[key] for key in _regionkeys))
+            for kind in _settypes:
+                if kind not in ovf:
+                    continue
+                pts = ovf[kind]
+                npts = len(pts['ii'])
+                sets = pts.get('set', np.zeros(npts, int))
+                dd = pts.get('dd', np.zeros(npts, int))
+                for p in range(npts):
+                    points.append((number, kind, sets[p], 
+                        pts['ii'][p], pts['jj'][p], pts['kk'][p], dd[p]))
+        return cls(np.array(points, dtype=point_dtype), np.array(regions, dtype=region_dtype))
+
+    def to_dict(self):
+        """Convert to the nested dicts returned by `parse_ovf_file`"""
+        overflows = {}
+        names = dict(zip(np.unique(self.regions['ovf']), self.names))
+        for number, name in names.items():
+            ovf = overflows[name] = {'number' : int(number), 'regions' : {}}
+            for box in self.regions[self.regions['ovf'] == number]:
+                ovf['regions'][box['region'].decode()] = Struct(
+                        {key : int(box[key]) for key in _regionkeys})
+            for kind in _settypes:
+                pts = self.points[(self.points['ovf'] == number) & (self.points['kind'] == kind.encode())]
+                if len(pts):
+                    ovf[kind] = dict(ii=pts['i'], jj=pts['j'], kk=pts['k'], dd=pts['d'], set=pts['set'])
+        return overflows
+
+    def save(self, prefix):
+        """Save to `prefix`.points.npy and `prefix`.regions.npy"""
+        np.save(prefix + '.points.npy', self.points)
+        np.save(prefix + '.regions.npy', self.regions)
+
+    @classmethod
+    def load(cls, prefix, mmap_mode='r'):
+        """Load (memory-map) from files written by `save`"""
+        return cls(np.load(prefix + '.points.npy', mmap_mode=mmap_mode),
+                   np.load(prefix + '.regions.npy', mmap_mode=mmap_mode))
+
+
+def load_ovf_table(fname, cache=True, **kwargs):
+    """Load a POP overflow namelist file as `OverflowTable`
+    
+    Parameters
+    ----------
+    fname : str
+        path to input file
+    cache : bool
+        memory-map the table from binary files next to `fname` if they are
+        newer than `fname`, otherwise parse the file and (try to) write them
+    kwargs : dict
+        keyword arguments passed to `parse_ovf_file`
+        (only used without cache, the cache holds the default zero-based indices)
+    """
+    if not cache or kwargs:
+        return OverflowTable.from_dict(parse_ovf_file(fname, **kwargs))
+    cachefiles = [fname + suffix for suffix in ['.points.npy', '.regions.npy']]
+    try:
+        if all(os.path.getmtime(f) >= os.path.getmtime(fname) for f in cachefiles):
+            return OverflowTable.load(fname)
+    except OSError:
+        pass
+    table = OverflowTable.from_dict(parse_ovf_file(fname))
+    try:
+        table.save(fname)
+    except (IOError, OSError):
+        print('Warning: Unable to write overflow table cache next to {}'.format(fname))
+    return table
@@ -0,0 +1,331 @@
+"""
+Compute many time series from many cases in one pass over the files
+
+The pipeline is driven by a configuration (JSON, or YAML if PyYAML is
+installed) listing cases, their files and the metrics to compute:
+
+    {
+        "output" : "timeseries.h5",
+        "nprocs" : 8,
+        "backend" : "netcdf4",
+        "cases" : {
+            "ctrl" : {"files" : ["/data/ctrl/ocn/hist/*.pop.h.*.nc"]},
+            "hosing" : {"catalog" : "hist.db", 
+                        "query" : {"case" : "hosing", "stream" : "h", "yearlim" : [300,400]}}
+        },
+        "metrics" : [
+            {"name" : "AMOC", "type" : "amoc", "latlim" : [30,60], "zlim" : [500,9999]},
+            {"name" : "SST_NorthAtlantic", "type" : "region", "varn" : "TEMP",
+             "region" : "NorthAtlantic", "reduce" : "mean"},
+            {"name" : "XMXL_LabradorSea", "type" : "region", "varn" : "XMXL",
+             "region" : "LabradorSea", "reduce" : "nanmax", "scale" : 0.01,
+             "rolling" : {"func" : "max", "window" : 12}}
+        ]
+    }
+
+For every case, the files are globbed and sorted once, grid indices and
+region masks are computed once from the first file (and shared between
+cases on the same grid), and each file is opened once to read the data of
+all metrics, in parallel over files, with the read backend given by
+"backend" (per case or for all cases, see `poppy.backends`). All results
+are written to one HDF5 store under /<case>/<metric>.
+"""
+from __future__ import print_function
+import glob
+import json
+import os
+import multiprocessing
+import functools
+import numpy as np
+
+from .lazy import LazyModule
+from . import grid as poppygrid
+from . import derived
+from . import backends
+from . import catalog
+from . import metrics
+from . import regions
+from . import utils
+
+pd = LazyModule('pandas')
+
+
+def _ndim(dsvar, varn):
+    """Number of dimensions of a POP or derived variable"""
+    if derived.is_derived(varn):
+        varn = derived.registry[varn].inputs[0]
+    return len(dsvar[varn].shape)
+
+
+class Metric:
+    """Time series computed from every file in the pipeline pass
+
+    Subclasses implement `setup` (indices and masks from the first file),
+    `read` (the data of all time steps of one file) and optionally
+    `finalize` (e.g. smoothing over the whole series).
+    """
+    def __init__(self, name, **params):
+        self.name = name
+        self.params = params
+
+    def __repr__(self):
+        return '{}({}, {})'.format(type(self).__name__, self.name, self.params)
+
+    def setup(self, ds, cache):
+        pass
+
+    def read(self, dsvar):
+        raise NotImplementedError
+
+    def finalize(self, data):
+        return data
+
+
+class AMOC(Metric):
+    """Maximum Atlantic overturning within `latlim` and `zlim` (see `metrics.get_amoc`)"""
+    def setup(self, ds, cache):
+        dsvar = ds.variables
+        latlim = self.params.get('latlim', (30,60))
+        zlim = self.params.get('zlim', (500,9999))
+        zax = dsvar['moc_z'][:]/100.
+        latax = dsvar['lat_aux_grid'][:]
+        self.kk = slice(np.argmin(np.abs(zax-zlim[0])), np.argmin(np.abs(zax-zlim[1]))+1)
+        self.jj = slice(np.argmin(np.abs(latax-latlim[0])), np.argmin(np.abs(latax-latlim[1]))+1)
+
+    def read(self, dsvar):
+        return dsvar['MOC'][:,1,0,self.kk,self.jj]
+
+    def finalize(self, amoc):
+        return metrics.reduce_amoc(amoc, self.params.get('window_size', 12))
+
+
+class MHT(Metric):
+    """Maximum northward heat transport within `latlim` (see `metrics.get_mht`)"""
+    def setup(self, ds, cache):
+        latlim = self.params.get('latlim', (30,60))
+        latax = ds.variables['lat_aux_grid'][:]
+        self.jj = slice(np.argmin(np.abs(latax-latlim[0])), np.argmin(np.abs(latax-latlim[1]))+1)
+
+    def read(self, dsvar):
+        return dsvar['N_HEAT'][:,0,self.params.get('component', 0),self.jj]
+
+    def finalize(self, nheat):
+        return metrics.reduce_mht(nheat, self.params.get('window_size', 12))
+
+
+class MST(Metric):
+    """Northward salt transport at `lat0` (see `metrics.get_mst`)"""
+    def setup(self, ds, cache):
+        latax = ds.variables['lat_aux_grid'][:]
+        self.j0 = np.argmin(np.abs(latax-self.params.get('lat0', 55)))
+
+    def read(self, dsvar):
+        return dsvar['N_SALT'][:,0,self.params.get('component', 0),self.j0]
+
+    def finalize(self, nsalt):
+        return metrics.reduce_mst(nsalt, self.params.get('window_size', 12))
+
+
+class RegionReduction(Metric):
+    """Field `varn` at level `k` reduced over a region
+
+    Parameters (in the configuration)
+    ---------------------------------
+    varn : str
+        POP or derived variable (see `poppy.derived`)
+    grid : str
+        'T' or 'U'
+    region : str or dict
+        name in `regions.regionlims` or dict(lonlim, latlim)
+        (default: all ocean points)
+    k : int
+        level of 3D variables
+    reduce : str
+        'mean' (area-weighted), 'integral' (area-weighted sum in m2)
+        or the name of a NumPy function (e.g. 'nanmax')
+    scale : float
+        factor applied to the result
+    rolling : dict(func, window), optional
+        centred rolling statistic applied to the series (e.g. annual max)
+    """
+    def setup(self, ds, cache):
+        dsvar = ds.variables
+        grid = self.params.get('grid', 'T')
+        region = self.params.get('region')
+        lims = regions.get_region(region) if region is not None else {}
+        key = (grid, repr(sorted(lims.items())), dsvar['KM'+grid].shape)
+        if key not in cache:
+            mask = dsvar['KM'+grid][:] > 0
+            if lims:
+                mask &= poppygrid.get_mask_lonlat(ds, grid=grid, **lims)
+            cache[key] = mask
+        self.jj, self.ii = np.nonzero(cache[key])
+        self.jslice = slice(self.jj.min(), self.jj.max()+1)
+        self.islice = slice(self.ii.min(), self.ii.max()+1)
+        self.jj = self.jj - self.jslice.start
+        self.ii = self.ii - self.islice.start
+        if self.params.get('reduce', 'mean') in ['mean', 'integral']:
+            area = dsvar[grid+'AREA'][self.jslice,self.islice][self.jj,self.ii] * 1e-4
+            self.weights = area / area.sum() if self.params.get('reduce', 'mean') == 'mean' else area
+        if _ndim(dsvar, self.params['varn']) == 4:
+            self.index = (slice(None), self.params.get('k', 0), self.jslice, self.islice)
+        else:
+            self.index = (slice(None), self.jslice, self.islice)
+
+    def read(self, dsvar):
+        data = derived.read(dsvar, self.params['varn'], self.index)
+        data = np.ma.filled(np.ma.asarray(data, dtype='f8'), np.nan)[:,self.jj,self.ii]
+        reduce = self.params.get('reduce', 'mean')
+        if reduce in ['mean', 'integral']:
+            return np.nansum(data * self.weights, axis=-1)
+        return getattr(np, reduce)(data, axis=-1)
+
+    def finalize(self, data):
+        data = data * self.params.get('scale', 1.)
+        rolling = self.params.get('rolling')
+        if rolling:
+            series = pd.Series(data)
+            data = getattr(series.rolling(rolling['window'], center=True), rolling['func'])().values
+        return data
+
+
+metrictypes = {
+    'amoc' : AMOC,
+    'mht' : MHT,
+    'mst' : MST,
+    'region' : RegionReduction,
+    }
+
+
+def load_config(fname):
+    """Read a pipeline configuration from a JSON or YAML file"""
+    with open(fname) as f:
+        if os.path.splitext(fname)[-1] in ['.yml', '.yaml']:
+            import yaml
+            return yaml.safe_load(f)
+        return json.load(f)
+
+
+def get_metrics(config):
+    """Metric objects from the 'metrics' list of the configuration"""
+    metrics = []
+    for spec in config['metrics']:
+        spec = dict(spec)
+        try:
+            cls = metrictypes[spec.pop('type')]
+        except KeyError as err:
+            raise ValueError('Unknown metric type {}. Choose from {}.'.format(err, sorted(metrictypes)))
+        metrics.append(cls(spec.pop('name'), **spec))
+    return metrics
+
+
+def find_files(patterns, sort=True):
+    """Files matching the glob pattern(s) of a case"""
+    if isinstance(patterns, str):
+        patterns = [patterns]
+    files = [fname for pattern in patterns for fname in glob.glob(os.path.expanduser(pattern))]
+    return sorted(files) if sort else files
+
+
+def _read_file(fname, metrics, backend=None):
+    """Time axis and the raw data of all metrics from one file"""
+    with backends.open_file(fname, backend) as ds:
+        dsvar = ds.variables
+        timeax = np.atleast_1d(utils.get_time_decimal_year(dsvar['time']))
+        return timeax, [metric.read(dsvar) for metric in metrics]
+
+
+def _map(func, items, nprocs):
+    if nprocs > 1 and len(items) > 1:
+        pool = multiprocessing.Pool(min(nprocs, len(items)))
+        try:
+            return pool.map(func, items, chunksize=max(1, len(items)//(4*nprocs)))
+        finally:
+            pool.close()
+            pool.join()
+    return [func(item) for item in items]
+
+
+def run_case(files, metrics, nprocs=1, cache=None, backend=None):
+    """Compute all `metrics` from `files` in one pass
+
+    Parameters
+    ----------
+    files : list of str
+        input files, sorted in time
+    metrics : list of Metric
+        metrics to compute
+    nprocs : int
+        number of processes reading files in parallel
+    cache : dict, optional
+        grid masks shared between cases
+    backend : str, optional
+        read backend (see `poppy.backends`)
+
+    Returns
+    -------
+    pandas.DataFrame with one column per metric, indexed by ModelYear
+    """
+    if not files:
+        raise ValueError('No files found. Check your glob pattern.')
+    cache = {} if cache is None else cache
+    with backends.open_file(files[0], backend) as ds:
+        for metric in metrics:
+            metric.setup(ds, cache)
+    results = _map(functools.partial(_read_file, metrics=metrics, backend=backend), files, nprocs)
+    timeax = np.concatenate([r[0] for r in results])
+    columns = {}
+    for m, metric in enumerate(metrics):
+        data = np.ma.concatenate([r[1][m] for r in results])
+        columns[metric.name] = metric.finalize(np.ma.filled(np.ma.asarray(data, dtype='f8'), np.nan))
+    index = pd.Index(timeax, name='ModelYear')
+    return pd.DataFrame(columns, index=index, columns=[metric.name for metric in metrics])
+
+
+def run(config, cases=None, nprocs=None, output=None, verbose=True):
+    """Run the pipeline described by `config`
+
+    Parameters
+    ----------
+    config : dict or str
+        configuration or path to configuration file
+    cases : list of str, optional
+        run only these cases
+    nprocs : int, optional
+        overrides 'nprocs' of the configuration
+    output : str, optional
+        overrides 'output' of the configuration
+
+    Returns
+    -------
+    dict case -> DataFrame
+    """
+    if not isinstance(config, dict):
+        config = load_config(config)
+    nprocs = nprocs or config.get('nprocs', 1)
+    output = output or config.get('output')
+    cache = {}
+    results = {}
+    for case, spec in sorted(config['cases'].items()):
+        if cases and case not in cases:
+            continue
+        if 'catalog' in spec:
+            files = catalog.Query(spec['catalog'], **spec.get('query', {})).files()
+        else:
+            files = find_files(spec['files'], sort=spec.get('sort', True))
+        if verbose:
+            print('Processing {} files of case {} ...'.format(len(files), case))
+        metrics = get_metrics(dict(config, metrics=config['metrics'] + spec.get('metrics', [])))
+        df = run_case(files, metrics, nprocs=nprocs, cache=cache,
+                backend=spec.get('backend', config.get('backend')))
+        results[case] = df
+        if output:
+            with pd.HDFStore(output, mode='a') as store:
+                for name in df.columns:
+                    key = '{}/{}'.format(case, name)
+                    if key in store:
+                        store.remove(key)
+                    store.put(key, df[name], format='table')
+            if verbose:
+                print('Saved {} time series of case {} to {}'.format(len(df.columns), case, output))
+    return results
@@ -0,0 +1,261 @@
+"""
+Multi-resolution aggregate pyramids for long time series
+
+A pyramid stores a time series (indexed by decimal model year) in an
+HDF5 file together with its min/mean/max aggregates at daily, monthly,
+annual and decadal resolution:
+
+    <key>/raw, <key>/daily, <key>/monthly, <key>/annual, <key>/decadal
+
+Plotting helpers pick the coarsest level that still has about one value
+per pixel for the requested time span, so long series are plotted without
+re-reading and re-smoothing the raw data.
+
+A pyramid can record what it was computed from (parameters and input
+files, see `source_attrs`), so that `build_if_missing` rebuilds it when
+they change instead of returning a stale series.
+"""
+import os
+import json
+import numpy as np
+
+from . import ncpool
+from .lazy import LazyModule
+pd = LazyModule('pandas')
+
+# (name, values per year), from fine to coarse
+levels = [
+    ('daily', 365.),
+    ('monthly', 12.),
+    ('annual', 1.),
+    ('decadal', 0.1),
+    ]
+
+stats = ['min', 'mean', 'max']
+
+
+def _as_frame(ts):
+    if isinstance(ts, pd.Series):
+        return ts.to_frame(name=(ts.name or 'value'))
+    return ts
+
+
+def _flatten(agg):
+    """(variable, stat) columns to 'variable_stat' for storage"""
+    flat = agg.copy()
+    flat.columns = ['{}_{}'.format(*col) for col in agg.columns]
+    return flat
+
+
+def _unflatten(flat):
+    agg = flat.copy()
+    agg.columns = pd.MultiIndex.from_tuples(
+            [tuple(col.rsplit('_',1)) for col in flat.columns], names=['variable','stat'])
+    return agg
+
+
+def aggregate(ts, nperyear):
+    """Min/mean/max of `ts` in bins of 1/`nperyear` years
+
+    Parameters
+    ----------
+    ts : pandas.Series or DataFrame
+        time series indexed by decimal year
+    nperyear : float
+        number of bins per year
+
+    Returns
+    -------
+    DataFrame with columns (variable, stat) indexed by the bin centres
+    """
+    df = _as_frame(ts)
+    bins = np.floor(np.asarray(df.index, dtype='f8')*nperyear + 1e-6)
+    grouped = df.groupby(bins, sort=True)
+    agg = pd.concat([getattr(grouped, stat)() for stat in stats], axis=1, keys=stats)
+    agg = agg.swaplevel(0, 1, axis=1)[[(col, stat) for col in df.columns for stat in stats]]
+    agg.columns.names = ['variable','stat']
+    agg.index = pd.Index((agg.index.values + 0.5) / nperyear, name=df.index.name or 'ModelYear')
+    return agg
+
+
+def _normalize(attrs):
+    # as read back from JSON (lists for tuples, ...)
+    return json.loads(json.dumps(attrs))
+
+
+def source_attrs(ncfiles, **params):
+    """Description of a series computed from `ncfiles` with `params`
+
+    Holds the parameters and the path, size and mtime of every file
+    (see `ncpool.file_signature`).
+    """
+    files = [[os.path.abspath(fname)] + list(ncpool.file_signature(fname)) for fname in ncfiles]
+    return _normalize(dict(params, files=files))
+
+
+def build_pyramid(ts, store, key, attrs=None):
+    """Store `ts` and its aggregates at all levels coarser than its resolution
+
+    Parameters
+    ----------
+    ts : pandas.Series or DataFrame
+        time series indexed by decimal year
+    store : str
+        path to HDF5 file
+    key : str
+        group to store the pyramid in
+    attrs : dict, optional
+        description of the series (JSON serializable, e.g. `source_attrs`)
+
+    Returns
+    -------
+    list of levels written
+    """
+    df = _as_frame(ts).sort_index()
+    df.index = pd.Index(np.asarray(df.index, dtype='f8'), name=df.index.name or 'ModelYear')
+    dt = np.median(np.diff(df.index.values)) if len(df) > 1 else 0.
+    written = []
+    with pd.HDFStore(store, mode='a') as hdf:
+        for name in ['raw'] + [name for name, _ in levels]:
+            if '{}/{}'.format(key, name) in hdf:
+                hdf.remove('{}/{}'.format(key, name))
+        hdf.put('{}/raw'.format(key), df, format='table')
+        hdf.get_storer('{}/raw'.format(key)).attrs.source = json.dumps(attrs)
+        for name, nperyear in levels:
+            if dt >= (1. - 1e-3) / nperyear:
+                # not coarser than the raw data
+                continue
+            hdf.put('{}/{}'.format(key, name), _flatten(aggregate(df, nperyear)), format='table')
+            written.append(name)
+    return written
+
+
+def get_attrs(store, key):
+    """Description stored with pyramid `key` (None if none was given)"""
+    with pd.HDFStore(store, mode='r') as hdf:
+        return json.loads(getattr(hdf.get_storer('{}/raw'.format(key)).attrs, 'source', 'null'))
+
+
+def has_pyramid(store, key, attrs=None):
+    """Whether `store` exists and holds pyramid `key` (built with `attrs`, if given)"""
+    if not os.path.exists(store):
+        return False
+    with pd.HDFStore(store, mode='r') as hdf:
+        if '{}/raw'.format(key) not in hdf:
+            return False
+    return attrs is None or get_attrs(store, key) == _normalize(attrs)
+
+
+def build_if_missing(store, key, compute, attrs=None):
+    """Build pyramid `key` from the series returned by `compute()` unless `store` holds it
+
+    `compute` is only called (e.g. to read a metric from the model output)
+    if the pyramid is missing or was built with other `attrs` (e.g. other
+    parameters or input files, see `source_attrs`), so later plots only
+    read `store`.
+    """
+    if not has_pyramid(store, key, attrs):
+        build_pyramid(compute(), store, key, attrs)
+
+
+def available_levels(store, key):
+    """Levels stored for `key`, from fine to coarse"""
+    with pd.HDFStore(store, mode='r') as hdf:
+        return [name for name, _ in levels if '{}/{}'.format(key, name) in hdf]
+
+
+def select_level(store, key, timelim=None, npixels=1000, finest=None):
+    """Coarsest level with at least `npixels` values within `timelim`
+
+    With `finest` (e.g. 'annual' instead of a running annual mean), no
+    finer level than `finest` is selected: the finest stored level at
+    least as coarse is used if none has `npixels` values.
+    """
+    if timelim is None or None in timelim:
+        with pd.HDFStore(store, mode='r') as hdf:
+            index = hdf.select_column('{}/raw'.format(key), 'index')
+        timelim = timelim or (None, None)
+        timelim = (index.min() if timelim[0] is None else timelim[0],
+                   index.max() if timelim[1] is None else timelim[1])
+    span = timelim[1] - timelim[0]
+    nperyear = dict(levels)
+    names = available_levels(store, key)
+    if finest is not None:
+        names = [name for name in names if nperyear[name] <= nperyear[finest]]
+    for name in reversed(names):
+        if span * nperyear[name] >= npixels:
+            return name
+    if finest is not None and names:
+        return names[0]
+    return 'raw'
+
+
+def read_level(store, key, level, timelim=None):
+    """Read level `level` of pyramid `key` within `timelim`
+
+    Returns a DataFrame with columns (variable, stat); for the raw data,
+    min, mean and max are all the raw values.
+    """
+    where = []
+    if timelim is not None:
+        if timelim[0] is not None:
+            where.append('index >= {!r}'.format(float(timelim[0])))
+        if timelim[1] is not None:
+            where.append('index <= {!r}'.format(float(timelim[1])))
+    data = pd.read_hdf(store, '{}/{}'.format(key, level), where=(' & '.join(where) or None))
+    if level == 'raw':
+        agg = pd.concat([data]*len(stats), axis=1, keys=stats).swaplevel(0, 1, axis=1)
+        agg = agg[[(col, stat) for col in data.columns for stat in stats]]
+        agg.columns.names = ['variable','stat']
+        return agg
+    return _unflatten(data)
+
+
+def read_adequate(store, key, timelim=None, npixels=1000, finest=None):
+    """Read the coarsest level adequate for `npixels` values within `timelim`
+
+    No level finer than `finest` is read (see `select_level`).
+
+    Returns
+    -------
+    level, data
+    """
+    level = select_level(store, key, timelim, npixels, finest=finest)
+    return level, read_level(store, key, level, timelim)
+
+
+def plot_pyramid(ax, store, key, variable=None, timelim=None, npixels=None,
+        shade=True, **kwargs):
+    """Plot mean and min/max range of a stored pyramid on `ax`
+
+    Parameters
+    ----------
+    ax : axis
+        axis to plot on
+    store, key : str
+        HDF5 file and pyramid group
+    variable : str, optional
+        variable to plot (default: first)
+    timelim : tuple, optional
+        time span to plot
+    npixels : int, optional
+        number of values to aim for (default: axis width in pixels)
+    shade : bool
+        shade the range between min and max
+    kwargs : dict
+        keyword arguments passed to ax.plot
+
+    Returns
+    -------
+    level used
+    """
+    if npixels is None:
+        npixels = int(ax.get_window_extent().width)
+    level, data = read_adequate(store, key, timelim, npixels)
+    variable = variable or data.columns.get_level_values('variable')[0]
+    data = data[variable]
+    lines = ax.plot(data.index, data['mean'], **kwargs)
+    if shade and level != 'raw':
+        ax.fill_between(data.index, data['min'], data['max'],
+                color=lines[0].get_color(), alpha=0.3, linewidth=0)
+    return level
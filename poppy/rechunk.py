@@ -0,0 +1,355 @@
+"""
+Time-contiguous store of selected variables of a file set
+
+POP writes one history file per month, so the time series of one point
+or a small region touches every file. `build_store` copies selected
+variables of a file set into one local netCDF-4 file whose chunks are
+long in time and small in space, and appends the files not yet stored on
+later calls (e.g. as new months arrive):
+
+    >>> rechunk.build_store('ctrl.store.nc', '/data/ctrl/ocn/hist/*.pop.h.*.nc',
+    ...     variables=['MOC', 'N_HEAT', 'TEMP'])
+
+Metrics read time-dependent data from a store instead of the files when
+the store holds the variables and all requested files, unchanged since
+they were stored (see `find_store`). Stores are searched in `stores`,
+initialised from the environment variable POPPY_STORES (paths separated
+by os.pathsep):
+
+    >>> rechunk.stores.append('ctrl.store.nc')
+    >>> metrics.get_timeseries(files, 'TEMP', 'T', latlim=(60,65), lonlim=(-40,-30))
+
+The store is a plain netCDF-4 file readable with every read backend
+(see `poppy.backends`). Missing values of floating point variables are
+stored as NaN. Coordinates and constants (variables with at most one
+dimension and no time dimension) are copied from the first file.
+"""
+from __future__ import print_function
+import os
+import numpy as np
+import netCDF4
+
+from . import utils
+from . import derived
+from . import catalog
+from . import backends
+from . import ncpool
+
+# steps per chunk along time, uncompressed bytes per chunk and bytes buffered per write
+default_tchunk = 120
+default_chunk_bytes = 2**20
+default_buffer_bytes = 512 * 2**20
+
+# stores searched by `find_store`
+stores = [path for path in os.environ.get('POPPY_STORES', '').split(os.pathsep) if path]
+
+
+def store_chunks(shape, itemsize, tchunk=None, chunk_bytes=None):
+    """Chunk shape of a (time, ...) variable: `tchunk` steps long, about `chunk_bytes` large
+
+    The spatial dimensions are halved, largest first, until a chunk fits.
+    """
+    tchunk = tchunk or default_tchunk
+    spatial = list(shape[1:])
+    budget = max(1, (chunk_bytes or default_chunk_bytes) // (itemsize * tchunk))
+    while spatial and np.prod(spatial) > budget:
+        d = int(np.argmax(spatial))
+        spatial[d] = (spatial[d] + 1) // 2
+    return (tchunk,) + tuple(spatial)
+
+
+def _create(storefile, fname, variables, tchunk=None, chunk_bytes=None, backend=None):
+    """Create an empty store for `variables` with the dimensions and metadata of `fname`"""
+    tchunk = tchunk or default_tchunk
+    with backends.open_file(fname, backend) as f, \
+            netCDF4.Dataset(storefile, 'w', format='NETCDF4') as ds:
+        ds.setncatts(dict(
+            title='poppy time-contiguous store',
+            variables=' '.join(variables),
+            tchunk=tchunk))
+        ds.createDimension('source', None)
+        ds.createVariable('source_file', str, ('source',))
+        ds.createVariable('source_size', 'i8', ('source',))
+        ds.createVariable('source_mtime', 'f8', ('source',))
+        ds.createVariable('source_ntime', 'i4', ('source',))
+        for name, size in f.dimensions.items():
+            ds.createDimension(name, None if name == 'time' else size)
+        static = [name for name, var in f.variables.items()
+                if len(var.dimensions) <= 1 and 'time' not in var.dimensions]
+        for name in ['time'] + list(variables) + static:
+            if name in ds.variables:
+                continue
+            var = f.variables[name]
+            if var.dtype.kind not in 'iuf':
+                continue
+            attrs = dict((attr, value) for attr, value in f.attributes(name).items()
+                    if attr not in ['_FillValue', 'missing_value', 'scale_factor', 'add_offset'])
+            dtype = np.promote_types(var.dtype, 'f4') if 'scale_factor' in f.attributes(name) else var.dtype
+            kwargs = {}
+            if var.dimensions and var.dimensions[0] == 'time':
+                kwargs = dict(zlib=True, shuffle=True,
+                        chunksizes=store_chunks(var.shape, dtype.itemsize, tchunk, chunk_bytes))
+            if dtype.kind == 'f':
+                kwargs['fill_value'] = np.nan
+            newvar = ds.createVariable(name, dtype, var.dimensions, **kwargs)
+            newvar.setncatts(attrs)
+            if name not in variables and name != 'time':
+                newvar[...] = f.read(name)
+
+
+def _batches(ntime, start, tchunk, maxsteps):
+    """Groups of consecutive files, ending at chunk boundaries where possible"""
+    batches = []
+    batch = []
+    nsteps = 0
+    for n, nt in enumerate(ntime):
+        batch.append(n)
+        nsteps += nt
+        if nsteps >= maxsteps or (start + nsteps) % tchunk == 0:
+            batches.append(batch)
+            start += nsteps
+            batch = []
+            nsteps = 0
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def _check_steps(ds, storefile):
+    """Number of time steps owned by the source files of the open store `ds`
+
+    The data of a batch are written before its source files are recorded,
+    so an interrupted append can leave steps after the owned ones, which
+    are ignored. Fewer steps than owned mean a corrupt store (ValueError).
+    """
+    ntime = ds.variables['source_ntime'][:]
+    nstored = int(np.sum(ntime)) if len(ntime) else 0
+    if len(ds.variables['time']) < nstored:
+        raise ValueError('Store {} has {} time steps but its source files have {}. '
+                'Build a new store.'.format(storefile, len(ds.variables['time']), nstored))
+    return nstored
+
+
+def build_store(storefile, ncfiles, variables=None, tchunk=None, chunk_bytes=None,
+        buffer_bytes=None, backend=None, verbose=False):
+    """Create `storefile` from `ncfiles` or append the files not yet stored
+
+    Parameters
+    ----------
+    storefile : str
+        netCDF-4 store (created if it does not exist)
+    ncfiles : list of str, glob pattern or catalog.Query
+        input files, sorted in time
+    variables : list of str
+        time-dependent variables to store
+        (default: those of the existing store)
+    tchunk : int, optional
+        chunk length along time (default `default_tchunk`)
+    chunk_bytes : int, optional
+        uncompressed size of a chunk (default `default_chunk_bytes`)
+    buffer_bytes : int, optional
+        bytes of input buffered before writing (default `default_buffer_bytes`)
+    backend : str, optional
+        read backend for the input files (see `poppy.backends`)
+
+    Returns
+    -------
+    number of files appended
+    """
+    ncfiles = catalog.resolve_files(ncfiles)
+    if not os.path.exists(storefile):
+        if not variables:
+            raise ValueError('Give the variables to store in the new store {}.'.format(storefile))
+        if not ncfiles:
+            raise ValueError('No files found. Check your glob pattern.')
+        _create(storefile, ncfiles[0], variables, tchunk=tchunk, chunk_bytes=chunk_bytes, backend=backend)
+    with netCDF4.Dataset(storefile, 'a') as ds:
+        dsvar = ds.variables
+        stored = ds.getncattr('variables').split()
+        variables = variables or stored
+        missing = [varn for varn in variables if varn not in stored]
+        if missing:
+            raise ValueError('Store {} does not hold {}. Build a new store.'.format(storefile, missing))
+        tchunk = int(ds.getncattr('tchunk'))
+        nstored = _check_steps(ds, storefile)
+        known = set(str(fname) for fname in dsvar['source_file'][:])
+        new = [fname for fname in ncfiles if os.path.abspath(fname) not in known]
+        if not new:
+            return 0
+        ntime = []
+        for fname in new:
+            with backends.open_file(fname, backend) as f:
+                ntime.append(f.variables['time'].shape[0])
+        step_bytes = sum(int(np.prod(dsvar[varn].shape[1:])) * dsvar[varn].dtype.itemsize
+                for varn in stored)
+        maxsteps = max(1, (buffer_bytes or default_buffer_bytes) // max(1, step_bytes))
+        tunits = dsvar['time'].units
+        # steps after those of the source files (left by an interrupted append) are overwritten
+        t0 = nstored
+        for batch in _batches(ntime, nstored, tchunk, maxsteps):
+            data = dict((varn, []) for varn in ['time'] + stored)
+            for n in batch:
+                with backends.open_file(new[n], backend) as f:
+                    if f.attributes('time').get('units') != tunits:
+                        raise ValueError('Time units of {} differ from those of the store ({}).'.format(
+                            new[n], tunits))
+                    for varn in data:
+                        data[varn].append(f.read(varn))
+            times = np.concatenate(data['time'])
+            if t0 > 0 and times[0] <= dsvar['time'][t0-1]:
+                raise ValueError('{} starts before the end of store {}. Build a new store.'.format(
+                    new[batch[0]], storefile))
+            for varn, parts in data.items():
+                dsvar[varn][t0:t0+len(times)] = np.concatenate(parts)
+            for n in batch:
+                s = len(dsvar['source_file'])
+                size, mtime = ncpool.file_signature(new[n])
+                dsvar['source_file'][s] = os.path.abspath(new[n])
+                dsvar['source_size'][s] = size
+                dsvar['source_mtime'][s] = mtime
+                dsvar['source_ntime'][s] = ntime[n]
+            ds.sync()
+            t0 += len(times)
+            if verbose:
+                print('Stored {} of {} files'.format(batch[-1]+1, len(new)))
+        return len(new)
+
+
+class RechunkedStore:
+    """Open store, mapping files to their time steps in the store"""
+    def __init__(self, storefile, backend=None):
+        """
+        Parameters
+        ----------
+        storefile : str
+            store created by `build_store`
+        backend : str, optional
+            read backend for the data (see `poppy.backends`)
+        """
+        self.fname = storefile
+        with netCDF4.Dataset(storefile) as ds:
+            dsvar = ds.variables
+            # time steps of the source files, later ones are ignored
+            self.ntime = _check_steps(ds, storefile)
+            self.files = [str(fname) for fname in dsvar['source_file'][:]]
+            self.signatures = list(zip(dsvar['source_size'][:], dsvar['source_mtime'][:]))
+            ntime = np.asarray(dsvar['source_ntime'][:], dtype=int)
+            self.stored = ds.getncattr('variables').split()
+            self.tchunk = int(ds.getncattr('tchunk'))
+        self.offsets = np.concatenate([[0], np.cumsum(ntime)]).astype(int)
+        self._fileindex = dict((fname, n) for n, fname in enumerate(self.files))
+        self._f = backends.open_file(storefile, backend)
+        self.variables = self._f.variables
+
+    def __repr__(self):
+        return '<RechunkedStore {}: {} files, {}>'.format(self.fname, len(self.files), ', '.join(self.stored))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self._f.close()
+
+    def holds(self, varnames):
+        """Whether all of `varnames` (POP or derived) can be read from the store"""
+        for varn in varnames:
+            if derived.is_derived(varn):
+                dvar = derived.registry[varn]
+                if not self.holds(dvar.inputs) or any(c not in self.variables for c in dvar.constants):
+                    return False
+            elif varn not in self.stored:
+                return False
+        return True
+
+    def time_index(self, ncfiles):
+        """Index along time of the steps of `ncfiles`
+
+        Returns a slice if the steps are consecutive, else an integer array;
+        None if a file is not in the store or was modified since it was
+        stored (files that no longer exist are taken from the store).
+        """
+        tt = []
+        for fname in ncfiles:
+            path = os.path.abspath(fname)
+            n = self._fileindex.get(path)
+            if n is None:
+                return None
+            if os.path.exists(path) and ncpool.file_signature(path) != tuple(self.signatures[n]):
+                return None
+            tt.append(np.arange(self.offsets[n], self.offsets[n+1]))
+        tt = np.concatenate(tt) if tt else np.zeros(0, int)
+        if len(tt) and np.all(np.diff(tt) == 1):
+            return slice(int(tt[0]), int(tt[-1]) + 1)
+        return tt
+
+    def time_blocks(self, tindex):
+        """Split `tindex` into chunk-aligned blocks (slices where consecutive)"""
+        tt = np.arange(self.ntime)[tindex]
+        blocks = []
+        for block in np.split(tt, np.flatnonzero(np.diff(tt // self.tchunk)) + 1):
+            if not len(block):
+                continue
+            if np.all(np.diff(block) == 1):
+                blocks.append(slice(int(block[0]), int(block[-1]) + 1))
+            else:
+                blocks.append(block)
+        return blocks
+
+    def get_time_decimal_year(self):
+        """Decimal model years of all time steps of the source files in the store"""
+        timevar = self.variables['time']
+        return np.atleast_1d(utils.time_to_decimal_year(
+            timevar[:self.ntime], timevar.units, getattr(timevar, 'calendar', 'standard')))
+
+
+def find_store(ncfiles, varnames, backend=None):
+    """First store in `stores` holding `varnames` and all `ncfiles`
+
+    Returns
+    -------
+    (RechunkedStore, time index) or (None, None)
+    """
+    for path in stores:
+        if not os.path.exists(path):
+            continue
+        try:
+            store = RechunkedStore(path, backend=backend)
+        except ValueError as err:
+            print('Warning: {}'.format(err))
+            continue
+        if store.holds(varnames):
+            tindex = store.time_index(ncfiles)
+            if tindex is not None:
+                return store, tindex
+        store.close()
+    return None, None
+
+
+def select_store(ncfiles, varnames, backend=None, store=None):
+    """Store holding the variables `varnames` of all `ncfiles`, as used by the metrics
+
+    Parameters
+    ----------
+    store : str or False, optional
+        store to use (ValueError if it does not hold all files);
+        if None, the first suitable store in `stores`; if False, none
+
+    Returns
+    -------
+    (RechunkedStore, time index of `ncfiles` in it) or (None, slice(None))
+    """
+    if store is None:
+        ds, tindex = find_store(ncfiles, varnames, backend=backend)
+        if ds is not None:
+            return ds, tindex
+    elif store is not False:
+        ds = RechunkedStore(store, backend=backend)
+        tindex = ds.time_index(ncfiles) if ds.holds(varnames) else None
+        if tindex is None:
+            ds.close()
+            raise ValueError('Store {} does not hold {} of all files.'.format(store, varnames))
+        return ds, tindex
+    return None, slice(None)
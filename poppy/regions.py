@@ -0,0 +1,33 @@
+"""
+Named regions used by the time series scripts and the pipeline
+
+Each region is given by longitude and latitude limits (see
+`grid.get_mask_lonlat` and `grid.get_grid_mask`). Longitude limits
+crossing the zero meridian are written west to east, e.g. (-80,40).
+"""
+
+regionlims = {
+        'Global' : dict(lonlim=(-180,180),latlim=(-90,90)),
+        'Atlantic' : dict(lonlim=(-80,40),latlim=(-70,70)),
+        'PolarNorthAtlantic': dict(lonlim=(-80,60),latlim=(60,90)),
+        'NNA': dict(lonlim=(-80,60),latlim=(50,90)),
+        'LabradorSea': dict(latlim=(50,60), lonlim=(-50,-40)),
+        'NorthAtlantic' : dict(lonlim=(-80,20),latlim=(0,65)),
+        'SubpolarNorthAtlantic': dict(lonlim=(-60,0),latlim=(40,65)),
+        'SubtropicalNorthAtlantic': dict(lonlim=(-100,0),latlim=(10,30)),
+        'TreguierNorthAtlantic': dict(lonlim=(-100,20),latlim=(10,50)),
+        'SubtropicalSouthAtlantic': dict(lonlim=(-50,20),latlim=(-40,-10)),
+        'BrazilEastCoast20S40W': dict(lonlim=(-45,-20),latlim=(-30,-10)),
+        'EquatorialAtlantic': dict(lonlim=(-55,15),latlim=(-10,10)),
+        'SubtropicalSouthPacific': dict(lonlim=(150,280),latlim=(-40,-10)),
+        }
+
+
+def get_region(region):
+    """Region limits dict(lonlim, latlim) for a region name or dict"""
+    if isinstance(region, dict):
+        return dict(lonlim=region.get('lonlim'), latlim=region.get('latlim'))
+    try:
+        return dict(regionlims[region])
+    except KeyError:
+        raise ValueError('Unknown region {}. Choose from {}.'.format(region, sorted(regionlims)))
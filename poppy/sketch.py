@@ -0,0 +1,171 @@
+"""
+Streaming statistics of many fields for choosing color levels
+
+`QuantileSketch` keeps the exact min, max and count and approximate
+quantiles of all values it has seen in bounded memory. Sketches of
+different frames or files can be merged, so they can be built in parallel:
+
+    >>> sketch = sketch_files(ncfiles, reader, nprocs=8)
+    >>> levels = robust_levels(sketch)
+
+The quantile estimate uses a compactor hierarchy (as in the KLL sketch):
+values are collected at level 0 and whenever a level holds more than
+`k` values, every second of them (after sorting) is promoted to the next
+level with twice the weight.
+"""
+import multiprocessing
+import functools
+import numpy as np
+import netCDF4
+
+from . import ncpool
+
+
+class QuantileSketch:
+    """Mergeable min/max/quantile sketch"""
+    def __init__(self, k=4096, seed=0):
+        """
+        Parameters
+        ----------
+        k : int
+            maximum number of values per level (accuracy about 1/k)
+        seed : int
+            seed for the random choice of promoted values
+        """
+        self.k = k
+        self.levels = [np.empty(0)]
+        self.count = 0
+        self.min = np.inf
+        self.max = -np.inf
+        self._rng = np.random.RandomState(seed)
+
+    def __repr__(self):
+        return '<QuantileSketch: n={0.count}, min={0.min}, max={0.max}>'.format(self)
+
+    def update(self, data):
+        """Add the valid (unmasked, finite) values of `data`"""
+        values = np.ma.compressed(np.ma.masked_invalid(data)).astype('f8')
+        if len(values) == 0:
+            return self
+        self.count += len(values)
+        self.min = min(self.min, values.min())
+        self.max = max(self.max, values.max())
+        self.levels[0] = np.concatenate([self.levels[0], values])
+        self._compress()
+        return self
+
+    def merge(self, other):
+        """Merge `other` into this sketch"""
+        self.count += other.count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        for h, values in enumerate(other.levels):
+            if h == len(self.levels):
+                self.levels.append(np.empty(0))
+            self.levels[h] = np.concatenate([self.levels[h], values])
+        self._compress()
+        return self
+
+    def _compress(self):
+        h = 0
+        while h < len(self.levels):
+            values = self.levels[h]
+            if len(values) > self.k:
+                values = np.sort(values)
+                # keep one value at this level if the number is odd
+                keep = values[-1:] if len(values) % 2 else values[:0]
+                values = values[:len(values) - len(keep)]
+                promoted = values[self._rng.randint(2)::2]
+                self.levels[h] = keep
+                if h + 1 == len(self.levels):
+                    self.levels.append(np.empty(0))
+                self.levels[h+1] = np.concatenate([self.levels[h+1], promoted])
+            h += 1
+
+    def quantile(self, q):
+        """Approximate quantile(s) `q` (0 <= q <= 1), min and max are exact"""
+        if self.count == 0:
+            return np.full(np.shape(q), np.nan)[()]
+        values = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(v), 2.**h) for h, v in enumerate(self.levels)])
+        order = np.argsort(values)
+        values = values[order]
+        cumulative = np.cumsum(weights[order])
+        # empirical CDF at the centre of each weighted value
+        cdf = (cumulative - 0.5*weights[order]) / cumulative[-1]
+        result = np.interp(q, cdf, values)
+        result = np.where(np.asarray(q) <= 0, self.min, result)
+        result = np.where(np.asarray(q) >= 1, self.max, result)
+        return result[()]
+
+
+def robust_levels(sketch, q=0.01, nbins=21, symmetric=True):
+    """Color levels covering the (`q`, 1-`q`) quantile range
+
+    Parameters
+    ----------
+    sketch : QuantileSketch
+        statistics of all frames
+    q : float
+        fraction of values allowed to saturate at either end
+    nbins : int
+        maximum number of intervals
+    symmetric : bool
+        make the levels symmetric around zero
+    """
+    import matplotlib.ticker as mticker
+    lower, upper = sketch.quantile([q, 1.-q])
+    ticker = mticker.MaxNLocator(nbins=nbins, symmetric=symmetric)
+    return ticker.tick_values(lower, upper)
+
+
+def sketch_frames(frames, sketch=None):
+    """Sketch all frames of a frame source (see `poppy.frames`)
+
+    Frames that are tuples (data, time) contribute their data.
+    """
+    sketch = sketch or QuantileSketch()
+    for i in range(len(frames)):
+        frame = frames[i]
+        if isinstance(frame, tuple):
+            frame = frame[0]
+        sketch.update(frame)
+    return sketch
+
+
+def _sketch_file(fname, reader, k):
+    with ncpool.netcdf_lock:
+        with netCDF4.Dataset(fname) as ds:
+            data = reader(ds.variables)
+    return QuantileSketch(k=k).update(data)
+
+
+def sketch_files(ncfiles, reader, nprocs=1, k=4096):
+    """Sketch the fields read by `reader` from all `ncfiles`, in parallel
+
+    Parameters
+    ----------
+    ncfiles : list
+        input files
+    reader : function
+        reader(dsvar) returning the field of one file
+        (must be picklable, i.e. a module level function, for nprocs > 1)
+    nprocs : int
+        number of processes
+    k : int
+        size of the sketch (see `QuantileSketch`)
+    """
+    func = functools.partial(_sketch_file, reader=reader, k=k)
+    if nprocs > 1:
+        pool = multiprocessing.Pool(nprocs)
+        try:
+            sketches = pool.map(func, ncfiles)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        sketches = [func(fname) for fname in ncfiles]
+    sketch = QuantileSketch(k=k)
+    for other in sketches:
+        sketch.merge(other)
+    return sketch
@@ -0,0 +1,116 @@
+"""
+Memory-mapped cache of the raw slabs behind the transport metrics
+
+`get_amoc` reduces `MOC[:,1,0,kza:kzo+1,ja:jo+1]` to a time series, so
+every new `latlim`, `zlim` or `window_size` reads all files again. With a
+cache directory, the full Atlantic MOC slab (all depths and latitudes)
+and the full N_HEAT and N_SALT arrays are read once into `.npy` files
+next to their time axis, and later calls select their windows from
+memory-mapped data:
+
+    >>> for zlim in [(500,9999), (1000,9999)]:
+    ...     amoc = metrics.get_amoc(ncfiles, zlim=zlim, cachedir='/scratch/poppy')
+
+A cache entry is keyed by the variable, the slab and the list of files,
+and is rebuilt when any file changed since it was written.
+"""
+import os
+import json
+import hashlib
+import numpy as np
+
+from . import ncpool
+from . import mfdataset
+from . import rechunk
+
+# index (after time) of the slab cached for each variable
+slabs = {
+    'MOC' : (1, 0),  # Atlantic, total
+    'N_HEAT' : (),
+    'N_SALT' : (),
+    }
+
+# time steps read per block while building an entry
+block_steps = 120
+
+
+def cache_key(ncfiles, varn, slab):
+    """Name of the cache entry of `slab` of `varn` over `ncfiles`"""
+    digest = hashlib.sha1(repr((varn, slab)).encode('utf-8'))
+    for fname in ncfiles:
+        digest.update(os.path.abspath(fname).encode('utf-8'))
+    return '{}.{}'.format(varn, digest.hexdigest()[:16])
+
+
+def _paths(cachedir, key):
+    base = os.path.join(cachedir, key)
+    return base + '.json', base + '.npy', base + '.time.npy'
+
+
+def _is_valid(manifest, ncfiles):
+    try:
+        with open(manifest) as f:
+            stored = json.load(f)
+    except (IOError, OSError, ValueError):
+        return False
+    return stored['signatures'] == [list(ncpool.file_signature(fname)) for fname in ncfiles]
+
+
+def get_slab(ncfiles, varn, cachedir, backend=None, store=None):
+    """Memory-mapped slab `slabs[varn]` of `varn` over `ncfiles`, read on the first call
+
+    Parameters
+    ----------
+    ncfiles : list of str
+        input files, sorted in time
+    varn : str
+        variable in `slabs`
+    cachedir : str
+        directory of the cache (created if missing)
+    backend : str, optional
+        read backend (see `poppy.backends`)
+    store : str or False, optional
+        time-contiguous store to build the entry from (see `poppy.rechunk`,
+        default: a store in `rechunk.stores` holding all files, if any)
+
+    Returns
+    -------
+    data : numpy.memmap (read-only), shape (ntime,) + slab shape
+    timeax : ndarray, decimal model years
+    """
+    slab = slabs[varn]
+    manifest, datafile, timefile = _paths(cachedir, cache_key(ncfiles, varn, slab))
+    if not _is_valid(manifest, ncfiles):
+        _build(ncfiles, varn, slab, manifest, datafile, timefile, backend=backend, store=store)
+    return np.load(datafile, mmap_mode='r'), np.load(timefile)
+
+
+def _build(ncfiles, varn, slab, manifest, datafile, timefile, backend=None, store=None):
+    if not os.path.isdir(os.path.dirname(manifest)):
+        os.makedirs(os.path.dirname(manifest))
+    signatures = [list(ncpool.file_signature(fname)) for fname in ncfiles]
+    ds, tindex = rechunk.select_store(ncfiles, [varn], backend=backend, store=store)
+    if ds is None:
+        ds = mfdataset.open_pop_mfdataset(ncfiles, backend=backend)
+    with ds:
+        var = ds.variables[varn]
+        tt = np.arange(var.shape[0])[tindex]
+        timeax = ds.get_time_decimal_year()[tt]
+        first = var[(slice(0, 1),) + slab]
+        # write to a temporary file, so an interrupted build leaves no entry
+        tmpfile = datafile + '.tmp.npy'
+        data = np.lib.format.open_memmap(tmpfile, mode='w+', dtype=first.dtype,
+                shape=(len(tt),) + first.shape[1:])
+        for t0 in range(0, len(tt), block_steps):
+            block = tt[t0:t0+block_steps]
+            if np.all(np.diff(block) == 1):
+                block = slice(int(block[0]), int(block[-1]) + 1)
+            data[t0:t0+block_steps] = var[(block,) + slab]
+        data.flush()
+        del data
+    os.rename(tmpfile, datafile)
+    np.save(timefile, timeax)
+    with open(manifest, 'w') as f:
+        json.dump(dict(variable=varn, slab=list(slab),
+            files=[os.path.abspath(fname) for fname in ncfiles],
+            signatures=signatures), f)
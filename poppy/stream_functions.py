@@ -1,9 +1,8 @@
 import numpy as np
 
 import poppy.grid
-
-def _fill0(a):
-    return np.ma.filled(a,0.)
+import poppy.chunks
+from poppy.backends import fill0
 
 
 def get_vertical_stream_function(ds, region='Global', t=0, lat0=None, custom_mask=None):
@@ -11,8 +10,9 @@ def get_vertical_stream_function(ds, region='Global', t=0, lat0=None, custom_mas
     
     Parameters
     ----------
-    ds : netCDF4.Dataset
-        open netCDF dataset
+    ds : netCDF4.Dataset or backend file
+        open netCDF dataset (e.g. from `poppy.backends.dataset`;
+        the 'h5py-threads' backend decompresses 3D reads in parallel)
     region : str
         region ID to be used with `poppy.grid.get_regmasks`
     custom_mask : ndarray
@@ -60,24 +60,31 @@ def get_vertical_stream_function(ds, region='Global', t=0, lat0=None, custom_mas
         nt = 1
 
     # compute zonal sum of meridional transport
+    # levels are read in chunk-aligned blocks
+    vvel = dsvar['VVEL']
+    blocks = poppy.chunks.level_blocks(vvel, 0, nz)
     if lat0 is not None: # only one latitude circle
         j0 = np.argmin(np.abs(latax-lat0))
         latax = latax[j0]
         Vdz = np.zeros((nt,nz))
-        for k in range(nz):
-            Vdz[:,k] = np.sum((
-                _fill0(dsvar['VVEL'][t,k,j0,:]) * 1e-2
-                    * imask[j0]
-                    * dx[j0]
-                    ),axis=-1) * dz[k]
+        for k0,k1 in blocks:
+            vblock = fill0(poppy.chunks.read(vvel, (t,slice(k0,k1),j0,slice(None)))) * 1e-2
+            for k in range(k0,k1):
+                Vdz[:,k] = np.sum((
+                    vblock[...,k-k0,:]
+                        * imask[j0]
+                        * dx[j0]
+                        ),axis=-1) * dz[k]
     else:
         Vdz = np.zeros((nt,nz,ny))
-        for k in range(nz):
-            Vdz[:,k,:] = np.sum((
-                _fill0(dsvar['VVEL'][t,k,:,:]) * 1e-2
-                    * imask
-                    * dx
-                    ),axis=-1) * dz[k]
+        for k0,k1 in blocks:
+            vblock = fill0(poppy.chunks.read(vvel, (t,slice(k0,k1)))) * 1e-2
+            for k in range(k0,k1):
+                Vdz[:,k,:] = np.sum((
+                    vblock[...,k-k0,:,:]
+                        * imask
+                        * dx
+                        ),axis=-1) * dz[k]
 
     # compute streamfunction in Sv
     psi = np.squeeze(np.cumsum(Vdz,axis=1)) # cumulative vertical sum
@@ -92,8 +99,9 @@ def get_barotropic_stream_function(ds,region=None,lon0=None,t=0):
     
     Parameters
     ----------
-    ds : netCDF4.Dataset
-        open netCDF dataset
+    ds : netCDF4.Dataset or backend file
+        open netCDF dataset (e.g. from `poppy.backends.dataset`;
+        the 'h5py-threads' backend decompresses 3D reads in parallel)
     region : str
         region ID to be used with ``poppy.grid.get_regmasks``
     lon0 : float
@@ -116,9 +124,12 @@ def get_barotropic_stream_function(ds,region=None,lon0=None,t=0):
         regmask = poppy.grid.get_regmasks(dsvar['REGION_MASK'][:],int)[region]
 
     V = np.zeros(lat.shape)
-    for k in range(len(dsvar['dz'])):
-        V += (_fill0(dsvar['VVEL'][t,k]) * 1e-2
-                * dsvar['dz'][k] * 1e-2)
+    vvel = dsvar['VVEL']
+    for k0,k1 in poppy.chunks.level_blocks(vvel, 0, len(dsvar['dz'])):
+        vblock = fill0(poppy.chunks.read(vvel, (t,slice(k0,k1))))
+        for k in range(k0,k1):
+            V += (vblock[k-k0] * 1e-2
+                    * dsvar['dz'][k] * 1e-2)
     V *= dsvar['DXU'][:,:] * 1e-2
     V *= regmask
 
@@ -144,8 +155,9 @@ def get_barotropic_stream_function_section(ds,ii,jj,region=None,t=0):
     
     Parameters
     ----------
-    ds : netCDF4.Dataset
-        open netCDF dataset
+    ds : netCDF4.Dataset or backend file
+        open netCDF dataset (e.g. from `poppy.backends.dataset`;
+        the 'h5py-threads' backend decompresses 3D reads in parallel)
     region : str
         region ID to be used with ``poppy.grid.get_regmasks``
     lon0 : float
@@ -169,7 +181,7 @@ def get_barotropic_stream_function_section(ds,ii,jj,region=None,t=0):
         regmask = poppy.grid.get_regmasks(dsvar['REGION_MASK'][jj,ii],int)[region]
 
     if isinstance(jj,int):
-        V = np.sum((_fill0(dsvar['VVEL'][t,:,jj,ii]) * 1e-2
+        V = np.sum((fill0(poppy.chunks.read_aligned(dsvar['VVEL'], (t,slice(None),jj,ii))) * 1e-2
             * dsvar['dz'][:][:,np.newaxis] * 1e-2),axis=0)
         V *= dsvar['DXU'][jj,ii] * 1e-2
         V *= regmask
@@ -177,7 +189,7 @@ def get_barotropic_stream_function_section(ds,ii,jj,region=None,t=0):
         psi *= -1.
 
     elif isinstance(ii,int):
-        U = np.sum((_fill0(dsvar['UVEL'][t,:,jj,ii]) * 1e-2
+        U = np.sum((fill0(poppy.chunks.read_aligned(dsvar['UVEL'], (t,slice(None),jj,ii))) * 1e-2
             * dsvar['dz'][:][:,np.newaxis] * 1e-2),axis=0)
         U *= dsvar['DYU'][jj,ii] * 1e-2
         U *= regmask
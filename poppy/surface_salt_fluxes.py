@@ -41,7 +41,17 @@ specifically the line
 For guidance on conversion of FW flux to virtual salt flux, etc, refer 
 to POP_ConstantsMod.F90
 """
-import netCDF4
+import numpy as np
+
+from . import grid as poppygrid
+from . import derived
+from . import utils
+from . import ncpool
+from .backends import fill0
+from .lazy import LazyModule, available
+
+pd = LazyModule('pandas')
+use_pandas = available('pandas')
 
 
 def net_salinity_forcing(ncfile):
@@ -50,12 +60,11 @@ def net_salinity_forcing(ncfile):
         SFWF - QFLUX/latent_heat_fusion/1.e4  [kg FW /m^2/s]
     """
     def _get_data(ds):
-        dsv = ds.variables
-        return dsv['SFWF'][0] - dsv['QFLUX'][0]/dsv['latent_heat_fusion'][:]/1.e4 # units [kg FW /m^2/s]
+        return derived.read(ds.variables, 'NET_SALINITY_FORCING', 0) # units [kg FW /m^2/s]
     try:
         return _get_data(ncfile)
     except AttributeError:
-        with netCDF4.Dataset(ncfile) as ds:
+        with ncpool.dataset(ncfile) as ds:
             return _get_data(ds)
 
 
@@ -69,15 +78,11 @@ def salinity_restoring(ncfile):
             = (any weak or strong salinity restoring)
     """
     def _get_data(ds):
-        dsv = ds.variables
-        data = dsv['SFWF'][0]
-        data -= (dsv['PREC_F'][0] + dsv['EVAP_F'][0] + dsv['ROFF_F'][0] + dsv['IOFF_F'][0] + dsv['MELT_F'][0]) 
-        data -= dsv['SALT_F'][0]*(dsv['sflux_factor'][:]/dsv['salinity_factor'][:])
-        return data
+        return derived.read(ds.variables, 'SALINITY_RESTORING', 0)
     try:
         return _get_data(ncfile)
     except AttributeError:
-        with netCDF4.Dataset(ncfile) as ds:
+        with ncpool.dataset(ncfile) as ds:
             return _get_data(ds)
 
 
@@ -87,3 +92,135 @@ def salt_flux_to_fw_flux(ds):
     """
     dsvar = ds.variables
     return dsvar['sflux_factor'][0] / dsvar['salinity_factor'][0]
+
+
+budget_components = ['PREC_F', 'EVAP_F', 'ROFF_F', 'IOFF_F', 'MELT_F', 'SALT_F', 'QFLUX']
+
+
+def get_region_weights(ds, regions):
+    """Get area weights of regions on the T grid
+    
+    Parameters
+    ----------
+    ds : netCDF4.Dataset
+        open dataset containing the grid variables
+    regions : dict
+        region name -> either a boolean mask on the T grid
+        or a dict with `lonlim` and/or `latlim` (see `grid.get_grid_mask`)
+
+    Returns
+    -------
+    names : list of region names
+    weights : ndarray (nregions, nlat*nlon)
+        cell areas [m^2] inside each region (ocean points only), 0 elsewhere
+    """
+    dsvar = ds.variables
+    tarea = dsvar['TAREA'][:] * 1e-4
+    ocean = dsvar['KMT'][:] > 0
+    names = sorted(regions)
+    weights = np.zeros((len(names), tarea.size))
+    for r, name in enumerate(names):
+        region = regions[name]
+        if isinstance(region, dict):
+            if region:
+                mask = poppygrid.get_grid_mask(
+                        lon=dsvar['TLONG'][:], lat=dsvar['TLAT'][:], **region)
+            else:
+                mask = np.ones(tarea.shape, bool)
+        else:
+            mask = np.asarray(region, dtype=bool)
+        mask = mask & ocean
+        weights[r] = np.where(mask, fill0(tarea), 0.).ravel()
+    return names, weights
+
+
+def get_surface_fw_budget(ncfiles, regions={'Global':{}}, components=budget_components):
+    """Get area-integrated surface freshwater budget time series over regions
+    
+    Each component is read once per file (all time levels) and reduced 
+    with precomputed area weights, so the cost is one read per component 
+    and file, independent of the number of regions.
+
+    Parameters
+    ----------
+    ncfiles : list of str
+        paths to input files
+    regions : dict
+        region name -> boolean mask or dict with `lonlim`, `latlim`
+        (an empty dict means the global ocean)
+    components : list of str
+        flux components to integrate (subset of `budget_components`
+        and/or names of surface fields in `poppy.derived.registry`
+        with metrics ['TAREA'])
+
+    Returns
+    -------
+    pandas.DataFrame with columns (Region, Component), indexed by ModelYear
+    or tuple (budget, timeax, names, columns) without Pandas,
+    budget having shape (ntime, nregions, ncolumns).
+    All values in [kg FW s-1]. The columns contain the components, 
+    the net salinity forcing 'NET' (SFWF - QFLUX/latent_heat_fusion/1.e4)
+    and, if all components are included, the implied salinity restoring 
+    'RESTORING'. 'QFLUX' and 'SALT_F' are converted to freshwater flux.
+
+    Note
+    ----
+    The regions are defined on the grid of the first file.
+    """
+    n = len(ncfiles)
+    if n == 0:
+        raise ValueError('No files found. Check your glob pattern.')
+
+    with ncpool.dataset(ncfiles[0]) as ds:
+        names, weights = get_region_weights(ds, regions)
+        dsvar = ds.variables
+        qflux_factor = 1. / dsvar['latent_heat_fusion'][:] / 1.e4
+        salt_factor = dsvar['sflux_factor'][:] / dsvar['salinity_factor'][:]
+    weights = weights.T
+    
+    components = list(components)
+    for varn in components:
+        # weighted by TAREA below, so only surface fields integrated by area
+        if derived.is_derived(varn) and derived.registry[varn].metrics != ['TAREA']:
+            raise ValueError('{} is not integrated by area (metrics {}).'.format(
+                varn, derived.registry[varn].metrics))
+    with_restoring = set(budget_components) <= set(components)
+    columns = components + ['NET'] + (['RESTORING'] if with_restoring else [])
+
+    timeax = []
+    budget = []
+    for fname in ncfiles:
+        with ncpool.dataset(fname) as ds:
+            dsvar = ds.variables
+            timeax.append(np.atleast_1d(utils.get_time_decimal_year(dsvar['time'])))
+            nt = len(timeax[-1])
+            def _integrate(varn):
+                data = fill0(derived.read(dsvar, varn, Ellipsis)).reshape((nt, -1))
+                return data.dot(weights)
+            integrals = {}
+            for varn in components:
+                integrals[varn] = _integrate(varn)
+            if 'SALT_F' in integrals:
+                integrals['SALT_F'] = integrals['SALT_F'] * salt_factor
+            if 'QFLUX' not in integrals:
+                # NET needs QFLUX, whatever the requested components
+                if 'QFLUX' not in dsvar:
+                    raise ValueError('QFLUX is needed for the net forcing but missing in {}.'.format(fname))
+                integrals['QFLUX'] = _integrate('QFLUX')
+            integrals['QFLUX'] = integrals['QFLUX'] * qflux_factor
+            sfwf = _integrate('SFWF')
+            integrals['NET'] = sfwf - integrals['QFLUX']
+            if with_restoring:
+                integrals['RESTORING'] = sfwf - integrals['SALT_F'] - sum(
+                        integrals[varn] for varn in budget_components
+                        if varn not in ('SALT_F', 'QFLUX'))
+            budget.append(np.stack([integrals[key] for key in columns], axis=-1))
+    timeax = np.concatenate(timeax)
+    budget = np.concatenate(budget)
+
+    if use_pandas:
+        index = pd.Index(timeax, name='ModelYear')
+        cols = pd.MultiIndex.from_product([names, columns], names=('Region', 'Component'))
+        return pd.DataFrame(budget.reshape((len(timeax), -1)), index=index, columns=cols)
+    else:
+        return budget, timeax, names, columns
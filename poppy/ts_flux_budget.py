@@ -4,9 +4,33 @@ import warnings
 from oceanpy.fluxbudget import budget_over_region_2D
 from oceanpy.stats import central_differences
 
+from . import derived
+from .backends import filled, fill0
 
-def _fill0(a):
-    return np.ma.filled(a,0.)
+
+# names of the (derived) variables transported for each `varn`
+scalarnames = {
+    'heat' : 'TEMP',
+    'salt' : 'SALT',
+    'freshwater' : 'FRESHWATER',
+    }
+
+
+def _iter_scalar(dsvar,varn,t,kza,kzo,S0=34.8):
+    """Levels `kza` to `kzo`-1 of the scalar transported for `varn` (None if not `varn`)
+
+    Derived scalars are evaluated on chunk-aligned blocks of levels
+    (see `derived.iter_levels`), not on the full field.
+    """
+    if not varn:
+        for k in range(kza,kzo):
+            yield None
+        return
+    # land is pure freshwater (SALT filled with 0)
+    value = 1. if varn == 'freshwater' else 0.
+    params = dict(S0=S0) if varn == 'freshwater' else {}
+    for k, layer in derived.iter_levels(dsvar,scalarnames.get(varn,varn),t=t,kza=kza,kzo=kzo,**params):
+        yield filled(layer,value)
 
 
 def _warn_virtual_salt_flux_units():
@@ -23,21 +47,13 @@ def fluxbudget_VVEL(ds,mask,varn,kza=0,kzo=None,S0=34.8,t=0):
     dz = dsvar['dz'][:] * 1e-2
     if kzo is None: kzo = len(dz)
     fluxbudget = 0.
-    for k in range(kza,kzo):
-        uflux = _fill0(dsvar['UVEL'][t,k]) * 1e-2
+    for k, scalar in zip(range(kza,kzo), _iter_scalar(dsvar,varn,t,kza,kzo,S0)):
+        uflux = fill0(dsvar['UVEL'][t,k]) * 1e-2
         uflux *= dyu
         uflux *= dz[k]
-        vflux = _fill0(dsvar['VVEL'][t,k]) * 1e-2
+        vflux = fill0(dsvar['VVEL'][t,k]) * 1e-2
         vflux *= dxu
         vflux *= dz[k]
-        if not varn:
-            scalar = None
-        elif varn == 'heat':
-            scalar = _fill0(dsvar['TEMP'][t,k])
-        elif varn == 'salt':
-            scalar = _fill0(dsvar['SALT'][t,k])
-        elif varn == 'freshwater':
-            scalar = (S0 - _fill0(dsvar['SALT'][t,k])) / S0
         fluxbudget += budget_over_region_2D(uflux,vflux,scalar=scalar,mask=mask,grid='ArakawaB')
     if varn == 'heat':
         fluxbudget *= (1e3 * 4e3 * 1e-15) # PW
@@ -53,10 +69,10 @@ def fluxbudget_UESVNS(ds,mask,varn='salt',kza=0,kzo=None,t=0):
     if kzo is None: kzo = len(dz)
     fluxbudget = 0.
     for k in range(kza,kzo):
-        uflux = _fill0(dsvar['UES'][t,k])
+        uflux = fill0(dsvar['UES'][t,k])
         uflux *= tarea
         uflux *= dz[k]
-        vflux = _fill0(dsvar['VNS'][t,k])
+        vflux = fill0(dsvar['VNS'][t,k])
         vflux *= tarea
         vflux *= dz[k]
         fluxbudget += budget_over_region_2D(uflux,vflux,scalar=None,mask=mask)
@@ -72,17 +88,10 @@ def fluxbudget_bolus_visop(ds,mask,varn,kza=0,kzo=None,S0=34.8,t=0):
     dz = dsvar['dz'][:] * 1e-2
     if kzo is None: kzo = len(dz)
     fluxbudget = 0.
-    for k in range(kza,kzo):
+    for k, scalar in zip(range(kza,kzo), _iter_scalar(dsvar,varn,t,kza,kzo,S0)):
         # get bolus velocity
-        uflux = _fill0(dsvar['UISOP'][t,k]) * 1e-2 # m s-1
-        vflux = _fill0(dsvar['VISOP'][t,k]) * 1e-2 # m s-1
-        # get scalar data
-        if varn == 'heat':
-            scalar = _fill0(dsvar['TEMP'][t,k])
-        elif varn == 'salt':
-            scalar = _fill0(dsvar['SALT'][t,k])
-        elif varn == 'freshwater':
-            scalar = (S0 - _fill0(dsvar['SALT'][t,k])) / S0
+        uflux = fill0(dsvar['UISOP'][t,k]) * 1e-2 # m s-1
+        vflux = fill0(dsvar['VISOP'][t,k]) * 1e-2 # m s-1
         # multiply flux by scalar
         uflux *= scalar
         vflux *= scalar
@@ -110,19 +119,12 @@ def fluxbudget_diffusion(ds,mask,varn,kza=0,kzo=None,S0=34.8,t=0):
     dz = dsvar['dz'][:] * 1e-2
     if kzo is None: kzo = len(dz)
     fluxbudget = 0.
-    for k in range(kza,kzo):
-        # get scalar data
-        if varn == 'heat':
-            scalar = _fill0(dsvar['TEMP'][t,k])
-        elif varn == 'salt':
-            scalar = _fill0(dsvar['SALT'][t,k])
-        elif varn == 'freshwater':
-            scalar = (S0 - _fill0(dsvar['SALT'][t,k])) / S0
+    for k, scalar in zip(range(kza,kzo), _iter_scalar(dsvar,varn,t,kza,kzo,S0)):
         # get gradient
         uflux = central_differences(scalar,dxt,axis=1) # [scalar] m-1
         vflux = central_differences(scalar,dyt,axis=0) # [scalar] m-1
         # multiply gradient by diffusion coefficient
-        kappa = _fill0(dsvar['KAPPA_ISOP'][t,k] * 1e-4) # m2 s-1
+        kappa = fill0(dsvar['KAPPA_ISOP'][t,k] * 1e-4) # m2 s-1
         uflux *= kappa
         vflux *= kappa
         # multiply by horizontal grid spacing
@@ -143,9 +145,9 @@ def fluxbudget_bolus_advection_tendency(ds,mask,varn,t=0):
     _warn_virtual_salt_flux_units()
     dsvar = ds.variables
     if varn == 'heat':
-        integrand = _fill0(dsvar['ADVT_ISOP'][t][mask]) * 1e-2
+        integrand = fill0(dsvar['ADVT_ISOP'][t][mask]) * 1e-2
     elif varn == 'salt':
-        integrand = _fill0(dsvar['ADVS_ISOP'][t][mask]) * 1e-2
+        integrand = fill0(dsvar['ADVS_ISOP'][t][mask]) * 1e-2
     else:
         raise ValueError('This function only works for heat and salt transport.')
     integrand *= dsvar['TAREA'][:][mask] * 1e-4
@@ -167,11 +169,11 @@ def transport_divergence(ds,mask,varn='salt',kza=0,kzo=None,t=0):
     if kzo is None: kzo = len(dz)
     transport_divergence = 0.
     for k in range(kza,kzo):
-        uflux = _fill0(dsvar[uvar][t,k])
+        uflux = fill0(dsvar[uvar][t,k])
         uflux *= dyu
         uflux *= dz[k]
         uflux *= mask
-        vflux = _fill0(dsvar[vvar][t,k])
+        vflux = fill0(dsvar[vvar][t,k])
         vflux *= dxu
         vflux *= dz[k]
         vflux *= mask
@@ -193,7 +195,7 @@ def transport_divergence_from_vertical(ds,mask,varn='salt',kza=0,kzo=None,t=0):
     if kzo is None: kzo = len(dz)
     transport_divergence = 0.
     for k in range(kza,kzo):
-        wflux = _fill0(dsvar[wvar][t,k][mask])
+        wflux = fill0(dsvar[wvar][t,k][mask])
         wflux *= dz[k]
         wflux *= dsvar['TAREA'][:][mask] * 1e-4
         transport_divergence += np.sum(wflux)
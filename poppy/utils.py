@@ -34,12 +34,24 @@ def get_time_datetime(timevar):
     timevar : netCDF4.Dataset(fname).variables['time']
         POP input data
     """
-    timedata = timevar[:]
-    timeunits = timevar.units
-    if timeunits.startswith('days since 0000'):
-        timeunits = timeunits.replace('days since 0000', 'days since 0001')
+    return num2date(timevar[:], timevar.units, getattr(timevar, 'calendar', 'standard'))
+
+
+def num2date(timedata, units, calendar='standard'):
+    """netCDF4.num2date accounting for reference year 0000
+
+    Parameters
+    ----------
+    timedata : ndarray
+        time values
+    units, calendar : str
+        attributes of the time variable
+    """
+    timedata = np.array(timedata, dtype=float)
+    if units.startswith('days since 0000'):
+        units = units.replace('days since 0000', 'days since 0001')
         timedata -= 364
-    return netCDF4.num2date(timedata, units=timeunits, calendar=timevar.calendar)
+    return netCDF4.num2date(timedata, units=units, calendar=calendar)
 
 
 def get_time_decimal_year(timevar, **kwarg):
@@ -51,6 +63,8 @@ def get_time_decimal_year(timevar, **kwarg):
         POP input data
     """
     return datetime_to_decimal_year(get_time_datetime(timevar))
-    
 
 
+def time_to_decimal_year(timedata, units, calendar='standard'):
+    """Convert time values (e.g. time bounds) with `units` and `calendar` to decimal year"""
+    return datetime_to_decimal_year(num2date(timedata, units, calendar))
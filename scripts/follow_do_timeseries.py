@@ -0,0 +1,24 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+import argparse
+
+from poppy import do_reader
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+            description='Follow growing *.pop.do.* files and append new records to an HDF5 store')
+    parser.add_argument('files', type=str, nargs='+', help='Files or glob pattern (in "") to follow')
+    parser.add_argument('-o', '--outfile', type=str, required=True, help='Output HDF5 store')
+    parser.add_argument('-i', '--interval', type=float, default=60., help='Seconds between updates')
+    parser.add_argument('--nperyear', type=int, default=365, help='Records per strait and year')
+    parser.add_argument('--once', action='store_true', help='Update once and exit')
+    args = parser.parse_args()
+
+    def _report(df):
+        print('Appended {} records up to model year {:.3f}'.format(
+            len(df), df.index.get_level_values('ModelYear').max()))
+
+    follower = do_reader.DoFollower(args.outfile, nperyear=args.nperyear)
+    follower.follow(args.files, interval=args.interval, 
+            maxiter=(1 if args.once else None), callback=_report)
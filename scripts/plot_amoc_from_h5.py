@@ -4,23 +4,29 @@ Plot AMOC time series from h5 files
 
 """
 from __future__ import print_function
-import matplotlib.pyplot as plt
-import pandas as pd
 import os.path
 
-# some style settings
-plt.style.use('ggplot') ; plt.rc('lines', linewidth=2)
-try:
-    import palettable as pal
-    colors = pal.tableau.Tableau_10.mpl_colors
-    plt.rc('axes', color_cycle=colors)
-except ImportError:
-    pass
+import poppy.pyramid
+from poppy.lazy import LazyModule
+
+plt = LazyModule('matplotlib.pyplot')
+pd = LazyModule('pandas')
+
+
+def _set_style():
+    plt.style.use('ggplot') ; plt.rc('lines', linewidth=2)
+    try:
+        import palettable as pal
+        colors = pal.tableau.Tableau_10.mpl_colors
+        plt.rc('axes', color_cycle=colors)
+    except ImportError:
+        pass
 
 
 def main(files, maxyear=None, savefig=None):
     """Plot AMOC time series from h5 files
     """
+    _set_style()
 
     fig, ax = plt.subplots(figsize=(10,6))
     ax.set_ylabel('AMOC maximum (Sv)')
@@ -34,8 +40,12 @@ def main(files, maxyear=None, savefig=None):
         case = os.path.basename(fname).split('.AMOC.h5')[0]
         labels.append(case)
         print(case)
-        df = pd.read_hdf(fname, **kwargs) 
-        df.plot(label=case)#, ls=('--' if '_br' in fname else '-'))
+        if poppy.pyramid.available_levels(fname, 'AMOC_pyramid'):
+            poppy.pyramid.plot_pyramid(ax, fname, 'AMOC_pyramid', 
+                    timelim=(None, maxyear), label=case)
+        else:
+            df = pd.read_hdf(fname, **kwargs) 
+            df.plot(label=case)#, ls=('--' if '_br' in fname else '-'))
     ax.legend(labels=labels,
               #loc='center left', bbox_to_anchor=(1, 0.5),
               loc=0,
@@ -1,15 +1,32 @@
 #!/usr/bin/env python
 
-import matplotlib.pyplot as plt ; plt.close('all')
-plt.style.use('ggplot')
 import glob
 
 import poppy.metrics 
+import poppy.pyramid
+from poppy.lazy import LazyModule
 
-def plot_amoc_time_series(files, latlim=(30,60), zlim=(500,9999), savefig=False, figname=''):
-    """Plot AMOC time series from CESM/POP data"""
-    ts = poppy.metrics.get_amoc(files, latlim=latlim, zlim=zlim)
-    ts.plot()
+plt = LazyModule('matplotlib.pyplot')
+
+def plot_amoc_time_series(files, latlim=(30,60), zlim=(500,9999), savefig=False, figname='',
+        pyramid=None):
+    """Plot AMOC time series from CESM/POP data
+
+    With `pyramid` (HDF5 file), the series is computed once and stored as a
+    pyramid (see `poppy.pyramid`); later calls plot it without reading `files`,
+    unless the parameters or files changed.
+    """
+    plt.close('all')
+    plt.style.use('ggplot')
+    if pyramid is not None:
+        poppy.pyramid.build_if_missing(pyramid, 'AMOC_pyramid',
+                lambda: poppy.metrics.get_amoc(files, latlim=latlim, zlim=zlim),
+                attrs=poppy.pyramid.source_attrs(files, latlim=list(latlim), zlim=list(zlim)))
+        ts = None
+        poppy.pyramid.plot_pyramid(plt.gca(), pyramid, 'AMOC_pyramid')
+    else:
+        ts = poppy.metrics.get_amoc(files, latlim=latlim, zlim=zlim)
+        ts.plot()
     plt.ylabel('AMOC (Sv)')
     plt.xlabel('integration year')
     if savefig or figname:
@@ -41,6 +58,8 @@ if __name__ == "__main__":
             help='set this to save the figure with default filename')
     parser.add_argument('--figname',type=str,
             help='save the figure to the given filename (implies -s)')
+    parser.add_argument('--pyramid', type=str,
+            help='HDF5 file storing the time series pyramid, computed from the files only once')
 
     args = parser.parse_args()
 
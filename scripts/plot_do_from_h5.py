@@ -1,14 +1,20 @@
-import matplotlib.pyplot as plt
-import matplotlib.patches as mpatches
 import os.path
-import pandas as pd
-from pandas.stats.moments import rolling_mean
-import gsw
 
-try:
-    import seaborn as sns
-except ImportError:
-    plt.style.use('ggplot')
+from poppy import do_store
+from poppy import pyramid
+from poppy.lazy import LazyModule
+
+plt = LazyModule('matplotlib.pyplot')
+mpatches = LazyModule('matplotlib.patches')
+pd = LazyModule('pandas')
+gsw = LazyModule('gsw')
+
+
+def _set_style():
+    try:
+        import seaborn as sns
+    except ImportError:
+        plt.style.use('ggplot')
 
 
 def plot_TS(df):
@@ -47,6 +53,7 @@ obs_props = dict(facecolor='0.6666', alpha=0.5)
 
 
 def plot_do(files, strait='DS', maxyear=None, savefig=False, figname=None):
+    _set_style()
     files = sorted(files)
 
     # make sure all files exist
@@ -54,10 +61,10 @@ def plot_do(files, strait='DS', maxyear=None, savefig=False, figname=None):
         if not os.path.isfile(fname):
             raise IOError('File not found: ' + fname)
     
-    # keyword arguments for reading the files
-    kwargs = dict(key='df')
-    if maxyear:
-        kwargs['where'] = 'ModelYear<={}'.format(maxyear)
+    # columns needed for the plots
+    columns = sorted(set(
+        sum([[varn.replace('rho_',s) for s in 'TS'] if varn.startswith('rho_') else [varn]
+            for fields in fieldsets for varn in fields], [])))
 
     fig,axx = plt.subplots(
             nrows=len(fieldsets), ncols=len(fieldsets[0]), 
@@ -70,8 +77,28 @@ def plot_do(files, strait='DS', maxyear=None, savefig=False, figname=None):
     for nf, fname in enumerate(files):
         label = cases[nf]
 
-        df = pd.read_hdf(fname, **kwargs)
-        df = df.loc[strait]
+        pkey = do_store.pyramid_key(strait)
+        if 'annual' in pyramid.available_levels(fname, pkey):
+            # pre-computed means at the coarsest level adequate for the axis width,
+            # at most annual resolution like the 365-day running mean below
+            npixels = int(axx[0,0].get_window_extent().width)
+            level, pdata = pyramid.read_adequate(fname, pkey, (None,maxyear), npixels, finest='annual')
+            df = pdata.xs('mean', axis=1, level='stat')
+            smooth = lambda series: series.values
+        else:
+            try:
+                # pre-computed annual means
+                df = do_store.query(fname, strait=strait, yearlim=(None,maxyear), columns=columns,
+                        annual=True)
+                smooth = lambda series: series.values
+            except KeyError:
+                try:
+                    df = do_store.query(fname, strait=strait, yearlim=(None,maxyear), columns=columns)
+                except KeyError:
+                    # files written before the do_store layer
+                    df = pd.read_hdf(fname, key='df', where=do_store._where(strait, (None,maxyear)))
+                smooth = lambda series: series.rolling(365).mean().values
+            df = df.loc[strait]
 
         for i, fields in enumerate(fieldsets):
             for j, varn in enumerate(fields):
@@ -79,12 +106,12 @@ def plot_do(files, strait='DS', maxyear=None, savefig=False, figname=None):
                 ax.set_title(varn)
                 if varn.startswith('rho_'):
                     # compute density from T,S
-                    salt = rolling_mean(df[varn.replace('rho_','S')],365).values
-                    temp = rolling_mean(df[varn.replace('rho_','T')],365).values
+                    salt = smooth(df[varn.replace('rho_','S')])
+                    temp = smooth(df[varn.replace('rho_','T')])
                     series = gsw.rho(salt, temp, 0)-1e3
                 else:
                     # get series directly from file
-                    series = rolling_mean(df[varn],365).values
+                    series = smooth(df[varn])
                 x = df.index.get_level_values('ModelYear')
                 ax.plot(x, series, label=label)
             
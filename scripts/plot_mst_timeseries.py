@@ -1,12 +1,19 @@
 #!/usr/bin/env python
 
-import matplotlib.pyplot as plt ; plt.close('all')
-import cPickle as pickle
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
 import glob
 
 import poppy.metrics
+import poppy.pyramid
+from poppy.lazy import LazyModule
 poppy.metrics.use_pandas = False
 
+plt = LazyModule('matplotlib.pyplot')
+pd = LazyModule('pandas')
+
 def save_mst_time_series(pattern, outfname, lat0=55, component=0):
     """Save MST time series from CESM/POP data"""
     ncfiles = sorted(glob.glob(pattern))
@@ -18,13 +25,27 @@ def save_mst_time_series(pattern, outfname, lat0=55, component=0):
         pickle.dump(dataout,fout)
 
 
-def plot_mst_time_series(pattern, lat0=55, component=0, savefig=False, figname=''):
-    """Plot MST time series from CESM/POP data"""
+def plot_mst_time_series(pattern, lat0=55, component=0, savefig=False, figname='', pyramid=None):
+    """Plot MST time series from CESM/POP data
+
+    With `pyramid` (HDF5 file), the series is computed once and stored as a
+    pyramid (see `poppy.pyramid`); later calls plot it without reading the files,
+    unless the parameters or files changed.
+    """
     ncfiles = sorted(glob.glob(pattern))
-    meannsalt, timeax = poppy.metrics.get_mst(ncfiles, lat0=55, component=0)
+    def _get_series():
+        meannsalt, timeax = poppy.metrics.get_mst(ncfiles, lat0=lat0, component=component)
+        return pd.Series(meannsalt, index=pd.Index(timeax, name='ModelYear'), name='MST')
+    plt.close('all')
     fig = plt.figure()
     ax = fig.gca()
-    ax.plot(timeax,meannsalt,'r')
+    if pyramid is not None:
+        poppy.pyramid.build_if_missing(pyramid, 'MST_pyramid', _get_series,
+                attrs=poppy.pyramid.source_attrs(ncfiles, lat0=lat0, component=component))
+        poppy.pyramid.plot_pyramid(ax, pyramid, 'MST_pyramid', color='r')
+    else:
+        ts = _get_series()
+        ax.plot(ts.index,ts.values,'r')
     ax.grid(True)
     ax.set_ylabel('Meridional salt transport (Sv PPT)')
     ax.set_xlabel('integration year')
@@ -61,6 +82,7 @@ if __name__ == "__main__":
     parser.add_argument('-s','--savefig',action='store_true',help='set this to save the figure with default filename')
     parser.add_argument('-f','--figname',type=str,help='save the figure to the given filename (implies -s)')
     parser.add_argument('--savetofile',dest='outfname',type=str,help='save the data to this file (pickle)')
+    parser.add_argument('--pyramid',type=str,help='HDF5 file storing the time series pyramid, computed from the files only once')
     
     parser.set_defaults(**defaults)
     args = parser.parse_args()
@@ -70,7 +92,7 @@ if __name__ == "__main__":
         argsdict['files'] = sorted(glob.glob(args.files[0]))
 
     if args.outfname is not None:
-        for key in ['savefig','figname']:
+        for key in ['savefig','figname','pyramid']:
             try:
                 del argsdict[key]
             except KeyError:
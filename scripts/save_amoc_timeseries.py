@@ -10,6 +10,7 @@ except ImportError:
     import pickle
 
 import poppy.metrics
+import poppy.pyramid
 
 if __name__ == "__main__":
 
@@ -47,6 +48,7 @@ if __name__ == "__main__":
         if not poppy.metrics.use_pandas:
             raise NotImplementedError('Saving to HDF5 requires Pandas!')
         df.to_hdf(args.outfile,key='df',mode='w',format='table')
+        poppy.pyramid.build_pyramid(df, args.outfile, key='AMOC_pyramid')
     else:
         with open(args.outfile,'wb') as fout:
             pickle.dump(df,fout)
@@ -9,12 +9,14 @@ except ImportError:
     import pickle
 
 from poppy import do_reader
+from poppy import do_store
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
             description='Read and concatenate *.pop.do.* files and save data series to file')
     parser.add_argument('files', type=str, nargs='+', help='Files to read and concatenate')
     parser.add_argument('-o', '--outfile', type=str, help='Output file')
+    parser.add_argument('-n', '--nprocs', type=int, default=1, help='Number of processes to read files in parallel')
     args = parser.parse_args()
 
     if isinstance(args.files, str):
@@ -23,10 +25,11 @@ if __name__ == "__main__":
     files = sorted(args.files)
     print('Processing {} files ...'.format(len(files)))
 
-    df = do_reader.read_do_multifile(files=files)
+    df = do_reader.read_do_multifile(files=files, nprocs=args.nprocs)
 
     if args.outfile.endswith('.h5'):
-        df.to_hdf(args.outfile, key='df', mode='w', format='table')
+        do_store.write(args.outfile, df)
+        do_store.write_pyramids(args.outfile, df)
     else:
         print('    Using pickle ...')
         with open(args.outfile,'wb') as fout:
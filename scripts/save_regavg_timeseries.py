@@ -8,8 +8,7 @@ import netCDF4
 
 import poppy.metrics
 import poppy.grid
-
-import meta
+from poppy.regions import regionlims
 
 
 def _get_grid_cell_area(fname, grid, lonlim, latlim):
@@ -31,7 +30,7 @@ if __name__ == "__main__":
     parser.add_argument('--grid', type=str,
             help='Grid', choices=['T','U'])
     parser.add_argument('--region', type=str,
-            help='Region name', choices=meta.regionlims.keys())
+            help='Region name', choices=regionlims.keys())
     parser.add_argument('--metric', type=str,
             help='Metric', choices=['mean', 'integral'], default='mean')
     parser.add_argument('-o', '--outfile', type=str,
@@ -46,7 +45,7 @@ if __name__ == "__main__":
     if len(files) == 1:
         files = sorted(glob.glob(files[0]))
 
-    area = _get_grid_cell_area(files[0], grid=args.grid, **meta.regionlims[args.region])
+    area = _get_grid_cell_area(files[0], grid=args.grid, **regionlims[args.region])
     def _weightedmean(data):
         return np.sum(data*area, axis=-1) / np.sum(area)
     def _integral(data):
@@ -62,7 +61,7 @@ if __name__ == "__main__":
             varn=args.varn,
             grid=args.grid,
             reducefunc=reducefunc,
-            **meta.regionlims[args.region])
+            **regionlims[args.region])
     
     ts.to_hdf(args.outfile, key='{0.varn}_{0.region}'.format(args), mode='w', format='table')
 
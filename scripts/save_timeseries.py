@@ -6,21 +6,8 @@ import argparse
 import glob
 
 import poppy.metrics
+from poppy.regions import regionlims
 
-regionlims = {
-        'Global' : dict(lonlim=(-90,90),latlim=(-180,180)),
-        'Atlantic' : dict(lonlim=(-80,40),latlim=(-70,70)),
-        'PolarNorthAtlantic': dict(lonlim=(-80,60),latlim=(60,90)),
-        'LabradorSea': dict(latlim=(50,60), lonlim=(-50,-40)),
-        'NorthAtlantic' : dict(lonlim=(-80,20),latlim=(0,65)),
-        'SubpolarNorthAtlantic': dict(lonlim=(-60,0),latlim=(40,65)),
-        'SubtropicalNorthAtlantic': dict(lonlim=(-100,0),latlim=(10,30)),
-        'TreguierNorthAtlantic': dict(lonlim=(-100,20),latlim=(10,50)),
-        'SubtropicalSouthAtlantic': dict(lonlim=(-50,20),latlim=(-40,-10)),
-        'BrazilEastCoast20S40W': dict(lonlim=(-45,-20),latlim=(-30,-10)),
-        'EquatorialAtlantic': dict(lonlim=(-55,15),latlim=(-10,10)),
-        'SubtropicalSouthPacific': dict(lonlim=(150,280),latlim=(-40,-10)),
-        }
 
 
 def get_timeseries(files, varn, grid, region, func, outfile):
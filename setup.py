@@ -13,6 +13,7 @@ setup(name = 'poppy',
       author = 'Jonas Bluethgen',
       author_email = 'bluthgen@nbi.ku.dk',
       packages = ['poppy'],
+      package_data = {'poppy' : ['data/*.cpt']},
       url = 'http://www.gfy.ku.dk/~bluthgen',
       license = 'LICENSE.txt',
       description = 'Python tools for analyzing output data from the Parallel Ocean Program (POP).',
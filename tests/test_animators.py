@@ -0,0 +1,93 @@
+import unittest
+import os
+import shutil
+import tempfile
+import datetime
+import numpy as np
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.image
+from poppy import animators
+
+ncfiles = ['./data/x3_0801-01.nc', './data/x3_0801-02.nc']
+
+
+def _generate_cmap_norm(levels, cm):
+    cmap = matplotlib.colormaps[cm]
+    return cmap, matplotlib.colors.BoundaryNorm(levels, cmap.N)
+
+
+class _Dates:
+    """Stand-in for pyutils.dates"""
+
+    @staticmethod
+    def pseudo_to_proper_datetime(date):
+        return datetime.datetime(date.year, date.month, date.day)
+
+    @staticmethod
+    def datetime_to_decimal_year(date):
+        return date.year + (date.month - 1) / 12.
+
+
+class TestLoad(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        patches = [
+                mock.patch.object(animators, 'pud', _Dates),
+                mock.patch.object(animators, 'pycpt_modify',
+                    mock.Mock(generate_cmap_norm=_generate_cmap_norm))]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_render_frames(self):
+        cache = os.path.join(self.tmpdir, 'cube.npy')
+        outdir = os.path.join(self.tmpdir, 'frames')
+        kwargs = dict(ncfiles=ncfiles, varname='TEMP', k=0, levels=np.linspace(-2, 30, 17),
+                cache=cache, lookahead=2)
+        render_chunk = animators._render_chunk
+        def _render_chunk(frames, **kw):
+            # the cube is extracted by the caller, before rendering
+            self.assertTrue(os.path.isfile(cache + '.json'))
+            return render_chunk(frames, **kw)
+        with mock.patch.object(animators, '_render_chunk', _render_chunk):
+            fnames = animators.render_frames(animators.Layer, kwargs, outdir, figsize=(4, 3), dpi=20)
+        self.assertEqual(fnames, [os.path.join(outdir, 'frame_{:05d}.png'.format(i)) for i in range(2)])
+        for fname in fnames:
+            self.assertTrue(os.path.isfile(fname))
+        # identical to the frame drawn by the interactive path
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        fig = Figure(figsize=(4, 3), dpi=20)
+        canvas = FigureCanvasAgg(fig)
+        ani = animators.Layer(fig.add_subplot(111), **kwargs)
+        ani.init()
+        ani(1)
+        canvas.draw()
+        expected = np.asarray(canvas.buffer_rgba())[...,:3]
+        rendered = np.round(matplotlib.image.imread(fnames[1])[...,:3] * 255).astype(np.uint8)
+        np.testing.assert_array_equal(rendered, expected)
+        ani.frames.stop()
+        mtime = os.path.getmtime(cache)
+        animators.render_frames(animators.Layer, kwargs, outdir, frames=[1], figsize=(4, 3), dpi=20)
+        self.assertEqual(os.path.getmtime(cache), mtime)
+
+    def test_robust_levels(self):
+        from matplotlib.figure import Figure
+        ani = animators.Layer(Figure().add_subplot(111), ncfiles, 'TEMP', k=0,
+                levels='robust', lookahead=0, nprocs=2)
+        sketch = animators.poppysketch.QuantileSketch()
+        for i in range(len(ani.frames)):
+            sketch.update(ani.frames.read(i)[0])
+        np.testing.assert_allclose(ani.levels, animators.poppysketch.robust_levels(sketch))
+
+if __name__ == '__main__':
+    unittest.main()
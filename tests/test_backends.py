@@ -0,0 +1,78 @@
+import unittest
+import glob
+import os
+import shutil
+import tempfile
+import netCDF4
+import numpy as np
+from poppy import backends
+from poppy import metrics
+from poppy import mfdataset
+from poppy.lazy import available
+
+ncfiles = sorted(glob.glob('./data/x3_0801-??.nc'))
+
+
+def _to_netcdf4(src, dst):
+    with netCDF4.Dataset(src) as ds, netCDF4.Dataset(dst, 'w', format='NETCDF4') as out:
+        for name, dim in ds.dimensions.items():
+            out.createDimension(name, None if dim.isunlimited() else len(dim))
+        for name, var in ds.variables.items():
+            attrs = dict((attr, var.getncattr(attr)) for attr in var.ncattrs())
+            newvar = out.createVariable(name, var.dtype, var.dimensions, 
+                    zlib=var.ndim > 1, fill_value=attrs.pop('_FillValue', None))
+            newvar.setncatts(attrs)
+            var.set_auto_mask(False)
+            newvar.set_auto_mask(False)
+            newvar[:] = var[:]
+
+
+class TestLoad(unittest.TestCase):
+
+    def test_netcdf4(self):
+        with backends.open_file(ncfiles[0], 'netcdf4') as f:
+            temp = f.read('TEMP', (0, 0))
+            self.assertNotIsInstance(temp, np.ma.MaskedArray)
+            self.assertTrue(np.isnan(temp).any())
+            out = np.empty((10, 100))
+            f.read('TEMP', (0, 0, slice(20, 30)), out=out)
+            np.testing.assert_array_equal(out, temp[20:30])
+            self.assertEqual(f.variables['TEMP'].units, 'degC')
+            self.assertEqual(f.variables['TEMP'].dimensions, ('time', 'z_t', 'nlat', 'nlon'))
+
+    def test_normalize_index(self):
+        shape = (1, 60, 116, 100)
+        self.assertEqual(backends.normalize_index((0, -1), shape), 
+                (0, 59, slice(0, 116, 1), slice(0, 100, 1)))
+        self.assertEqual(backends.index_shape(backends.normalize_index((Ellipsis, 3), shape)), (1, 60, 116))
+        self.assertIsNone(backends.normalize_index((0, [1, 2]), shape))
+
+    @unittest.skipUnless(available('h5py'), 'h5py not installed')
+    def test_h5py(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            files = []
+            for fname in ncfiles:
+                files.append(os.path.join(tmpdir, os.path.basename(fname)))
+                _to_netcdf4(fname, files[-1])
+            with backends.open_file(files[0], 'h5py') as f, backends.open_file(ncfiles[0], 'netcdf4') as g:
+                self.assertEqual(sorted(f.variables), sorted(g.variables))
+                for varn, index in [('TEMP', (0, 0)), ('TEMP', (0, slice(None), 5, slice(None, None, 3))),
+                        ('MOC', (slice(None), 1, 0, slice(3, 30), -1)), ('KMT', Ellipsis)]:
+                    np.testing.assert_array_equal(f.read(varn, index), g.read(varn, index))
+                out = np.empty((116, 100))
+                self.assertIs(f.read('TEMP', (0, 0), out=out), out)
+                np.testing.assert_array_equal(out, g.read('TEMP', (0, 0)))
+                self.assertEqual(f.variables['time'].calendar, g.variables['time'].calendar)
+            with mfdataset.open_pop_mfdataset(files, backend='h5py') as ds:
+                np.testing.assert_array_equal(ds['MOC'][:,1,0], 
+                        np.concatenate([netCDF4.Dataset(fname).variables['MOC'][:,1,0] for fname in ncfiles]))
+            np.testing.assert_array_equal(
+                    metrics.get_amoc(files, window_size=0, backend='h5py'),
+                    metrics.get_amoc(ncfiles, window_size=0, backend='netcdf4'))
+            backends.get_pool('h5py').close()
+        finally:
+            shutil.rmtree(tmpdir)
+
+if __name__ == '__main__':
+    unittest.main()
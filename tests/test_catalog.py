@@ -0,0 +1,72 @@
+import unittest
+import glob
+import os
+import shutil
+import tempfile
+import netCDF4
+import numpy as np
+from poppy import catalog
+from poppy import metrics
+
+class TestLoad(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        for fname in glob.glob('./data/x3_0801-??.nc'):
+            shutil.copy(fname, os.path.join(self.tmpdir, 'x3.pop.h.' + os.path.basename(fname)[3:]))
+        self.dbfile = os.path.join(self.tmpdir, 'hist.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_parse_filename(self):
+        self.assertEqual(catalog.parse_filename('b.e11.B1850.f19_g16.pop.h.nday1.0300-01-01.nc'),
+                ('b.e11.B1850.f19_g16', 'h.nday1'))
+        self.assertEqual(catalog.parse_filename('x3_0801-01.nc'), (None, None))
+
+    def test_scan_and_query(self):
+        with catalog.Catalog(self.dbfile) as cat:
+            self.assertEqual(cat.scan(self.tmpdir, nprocs=2), (2, 0))
+            # unchanged files are not rescanned
+            self.assertEqual(cat.scan(self.tmpdir), (0, 0))
+            files = cat.query(case='x3', stream='h', yearlim=(801, 801), variables=['MOC'])
+            self.assertEqual([os.path.basename(f) for f in files], 
+                    ['x3.pop.h.0801-01.nc', 'x3.pop.h.0801-02.nc'])
+            self.assertEqual(cat.query(yearlim=(802, None)), [])
+            info = cat.info(files[0])
+            self.assertEqual(info['grid'], '116x100')
+            self.assertEqual(info['variables']['TEMP']['shape'], (1, 60, 116, 100))
+            os.remove(files[1])
+            self.assertEqual(cat.scan(self.tmpdir), (0, 1))
+            self.assertEqual(len(cat), 1)
+
+    def test_year_boundary(self):
+        # December of year 800 is stamped 801-01-01, January 801 is stamped 801-02-01
+        src = glob.glob(os.path.join(self.tmpdir, '*.nc'))
+        for fname, bounds in zip(sorted(src), [(334, 365), (365, 396)]):
+            with netCDF4.Dataset(fname, 'a') as ds:
+                ds.variables['time_bound'][0] = 800*365 + np.array(bounds)
+                ds.variables['time'][0] = 800*365 + bounds[1]
+        with catalog.Catalog(self.dbfile) as cat:
+            cat.scan(self.tmpdir)
+            self.assertEqual([os.path.basename(f) for f in cat.query(yearlim=(800, 800))],
+                    ['x3.pop.h.0801-01.nc'])
+            self.assertEqual([os.path.basename(f) for f in cat.query(yearlim=(801, 801))],
+                    ['x3.pop.h.0801-02.nc'])
+            self.assertAlmostEqual(cat.info(sorted(src)[1])['tstart'], 801., places=2)
+
+    def test_no_calendar(self):
+        fname = sorted(glob.glob(os.path.join(self.tmpdir, '*.nc')))[0]
+        with netCDF4.Dataset(fname, 'a') as ds:
+            ds.variables['time'].delncattr('calendar')
+        info = catalog.scan_file(fname)
+        self.assertEqual(info['ntime'], 1)
+
+    def test_metrics_query(self):
+        with catalog.Catalog(self.dbfile) as cat:
+            cat.scan(self.tmpdir)
+        ts = metrics.get_amoc(catalog.Query(self.dbfile, case='x3'), window_size=0)
+        self.assertEqual(len(ts), 2)
+
+if __name__ == '__main__':
+    unittest.main()
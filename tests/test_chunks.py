@@ -0,0 +1,95 @@
+import unittest
+import os
+import shutil
+import tempfile
+import netCDF4
+import numpy as np
+from poppy import chunks
+from poppy import derived
+from test_backends import _to_netcdf4
+
+ncfile = './data/x3_0801-01.nc'
+
+
+class TestLoad(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmpdir = tempfile.mkdtemp()
+        cls.nc4file = os.path.join(cls.tmpdir, 'x3_0801-01.nc')
+        _to_netcdf4(ncfile, cls.nc4file)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmpdir)
+
+    def setUp(self):
+        chunks.stats.reset()
+
+    def tearDown(self):
+        chunks.stats.enabled = False
+
+    def test_level_blocks(self):
+        with netCDF4.Dataset(ncfile) as ds:
+            temp = ds.variables['TEMP']
+            self.assertIsNone(chunks.get_chunking(temp))
+            self.assertEqual(chunks.level_blocks(temp, 2, 5), [(2, 3), (3, 4), (4, 5)])
+        with netCDF4.Dataset(self.nc4file) as ds:
+            temp = ds.variables['TEMP']
+            chunking = chunks.get_chunking(temp)
+            self.assertEqual(len(chunking), 4)
+            nz = temp.shape[1]
+            blocks = chunks.level_blocks(temp, 0, nz)
+            self.assertEqual([k for k0, k1 in blocks for k in range(k0, k1)], list(range(nz)))
+            for k0, k1 in blocks:
+                self.assertEqual(k0 // chunking[1], (k1 - 1) // chunking[1])
+            # blocks above the limit fall back to single levels
+            blocks = chunks.level_blocks(temp, 0, nz, maxbytes=1)
+            self.assertEqual(blocks, [(k, k+1) for k in range(nz)])
+
+    def test_tune_cache(self):
+        with netCDF4.Dataset(self.nc4file) as ds:
+            temp = ds.variables['TEMP']
+            temp.set_var_chunk_cache(size=1024, nelems=1, preemption=0.75)
+            working_set = sum(nbytes for _, nbytes in chunks.touched_chunks(temp, (0, 0)))
+            self.assertEqual(chunks.tune_cache(temp, (0, 0)), working_set)
+            self.assertEqual(temp.get_var_chunk_cache()[0], working_set)
+            # never shrinks
+            self.assertEqual(chunks.tune_cache(temp, (0, 0, 0, 0)), working_set)
+
+    def test_read_aligned(self):
+        jj = [50, 3, 80, 4]
+        ii = np.arange(0, 100, 7)
+        with netCDF4.Dataset(self.nc4file) as ds:
+            temp = ds.variables['TEMP']
+            expected = temp[0, :10, jj, ii]
+            data = chunks.read_aligned(temp, (0, slice(None, 10), jj, ii))
+            self.assertEqual(data.shape, expected.shape)
+            np.testing.assert_array_equal(np.ma.getmaskarray(data), np.ma.getmaskarray(expected))
+            np.testing.assert_array_equal(data, expected)
+
+    def test_stats(self):
+        chunks.stats.enabled = True
+        with netCDF4.Dataset(self.nc4file) as ds:
+            temp = ds.variables['TEMP']
+            chunks.read(temp, (0, 0))
+            reads, requested, decompressed, nchunks = chunks.stats.totals()
+            self.assertEqual(requested, temp.shape[2] * temp.shape[3] * temp.dtype.itemsize)
+            self.assertGreaterEqual(decompressed, requested)
+            # the next level is served from the chunk cache
+            chunks.read(temp, (0, 1))
+            self.assertEqual(chunks.stats.totals()[2], decompressed)
+        self.assertIn('TEMP', chunks.stats.report())
+
+    def test_iter_levels(self):
+        with netCDF4.Dataset(self.nc4file) as ds:
+            dsvar = ds.variables
+            nz = dsvar['TEMP'].shape[1]
+            nlevels = 0
+            for k, layer in derived.iter_levels(dsvar, 'TEMP', kzo=nz):
+                np.testing.assert_array_equal(layer, dsvar['TEMP'][0, k])
+                nlevels += 1
+            self.assertEqual(nlevels, nz)
+
+if __name__ == '__main__':
+    unittest.main()
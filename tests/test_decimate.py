@@ -0,0 +1,27 @@
+import unittest
+import numpy as np
+from poppy import decimate
+
+class TestLoad(unittest.TestCase):
+
+    def test_block_reducer(self):
+        data = np.ma.masked_invalid(np.arange(35, dtype=float).reshape((5, 7)))
+        data[0,0] = np.ma.masked
+        reducer = decimate.BlockReducer(data.shape, (2, 3), how='mean')
+        reduced = reducer(data)
+        self.assertEqual(reduced.shape, (3, 3))
+        self.assertAlmostEqual(reduced[0,0], np.mean([1, 2, 7, 8, 9]))
+        self.assertAlmostEqual(reduced[2,2], 34.)
+        reduced = decimate.BlockReducer(data.shape, 2, how='max')(data)
+        self.assertAlmostEqual(reduced[0,0], 8.)
+        empty = np.ma.masked_all((4, 4))
+        self.assertTrue(decimate.BlockReducer((4, 4), 2)(empty).mask.all())
+
+    def test_factor_and_edges(self):
+        self.assertEqual(decimate.get_factor((2400, 3600), (600, 800)), (4, 5))
+        self.assertEqual(decimate.get_factor((10, 10), 1000), (1, 1))
+        edges = np.arange(8) - 0.5
+        np.testing.assert_array_equal(decimate.coarse_edges(edges, 3, 7), [-0.5, 2.5, 5.5, 6.5])
+
+if __name__ == '__main__':
+    unittest.main()
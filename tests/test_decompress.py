@@ -0,0 +1,70 @@
+import unittest
+import os
+import shutil
+import tempfile
+import netCDF4
+import numpy as np
+from poppy import backends
+from poppy import decompress
+from poppy.lazy import available, LazyModule
+
+h5py = LazyModule('h5py')
+
+ncfile = './data/x3_0801-01.nc'
+
+
+def _to_small_chunks(src, dst, varn='TEMP', chunksizes=(1, 7, 30, 25)):
+    with netCDF4.Dataset(src) as ds, netCDF4.Dataset(dst, 'w', format='NETCDF4') as out:
+        for name, dim in ds.dimensions.items():
+            out.createDimension(name, None if dim.isunlimited() else len(dim))
+        var = ds.variables[varn]
+        newvar = out.createVariable(varn, var.dtype, var.dimensions, zlib=True, shuffle=True,
+                chunksizes=chunksizes, fill_value=var._FillValue)
+        var.set_auto_mask(False)
+        newvar.set_auto_mask(False)
+        newvar[:] = var[:]
+        # only the first chunks are written
+        sparse = out.createVariable('SPARSE', 'f8', var.dimensions, zlib=True,
+                chunksizes=chunksizes, fill_value=-1.)
+        sparse[0, :3, :10, :10] = 1.
+
+
+@unittest.skipUnless(available('h5py'), 'h5py not installed')
+class TestLoad(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmpdir = tempfile.mkdtemp()
+        cls.fname = os.path.join(cls.tmpdir, 'x3_0801-01.nc')
+        _to_small_chunks(ncfile, cls.fname)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmpdir)
+
+    def test_read_hyperslab(self):
+        with h5py.File(self.fname, 'r') as f:
+            self.assertTrue(decompress.supported(f['TEMP']))
+            for index in [(0, slice(None)), (0, 3), (slice(None), slice(10, 20), 5),
+                    (0, slice(2, 50, 3), slice(5, 100, 7), slice(None, None, 2))]:
+                np.testing.assert_array_equal(
+                        decompress.read_hyperslab(f['TEMP'], index, threads=3), f['TEMP'][index])
+            np.testing.assert_array_equal(
+                    decompress.read_hyperslab(f['SPARSE'], (0, slice(0, 10)), threads=3),
+                    f['SPARSE'][0, 0:10])
+            # non-contiguous output buffer
+            out = np.empty((116, 100, 60), dtype='f4').transpose(2, 0, 1)
+            decompress.read_hyperslab(f['TEMP'], (0,), out=out, threads=2)
+            np.testing.assert_array_equal(out, f['TEMP'][0])
+
+    def test_backend(self):
+        with backends.open_file(self.fname, 'h5py') as f:
+            expected = f.read('TEMP', (0, slice(None)))
+        with backends.H5pyThreadedFile(self.fname, threads=4) as f:
+            self.assertEqual(f.threads, 4)
+            temp = f.read('TEMP', (0, slice(None)))
+        np.testing.assert_array_equal(temp, expected)
+        self.assertTrue(np.isnan(temp).any())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,27 @@
+import unittest
+import netCDF4
+import numpy as np
+from poppy import derived
+
+class TestLoad(unittest.TestCase):
+
+    def setUp(self):
+        derived.register('TEMP_K', ['TEMP'], lambda temp, offset: temp + offset,
+                params=dict(offset=273.15), units='K')
+
+    def tearDown(self):
+        del derived.registry['TEMP_K']
+
+    def test_read_derived(self):
+        fname = './data/x3_0801-01.nc'
+        with netCDF4.Dataset(fname) as ds:
+            dsvar = ds.variables
+            temp = derived.read(dsvar, 'TEMP', (0,0))
+            self.assertTrue(np.allclose(temp, dsvar['TEMP'][0,0]))
+            tempk = derived.read(dsvar, 'TEMP_K', (0,0))
+            self.assertTrue(np.allclose(tempk, temp + 273.15))
+            tempk = derived.read(dsvar, 'TEMP_K', (0,0), offset=0.)
+            self.assertTrue(np.allclose(tempk, temp))
+
+if __name__ == '__main__':
+    unittest.main()
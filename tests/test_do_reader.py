@@ -0,0 +1,93 @@
+import unittest
+import os
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+from poppy import do_reader
+from poppy import do_store
+
+class TestLoad(unittest.TestCase):
+
+    def test_read_do_file(self):
+        fname = './data/x3.pop.do.0801-01-01-00000'
+        df = do_reader.read_do_file(fname)
+        straits = ['DS','FBC','RossSea','WeddellSea']
+        self.assertEqual(len(df), 5*len(straits))
+        self.assertEqual(list(df.columns), do_reader.cols['TS'][1:] + do_reader.cols['tr'][1:])
+        self.assertEqual(list(df.index.names), ['Strait','ModelYear'])
+        self.assertTrue(np.allclose(df.loc['DS'].index, 801 + np.arange(5)/5.))
+        # second strait, first record
+        with open(fname) as f:
+            line = [l for l in f if l.startswith(' ovf_TS')][1]
+        self.assertTrue(np.allclose(df.loc['FBC'].iloc[0][:8], list(map(float, line[18:].split()[1:]))))
+
+    def test_read_do_multifile(self):
+        fname = './data/x3.pop.do.0801-01-01-00000'
+        df = do_reader.read_do_multifile([fname, fname], nprocs=2)
+        self.assertEqual(len(df), 2*len(do_reader.read_do_file(fname)))
+
+    def test_follow(self):
+        fname = './data/x3.pop.do.0801-01-01-00000'
+        with open(fname, 'rb') as f:
+            contents = f.read()
+        tmpdir = tempfile.mkdtemp()
+        try:
+            runfile = os.path.join(tmpdir, os.path.basename(fname))
+            follower = do_reader.DoFollower(os.path.join(tmpdir, 'do.h5'), nperyear=5)
+            # incomplete time step
+            with open(runfile, 'wb') as f:
+                f.write(contents[:len(contents)//3])
+            df1 = follower.update(runfile)
+            with open(runfile, 'wb') as f:
+                f.write(contents)
+            df2 = follower.update(runfile)
+            self.assertIsNone(follower.update(runfile))
+            df = pd.read_hdf(follower.store, follower.key)
+            self.assertEqual(len(df1) + len(df2), len(df))
+            pd.testing.assert_frame_equal(
+                    df.sort_index(level=0, sort_remaining=False),
+                    do_reader.read_do_file(fname).sort_index(level=0, sort_remaining=False))
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_follow_resume(self):
+        fname = './data/x3.pop.do.0801-01-01-00000'
+        with open(fname, 'rb') as f:
+            contents = f.read()
+        tmpdir = tempfile.mkdtemp()
+        try:
+            runfile = os.path.join(tmpdir, os.path.basename(fname))
+            store = os.path.join(tmpdir, 'do.h5')
+            follower = do_reader.DoFollower(store, nperyear=5)
+            # complete time steps of the first half
+            half = contents[:follower._complete_length(contents[:len(contents)//2])]
+            with open(runfile, 'wb') as f:
+                f.write(half)
+            follower.update(runfile)
+            # interrupted after appending, before saving the state
+            shutil.copy(follower.statefile, follower.statefile + '.bak')
+            with open(runfile, 'wb') as f:
+                f.write(contents)
+            follower.update(runfile)
+            os.rename(follower.statefile + '.bak', follower.statefile)
+            do_reader.DoFollower(store, nperyear=5).update(runfile)
+            expected = do_reader.read_do_file(fname).sort_index()
+            pd.testing.assert_frame_equal(pd.read_hdf(store, follower.key).sort_index(), expected)
+            # replaced by a shorter file, then by a larger one with other values
+            for replacement in [half, contents.replace(b'E+0', b'E-0')]:
+                tmpfile = runfile + '.tmp'
+                with open(tmpfile, 'wb') as f:
+                    f.write(replacement)
+                os.rename(tmpfile, runfile)
+                do_reader.DoFollower(store, nperyear=5).update(runfile)
+                expected = do_reader._parse_do_contents(
+                        replacement, follower.straits, 801, nperyear=5).sort_index()
+                pd.testing.assert_frame_equal(pd.read_hdf(store, follower.key).sort_index(), expected)
+                pd.testing.assert_frame_equal(do_store.query(store, annual=True).sort_index(),
+                        do_store.annual_means(expected), check_index_type=False)
+        finally:
+            shutil.rmtree(tmpdir)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,33 @@
+import unittest
+import os
+import shutil
+import tempfile
+import numpy as np
+from poppy import do_reader
+from poppy import do_store
+
+class TestLoad(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.store = os.path.join(self.tmpdir, 'do.h5')
+        self.df = do_reader.read_do_file('./data/x3.pop.do.0801-01-01-00000')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_query(self):
+        do_store.write(self.store, self.df)
+        df = do_store.query(self.store, strait='DS', yearlim=(801.2,None), columns=['Ms','Mp'])
+        self.assertEqual(list(df.columns), ['Ms','Mp'])
+        self.assertTrue(np.allclose(df.values, self.df.loc['DS'].iloc[1:][['Ms','Mp']].values))
+
+    def test_annual(self):
+        do_store.append(self.store, self.df.iloc[::2])
+        do_store.append(self.store, self.df.iloc[1::2])
+        annual = do_store.query(self.store, annual=True)
+        self.assertEqual(len(annual), 4)
+        self.assertTrue(np.allclose(annual.loc['FBC'].values, self.df.loc['FBC'].mean().values))
+
+if __name__ == '__main__':
+    unittest.main()
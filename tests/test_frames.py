@@ -0,0 +1,65 @@
+import unittest
+import os
+import time
+import shutil
+import tempfile
+import numpy as np
+from poppy import ncpool
+from poppy.frames import FrameSource, CubeFrameSource
+
+ncfiles = ['./data/x3_0801-01.nc', './data/x3_0801-02.nc'] * 3
+
+def _reader(dsvar):
+    return dsvar['TEMP'][0,0], dsvar['time'][0]
+
+class TestLoad(unittest.TestCase):
+
+    def test_prefetch(self):
+        frames = FrameSource(ncfiles, _reader, lookahead=2)
+        expected = [frames.read(i) for i in range(len(frames))]
+        for i in list(range(len(frames))) + [3, 4, 0]:
+            data, time = frames[i]
+            np.testing.assert_array_equal(data, expected[i][0])
+            self.assertEqual(time, expected[i][1])
+        frames.stop()
+
+    def test_lock(self):
+        frames = FrameSource(ncfiles, _reader, lookahead=2)
+        with ncpool.netcdf_lock:
+            frames._start(0)
+            time.sleep(0.2)
+            # the prefetch thread waits for the lock
+            self.assertTrue(frames._queue.empty())
+        data, t = frames[0]
+        np.testing.assert_array_equal(data, frames.read(0)[0])
+        frames.stop()
+
+    def test_error(self):
+        frames = FrameSource(ncfiles, lambda dsvar: dsvar['NOTAVAR'][0], lookahead=2)
+        with self.assertRaises(KeyError):
+            frames[0]
+        frames.stop()
+
+    def test_cube(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmpdir, 'cube.npy')
+            cube = CubeFrameSource.open_or_extract(path, ncfiles, _reader, meta=dict(k=0))
+            frames = FrameSource(ncfiles, _reader, lookahead=0)
+            for i in range(len(frames)):
+                data, time = frames[i]
+                cdata, ctime = cube[i]
+                np.testing.assert_array_equal(cdata.mask, data.mask)
+                np.testing.assert_allclose(cdata.compressed(), data.compressed(), rtol=1e-6)
+                self.assertEqual(ctime, time)
+            self.assertEqual(cube.data.dtype, np.float32)
+            mtime = os.path.getmtime(path)
+            CubeFrameSource.open_or_extract(path, ncfiles, _reader, meta=dict(k=0))
+            self.assertEqual(os.path.getmtime(path), mtime)
+            cube = CubeFrameSource.open_or_extract(path, ncfiles[:2], _reader, meta=dict(k=0))
+            self.assertEqual(len(cube), 2)
+        finally:
+            shutil.rmtree(tmpdir)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,33 @@
+import unittest
+import os
+import subprocess
+import sys
+
+from poppy import lazy
+from poppy import colormaps
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+class TestLoad(unittest.TestCase):
+
+    def test_heavy_modules_not_imported(self):
+        code = ('import sys, poppy.metrics, poppy.do_store; '
+                'print(" ".join(m for m in ["pandas", "scipy", "xray"] if m in sys.modules))')
+        env = dict(os.environ, PYTHONPATH=root)
+        out = subprocess.check_output([sys.executable, '-c', code], env=env)
+        self.assertEqual(out.decode().strip(), '')
+
+    def test_lazy_module(self):
+        mod = lazy.LazyModule('json')
+        self.assertEqual(mod.dumps([1]), '[1]')
+        self.assertTrue(lazy.available('json'))
+        self.assertFalse(lazy.available('not_a_module_name'))
+
+    def test_colormaps(self):
+        import matplotlib
+        colormaps.register_cmaps()
+        cmap = matplotlib.colormaps['GMT_ocean_r']
+        self.assertEqual(tuple(cmap(1.0)[:3]), (0., 0., 0.))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,7 +1,41 @@
 import unittest
 import glob
+import os
+import shutil
+import tempfile
+import netCDF4
 import numpy as np
+try:
+    from unittest import mock
+except ImportError:
+    import mock
 from poppy import metrics
+from poppy import backends
+
+
+def _concatenate(ncfiles, dst):
+    """Write the time steps of `ncfiles` into one file"""
+    with netCDF4.Dataset(ncfiles[0]) as ds, netCDF4.Dataset(dst, 'w', format=ds.file_format) as out:
+        for name, dim in ds.dimensions.items():
+            out.createDimension(name, None if dim.isunlimited() else len(dim))
+        for name, var in ds.variables.items():
+            attrs = dict((attr, var.getncattr(attr)) for attr in var.ncattrs())
+            newvar = out.createVariable(name, var.dtype, var.dimensions,
+                    fill_value=attrs.pop('_FillValue', None))
+            newvar.setncatts(attrs)
+            newvar.set_auto_mask(False)
+            if 'time' not in var.dimensions:
+                var.set_auto_mask(False)
+                newvar[:] = var[:]
+        t = 0
+        for fname in ncfiles:
+            with netCDF4.Dataset(fname) as src:
+                nt = len(src.dimensions['time'])
+                for name, var in src.variables.items():
+                    if 'time' in var.dimensions:
+                        var.set_auto_mask(False)
+                        out.variables[name][t:t+nt] = var[:]
+                t += nt
 
 class TestLoad(unittest.TestCase):
 
@@ -26,5 +60,51 @@ class TestLoad(unittest.TestCase):
         # temperature below 100 degC
         self.assertTrue(np.mean(df) < 100)
 
+    def test_multiple_time_steps(self):
+        """Test that all time steps of files with several steps are used"""
+        ncfiles = sorted(glob.glob('./data/x3_0801-??.nc'))
+        tmpdir = tempfile.mkdtemp()
+        try:
+            fname = os.path.join(tmpdir, 'x3_0801.nc')
+            _concatenate(ncfiles, fname)
+            for func, kwargs in [
+                    (metrics.get_amoc, dict(window_size=0)),
+                    (metrics.get_timeseries, dict(varn='TEMP', grid='T', latlim=(60,90)))]:
+                expected = func(ncfiles, store=False, **kwargs)
+                result = func([fname], store=False, **kwargs)
+                self.assertEqual(len(result), len(ncfiles))
+                np.testing.assert_allclose(np.asarray(result), np.asarray(expected))
+                if metrics.use_pandas:
+                    np.testing.assert_allclose(result.index, expected.index)
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_time_read_once(self):
+        """Test that the time axis comes from the scan of the files"""
+        ncfiles = sorted(glob.glob('./data/x3_0801-??.nc'))
+        tmpdir = tempfile.mkdtemp()
+        reads = []
+        read = backends.Netcdf4File.read
+        def _read(f, varn, *args, **kwargs):
+            if varn == 'time':
+                reads.append(f.fname)
+            return read(f, varn, *args, **kwargs)
+        try:
+            cachefile = os.path.join(tmpdir, 'agg.npz')
+            with mock.patch.object(backends.Netcdf4File, 'read', _read):
+                for func, kwargs in [
+                        (metrics.get_amoc, dict(window_size=0)),
+                        (metrics.get_timeseries, dict(varn='TEMP', grid='T', latlim=(60,90)))]:
+                    del reads[:]
+                    func(ncfiles, store=False, backend='netcdf4', **kwargs)
+                    self.assertEqual(sorted(reads), [os.path.abspath(f) for f in ncfiles])
+                    # nothing read with the aggregation cache
+                    func(ncfiles, store=False, backend='netcdf4', cachefile=cachefile, **kwargs)
+                    del reads[:]
+                    func(ncfiles, store=False, backend='netcdf4', cachefile=cachefile, **kwargs)
+                    self.assertEqual(reads, [])
+        finally:
+            shutil.rmtree(tmpdir)
+
 if __name__ == '__main__':
     unittest.main()
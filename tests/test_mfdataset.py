@@ -0,0 +1,43 @@
+import unittest
+import glob
+import os
+import shutil
+import tempfile
+import netCDF4
+import numpy as np
+from poppy import mfdataset
+from poppy import utils
+
+ncfiles = sorted(glob.glob('./data/x3_0801-??.nc')) * 3
+
+class TestLoad(unittest.TestCase):
+
+    def test_reads(self):
+        expected = np.ma.concatenate([netCDF4.Dataset(f).variables['MOC'][:,1,0,10:20,50] for f in ncfiles])
+        with mfdataset.open_pop_mfdataset(ncfiles, maxopen=2) as ds:
+            self.assertEqual(ds['MOC'].shape[0], len(ncfiles))
+            np.testing.assert_array_equal(ds['MOC'][:,1,0,10:20,50], expected)
+            np.testing.assert_array_equal(ds['MOC'][3,1,0,10:20,50], expected[3])
+            np.testing.assert_array_equal(ds['MOC'][-2:,1,0,10:20,50], expected[-2:])
+            np.testing.assert_array_equal(ds['MOC'][[0,2,5],1,0,10:20,50], expected[[0,2,5]])
+            self.assertLessEqual(len(ds.handles), 2)
+            self.assertEqual(ds['TLAT'].shape, (116, 100))
+            np.testing.assert_allclose(ds.get_time_decimal_year(),
+                    [utils.get_time_decimal_year(netCDF4.Dataset(f).variables['time']) for f in ncfiles])
+            self.assertEqual(ds['time'].units, netCDF4.Dataset(ncfiles[0]).variables['time'].units)
+
+    def test_cache(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            cachefile = os.path.join(tmpdir, 'agg.npz')
+            ntime, times = mfdataset.build_aggregation(ncfiles[:2], cachefile=cachefile)
+            mtime = os.path.getmtime(cachefile)
+            ntime2, times2 = mfdataset.build_aggregation(ncfiles[:2], cachefile=cachefile)
+            self.assertEqual(os.path.getmtime(cachefile), mtime)
+            np.testing.assert_array_equal(times, times2)
+            np.testing.assert_array_equal(ntime, [1, 1])
+        finally:
+            shutil.rmtree(tmpdir)
+
+if __name__ == '__main__':
+    unittest.main()
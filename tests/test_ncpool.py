@@ -0,0 +1,53 @@
+import unittest
+import glob
+import os
+import shutil
+import tempfile
+import numpy as np
+from poppy import ncpool
+
+ncfiles = sorted(glob.glob('./data/x3_0801-??.nc'))
+
+class TestLoad(unittest.TestCase):
+
+    def test_get_ulimitn(self):
+        self.assertGreater(ncpool.get_ulimitn(), 0)
+        self.assertGreaterEqual(ncpool.default_maxopen(), 1)
+
+    def test_reuse(self):
+        pool = ncpool.HandlePool(maxopen=1)
+        with pool.borrow(ncfiles[0]) as ds:
+            zax = ds.variables['z_w'][:]
+        with pool.borrow(ncfiles[0]) as ds2:
+            self.assertIs(ds2, ds)
+            np.testing.assert_array_equal(ds2.variables['z_w'][:], zax)
+        with pool.borrow(ncfiles[1]) as ds3:
+            self.assertEqual(len(pool), 1)
+            self.assertNotIn(ncfiles[0], pool)
+        pool.close()
+        self.assertEqual(len(pool), 0)
+
+    def test_borrowed_not_evicted(self):
+        pool = ncpool.HandlePool(maxopen=1)
+        with pool.borrow(ncfiles[0]) as ds:
+            with pool.borrow(ncfiles[1]):
+                self.assertEqual(len(pool), 2)
+            self.assertEqual(len(ds.variables['time'][:]), 1)
+        self.assertEqual(len(pool), 1)
+        pool.close()
+
+    def test_modified(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            fname = os.path.join(tmpdir, 'x3.nc')
+            shutil.copy(ncfiles[0], fname)
+            pool = ncpool.HandlePool()
+            ds = pool.get(fname)
+            os.utime(fname, (0, 0))
+            self.assertIsNot(pool.get(fname), ds)
+            pool.close()
+        finally:
+            shutil.rmtree(tmpdir)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+import unittest
+import glob
+import os
+import shutil
+import tempfile
+import warnings
+import netCDF4
+import numpy as np
+from poppy import ovf_sampler
+
+
+def _make_file(fname, nt=2, nz=4, ny=6, nx=7):
+    rng = np.random.RandomState(0)
+    with netCDF4.Dataset(fname, 'w') as ds:
+        ds.createDimension('time', None)
+        ds.createDimension('z_t', nz)
+        ds.createDimension('nlat', ny)
+        ds.createDimension('nlon', nx)
+        time = ds.createVariable('time', 'f8', ('time',))
+        time.units = 'days since 0000-01-01 00:00:00'
+        time.calendar = 'noleap'
+        time[:] = 365. * 801 + 31. * np.arange(1, nt+1)
+        ds.createVariable('dz', 'f8', ('z_t',))[:] = 1e3 * np.arange(1, nz+1)
+        ds.createVariable('TAREA', 'f8', ('nlat', 'nlon'))[:] = 1e10 * (1. + rng.rand(ny, nx))
+        kmt = np.full((ny, nx), nz, dtype='i4')
+        kmt[:, 0] = 0
+        kmt[2, :] = 2
+        ds.createVariable('KMT', 'i4', ('nlat', 'nlon'))[:] = kmt
+        land = np.arange(nz)[:, np.newaxis, np.newaxis] >= kmt
+        for varn, mean in [('TEMP', 2.), ('SALT', 34.9)]:
+            var = ds.createVariable(varn, 'f4', ('time', 'z_t', 'nlat', 'nlon'), fill_value=9.96921e36)
+            var[:] = np.ma.masked_where(np.broadcast_to(land, (nt, nz, ny, nx)),
+                    mean + rng.randn(nt, nz, ny, nx))
+
+
+class TestLoad(unittest.TestCase):
+
+    def setUp(self):
+        self.overflows = {
+            'A' : {
+                'src' : dict(ii=np.array([10,11,12]), jj=np.array([50,50,50]), kk=np.array([5,5,5])),
+                'prd' : dict(ii=np.array([98,99,0,1]), jj=np.array([60,61,61,62]), kk=np.array([9,9,10,10])),
+                }}
+
+    def test_get_point_batches(self):
+        batches = ovf_sampler.get_point_batches(self.overflows)
+        # product points wrap around zonally and are split into two batches
+        self.assertEqual(len(batches), 3)
+
+    def test_sample_overflow_points(self):
+        ncfiles = sorted(glob.glob('./data/x3_0801-??.nc'))
+        timeax, samples = ovf_sampler.sample_overflow_points(
+                self.overflows, ncfiles, varns=['TEMP'], nprocs=2)
+        self.assertEqual(len(timeax), len(ncfiles))
+        prd = self.overflows['A']['prd']
+        with netCDF4.Dataset(ncfiles[-1]) as ds:
+            expected = np.ma.filled(ds.variables['TEMP'][0][prd['kk'],prd['jj'],prd['ii']], np.nan)
+        self.assertTrue(np.allclose(samples['A']['prd']['TEMP'][-1], expected, equal_nan=True))
+        self.assertEqual(samples['A']['src']['TEMP'].shape, (len(ncfiles), 3))
+
+    def test_region_timeseries(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            fname = os.path.join(tmpdir, 'ovf.nc')
+            _make_file(fname)
+            regions = dict(
+                    inflow=dict(imin=0, imax=2, jmin=1, jmax=3, kmin=0, kmax=3),
+                    src=dict(imin=3, imax=4, jmin=2, jmax=2, kmin=1, kmax=2),
+                    ent=dict(imin=5, imax=6, jmin=4, jmax=5, kmin=3, kmax=3))
+            overflows = {'A' : dict(regions=regions)}
+            with netCDF4.Dataset(fname) as ds:
+                op, = ovf_sampler.get_region_operators(overflows, ds)
+                dsvar = ds.variables
+                volume = (dsvar['dz'][:][:, np.newaxis, np.newaxis] * 1e-2
+                        * dsvar['TAREA'][:] * 1e-4
+                        * (np.arange(4)[:, np.newaxis, np.newaxis] < dsvar['KMT'][:]))
+                temp = dsvar['TEMP'][:]
+                salt = dsvar['SALT'][:]
+            self.assertEqual(op['slices'], (slice(0, 4), slice(1, 6), slice(0, 7)))
+            for r, name in enumerate(ovf_sampler.regionnames):
+                box = tuple(slice(regions[name][dim+'min'], regions[name][dim+'max']+1) for dim in 'kji')
+                weights = np.zeros_like(volume)
+                weights[box] = volume[box]
+                np.testing.assert_allclose(op['weights'][r], weights[op['slices']])
+            df = ovf_sampler.get_region_timeseries(overflows, [fname, fname], eos='linear')
+            self.assertEqual(len(df), 4)
+            for name in ovf_sampler.regionnames:
+                box = tuple(slice(regions[name][dim+'min'], regions[name][dim+'max']+1) for dim in 'kji')
+                w = volume[box]
+                expected = (temp[(slice(None),) + box] * w).sum(axis=(1, 2, 3)) / w.sum()
+                np.testing.assert_allclose(df['A'][name]['TEMP'].values[:2], expected, rtol=1e-6)
+                rho = ovf_sampler.sigma0(salt[(slice(None),) + box], temp[(slice(None),) + box], eos='linear')
+                np.testing.assert_allclose(df['A'][name]['SIGMA0'].values[:2],
+                        (rho * w).sum(axis=(1, 2, 3)) / w.sum(), rtol=1e-5)
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_sigma0_fallback(self):
+        use_gsw = ovf_sampler.use_gsw
+        ovf_sampler.use_gsw = False
+        try:
+            with warnings.catch_warnings(record=True) as caught:
+                warnings.simplefilter('always')
+                rho = ovf_sampler.sigma0(34.9, 0.)
+            self.assertEqual(len(caught), 1)
+            self.assertAlmostEqual(rho, 28.)
+            with self.assertRaises(ImportError):
+                ovf_sampler.sigma0(34.9, 0., eos='gsw')
+        finally:
+            ovf_sampler.use_gsw = use_gsw
+
+if __name__ == '__main__':
+    unittest.main()
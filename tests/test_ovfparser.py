@@ -1,5 +1,9 @@
 import unittest
-from poppy.ovfparser import parse_ovf_file
+import os
+import shutil
+import tempfile
+import numpy as np
+from poppy.ovfparser import parse_ovf_file, load_ovf_table
 
 class TestLoad(unittest.TestCase):
 
@@ -8,5 +12,26 @@ class TestLoad(unittest.TestCase):
         overflows = parse_ovf_file(ovf_file)
         self.assertIsInstance(overflows, dict)
 
+    def test_load_ovf_table(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            ovf_file = os.path.join(tmpdir, 'gx1v6_overflow')
+            shutil.copy('./data/gx1v6_overflow', ovf_file)
+            overflows = parse_ovf_file(ovf_file)
+            table = load_ovf_table(ovf_file)
+            self.assertTrue(os.path.exists(ovf_file + '.points.npy'))
+            cached = load_ovf_table(ovf_file)
+            self.assertIsInstance(cached.points, np.memmap)
+            self.assertEqual(sorted(cached.names), sorted(overflows))
+            np.testing.assert_array_equal(cached.points, table.points)
+            roundtrip = cached.to_dict()
+            for ovf in overflows:
+                for settype in ['src', 'ent', 'prd']:
+                    for key in ['ii', 'jj', 'kk', 'dd', 'set']:
+                        np.testing.assert_array_equal(
+                                roundtrip[ovf][settype][key], overflows[ovf][settype][key])
+        finally:
+            shutil.rmtree(tmpdir)
+
 if __name__ == '__main__':
     unittest.main()
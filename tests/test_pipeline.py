@@ -0,0 +1,59 @@
+import unittest
+import glob
+import os
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+from poppy import pipeline
+from poppy import metrics
+
+config = {
+    'cases' : {
+        'x3' : {'files' : ['./data/x3_0801-??.nc']},
+        },
+    'metrics' : [
+        {'name' : 'AMOC', 'type' : 'amoc', 'latlim' : [30,60], 'zlim' : [500,9999], 'window_size' : 0},
+        {'name' : 'SST_max', 'type' : 'region', 'varn' : 'TEMP', 'region' : 'NorthAtlantic', 
+         'reduce' : 'nanmax', 'k' : 0},
+        ],
+    }
+
+class TestLoad(unittest.TestCase):
+
+    def test_run(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            output = os.path.join(tmpdir, 'ts.h5')
+            results = pipeline.run(config, output=output, verbose=False)
+            df = results['x3']
+            self.assertEqual(list(df.columns), ['AMOC', 'SST_max'])
+            ncfiles = sorted(glob.glob('./data/x3_0801-??.nc'))
+            amoc = metrics.get_amoc(ncfiles, latlim=(30,60), zlim=(500,9999), window_size=0)
+            np.testing.assert_allclose(df['AMOC'].values, amoc.values)
+            self.assertTrue((df['SST_max'] < 40).all())
+            stored = pd.read_hdf(output, 'x3/AMOC')
+            np.testing.assert_allclose(stored.values, amoc.values)
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_smoothing(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            # 30 monthly files, so that the 12-step running mean has valid values
+            src = sorted(glob.glob('./data/x3_0801-??.nc'))
+            ncfiles = [shutil.copy(src[n % 2], os.path.join(tmpdir, 'x3_{:04d}.nc'.format(n)))
+                    for n in range(30)]
+            amocconfig = {
+                'cases' : {'x3' : {'files' : [os.path.join(tmpdir, 'x3_*.nc')]}},
+                'metrics' : [dict(config['metrics'][0], window_size=12)],
+                }
+            df = pipeline.run(amocconfig, output=os.path.join(tmpdir, 'ts.h5'), verbose=False)['x3']
+            amoc = metrics.get_amoc(ncfiles, latlim=(30,60), zlim=(500,9999), window_size=12)
+            self.assertTrue(np.isfinite(amoc.values).any())
+            np.testing.assert_allclose(df['AMOC'].values, amoc.values)
+        finally:
+            shutil.rmtree(tmpdir)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+import unittest
+import os
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+from poppy import pyramid
+
+class TestLoad(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.store = os.path.join(self.tmpdir, 'pyramid.h5')
+        # 20 years of monthly data
+        index = pd.Index(1 + (np.arange(240) + 0.5)/12., name='ModelYear')
+        self.ts = pd.Series(np.arange(240.), index=index, name='AMOC')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_build_pyramid(self):
+        written = pyramid.build_pyramid(self.ts, self.store, 'AMOC')
+        self.assertEqual(written, ['annual', 'decadal'])
+        annual = pyramid.read_level(self.store, 'AMOC', 'annual')['AMOC']
+        self.assertEqual(len(annual), 20)
+        self.assertTrue(np.allclose(annual['mean'], np.arange(20)*12 + 5.5))
+        self.assertTrue(np.allclose(annual['max'] - annual['min'], 11))
+
+    def test_select_level(self):
+        pyramid.build_pyramid(self.ts, self.store, 'AMOC')
+        self.assertEqual(pyramid.select_level(self.store, 'AMOC', (1,21), npixels=2), 'decadal')
+        self.assertEqual(pyramid.select_level(self.store, 'AMOC', (1,21), npixels=20), 'annual')
+        self.assertEqual(pyramid.select_level(self.store, 'AMOC', (1,21), npixels=100), 'raw')
+        self.assertEqual(pyramid.select_level(self.store, 'AMOC', (1,21), npixels=100, finest='annual'),
+                'annual')
+
+    def test_build_if_missing(self):
+        calls = []
+        def compute():
+            calls.append(1)
+            return self.ts
+        for _ in range(2):
+            pyramid.build_if_missing(self.store, 'AMOC', compute)
+        self.assertEqual(len(calls), 1)
+        self.assertTrue(pyramid.has_pyramid(self.store, 'AMOC'))
+
+    def test_rebuild(self):
+        calls = []
+        def compute():
+            calls.append(1)
+            return self.ts
+        fname = os.path.join(self.tmpdir, 'input.nc')
+        with open(fname, 'w') as f:
+            f.write('data')
+        for latlim in [(30, 60), (30, 60), (20, 60)]:
+            attrs = pyramid.source_attrs([fname], latlim=latlim)
+            pyramid.build_if_missing(self.store, 'AMOC', compute, attrs=attrs)
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(pyramid.get_attrs(self.store, 'AMOC')['latlim'], [20, 60])
+        # changed input file
+        with open(fname, 'a') as f:
+            f.write('more data')
+        pyramid.build_if_missing(self.store, 'AMOC', compute,
+                attrs=pyramid.source_attrs([fname], latlim=(20, 60)))
+        self.assertEqual(len(calls), 3)
+        self.assertEqual(pyramid.available_levels(self.store, 'AMOC'), ['annual', 'decadal'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+import unittest
+import glob
+import os
+import shutil
+import tempfile
+import netCDF4
+import numpy as np
+from poppy import metrics
+from poppy import rechunk
+
+
+class TestLoad(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.ncfiles = [shutil.copy(fname, self.tmpdir)
+                for fname in sorted(glob.glob('./data/x3_0801-??.nc'))]
+        self.storefile = os.path.join(self.tmpdir, 'store.nc')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_store_chunks(self):
+        chunks = rechunk.store_chunks((1200, 60, 384, 320), 4, tchunk=120, chunk_bytes=2**20)
+        self.assertEqual(chunks[0], 120)
+        self.assertLessEqual(np.prod(chunks) * 4, 2**20)
+
+    def test_build_and_append(self):
+        self.assertEqual(rechunk.build_store(self.storefile, self.ncfiles[:1], ['MOC', 'TEMP'], tchunk=2), 1)
+        self.assertEqual(rechunk.build_store(self.storefile, self.ncfiles), 1)
+        self.assertEqual(rechunk.build_store(self.storefile, self.ncfiles), 0)
+        with netCDF4.Dataset(self.storefile) as ds:
+            self.assertEqual(ds.variables['TEMP'].chunking()[0], 2)
+            for t, fname in enumerate(self.ncfiles):
+                with netCDF4.Dataset(fname) as src:
+                    np.testing.assert_array_equal(
+                            ds.variables['TEMP'][t], np.ma.filled(src.variables['TEMP'][0], np.nan))
+        with self.assertRaises(ValueError):
+            rechunk.build_store(self.storefile, self.ncfiles, ['SALT'])
+
+    def test_interrupted_append(self):
+        rechunk.build_store(self.storefile, self.ncfiles[:1], ['MOC', 'TEMP'], tchunk=2)
+        # data of the second file written, source rows not (interrupted append)
+        with netCDF4.Dataset(self.storefile, 'a') as ds, netCDF4.Dataset(self.ncfiles[1]) as src:
+            ds.variables['time'][1] = src.variables['time'][0]
+            ds.variables['TEMP'][1] = 0.
+        with rechunk.RechunkedStore(self.storefile) as store:
+            self.assertEqual(store.ntime, 1)
+            self.assertEqual(len(store.get_time_decimal_year()), 1)
+        self.assertEqual(rechunk.build_store(self.storefile, self.ncfiles), 1)
+        with netCDF4.Dataset(self.storefile) as ds, netCDF4.Dataset(self.ncfiles[1]) as src:
+            self.assertEqual(len(ds.variables['time']), 2)
+            np.testing.assert_array_equal(
+                    ds.variables['TEMP'][1], np.ma.filled(src.variables['TEMP'][0], np.nan))
+        expected = metrics.get_amoc(self.ncfiles, store=False, window_size=0)
+        result = metrics.get_amoc(self.ncfiles, store=self.storefile, window_size=0)
+        np.testing.assert_allclose(np.asarray(result), np.asarray(expected))
+        # fewer steps than the source files own
+        with netCDF4.Dataset(self.storefile, 'a') as ds:
+            ds.variables['source_ntime'][1] = 2
+        with self.assertRaises(ValueError):
+            rechunk.RechunkedStore(self.storefile)
+        with self.assertRaises(ValueError):
+            rechunk.build_store(self.storefile, self.ncfiles)
+
+    def test_metrics(self):
+        rechunk.build_store(self.storefile, self.ncfiles, ['MOC', 'TEMP'])
+        for func, kwargs in [
+                (metrics.get_amoc, dict(window_size=0)),
+                (metrics.get_timeseries, dict(varn='TEMP', grid='T', latlim=(60,90)))]:
+            expected = func(self.ncfiles, store=False, **kwargs)
+            result = func(self.ncfiles, store=self.storefile, **kwargs)
+            np.testing.assert_allclose(np.asarray(result), np.asarray(expected))
+        # found in `stores`, also for a subset of the files
+        rechunk.stores.append(self.storefile)
+        try:
+            store, tindex = rechunk.find_store(self.ncfiles[1:], ['TEMP'])
+            self.assertEqual(tindex, slice(1, 2))
+            store.close()
+            self.assertIsNone(rechunk.find_store(self.ncfiles, ['SALT'])[0])
+            # modified files are read from the files
+            os.utime(self.ncfiles[0], (0, 0))
+            self.assertIsNone(rechunk.find_store(self.ncfiles, ['TEMP'])[0])
+        finally:
+            rechunk.stores.remove(self.storefile)
+
+if __name__ == '__main__':
+    unittest.main()
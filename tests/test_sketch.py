@@ -0,0 +1,41 @@
+import unittest
+import numpy as np
+from poppy import sketch
+
+ncfiles = ['./data/x3_0801-01.nc', './data/x3_0801-02.nc']
+
+def _reader(dsvar):
+    return dsvar['TEMP'][0]
+
+class TestLoad(unittest.TestCase):
+
+    def test_quantiles(self):
+        rng = np.random.RandomState(1)
+        data = rng.normal(size=200000)
+        sk = sketch.QuantileSketch(k=1024)
+        for chunk in np.array_split(data, 7):
+            sk.update(chunk)
+        self.assertEqual(sk.count, len(data))
+        self.assertEqual(sk.min, data.min())
+        self.assertEqual(sk.max, data.max())
+        q = [0.01, 0.5, 0.99]
+        np.testing.assert_allclose(sk.quantile(q), np.percentile(data, [1, 50, 99]), atol=0.05)
+        self.assertLess(sum(len(v) for v in sk.levels), 20000)
+
+    def test_merge_files(self):
+        merged = sketch.sketch_files(ncfiles, _reader, nprocs=2)
+        serial = sketch.sketch_files(ncfiles, _reader)
+        data = np.concatenate([np.ma.compressed(_reader_file(f)) for f in ncfiles])
+        self.assertEqual(merged.count, len(data))
+        self.assertEqual(merged.max, serial.max)
+        np.testing.assert_allclose(merged.quantile(0.5), np.median(data), atol=0.2)
+        levels = sketch.robust_levels(merged)
+        self.assertAlmostEqual(levels[0], -levels[-1])
+
+def _reader_file(fname):
+    import netCDF4
+    with netCDF4.Dataset(fname) as ds:
+        return _reader(ds.variables)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,47 @@
+import unittest
+import glob
+import os
+import shutil
+import tempfile
+import numpy as np
+from poppy import metrics
+from poppy import slabcache
+
+
+class TestLoad(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.ncfiles = [shutil.copy(fname, self.tmpdir)
+                for fname in sorted(glob.glob('./data/x3_0801-??.nc'))]
+        self.cachedir = os.path.join(self.tmpdir, 'cache')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_get_slab(self):
+        moc, timeax = slabcache.get_slab(self.ncfiles, 'MOC', self.cachedir)
+        self.assertIsInstance(moc, np.memmap)
+        self.assertEqual(len(moc), len(self.ncfiles))
+        self.assertEqual(len(timeax), len(self.ncfiles))
+        datafile = moc.filename
+        inode = os.stat(datafile).st_ino
+        del moc
+        # reused while the files are unchanged
+        moc, _ = slabcache.get_slab(self.ncfiles, 'MOC', self.cachedir)
+        self.assertEqual(os.stat(datafile).st_ino, inode)
+        del moc
+        os.utime(self.ncfiles[0], (0, 0))
+        moc, _ = slabcache.get_slab(self.ncfiles, 'MOC', self.cachedir)
+        self.assertNotEqual(os.stat(datafile).st_ino, inode)
+
+    def test_amoc(self):
+        for zlim in [(500,9999), (1000,4000)]:
+            expected = metrics.get_amoc(self.ncfiles, zlim=zlim, window_size=0, store=False)
+            result = metrics.get_amoc(self.ncfiles, zlim=zlim, window_size=0, store=False,
+                    cachedir=self.cachedir)
+            np.testing.assert_array_equal(np.asarray(result), np.asarray(expected))
+        self.assertEqual(len(glob.glob(os.path.join(self.cachedir, 'MOC.*.json'))), 1)
+
+if __name__ == '__main__':
+    unittest.main()
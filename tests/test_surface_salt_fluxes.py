@@ -0,0 +1,79 @@
+import unittest
+import os
+import shutil
+import tempfile
+import netCDF4
+import numpy as np
+from poppy import surface_salt_fluxes as ssf
+
+
+def _make_file(fname, nt=2, ny=4, nx=5):
+    rng = np.random.RandomState(0)
+    with netCDF4.Dataset(fname, 'w') as ds:
+        ds.createDimension('time', None)
+        ds.createDimension('nlat', ny)
+        ds.createDimension('nlon', nx)
+        time = ds.createVariable('time', 'f8', ('time',))
+        time.units = 'days since 0000-01-01 00:00:00'
+        time.calendar = 'noleap'
+        time[:] = 365. * 801 + 31. * np.arange(1, nt+1)
+        ds.createVariable('TAREA', 'f8', ('nlat', 'nlon'))[:] = 1e10 * (1. + rng.rand(ny, nx))
+        kmt = np.full((ny, nx), 10, dtype='i4')
+        kmt[0, :2] = 0
+        ds.createVariable('KMT', 'i4', ('nlat', 'nlon'))[:] = kmt
+        lon, lat = np.meshgrid(np.linspace(0, 300, nx), np.linspace(-60, 60, ny))
+        ds.createVariable('TLONG', 'f8', ('nlat', 'nlon'))[:] = lon
+        ds.createVariable('TLAT', 'f8', ('nlat', 'nlon'))[:] = lat
+        for varn, value in [('latent_heat_fusion', 3.337e9), ('sflux_factor', 0.1),
+                ('salinity_factor', -0.00347)]:
+            ds.createVariable(varn, 'f8')[...] = value
+        for varn in ssf.budget_components + ['SFWF']:
+            ds.createVariable(varn, 'f8', ('time', 'nlat', 'nlon'))[:] = 1e-5 * rng.randn(nt, ny, nx)
+        # comparable to the other terms once divided by latent_heat_fusion*1e4
+        ds.variables['QFLUX'][:] = 1e9 * rng.rand(nt, ny, nx)
+
+
+class TestLoad(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.fname = os.path.join(self.tmpdir, 'fluxes.nc')
+        _make_file(self.fname)
+        self.regions = {'Global': {}, 'North': {'latlim': (0, 90)}}
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_budget_closes(self):
+        df = ssf.get_surface_fw_budget([self.fname], regions=self.regions)
+        for name in self.regions:
+            budget = df[name]
+            total = budget[ssf.budget_components[:-1] + ['RESTORING']].sum(axis=1) - budget['QFLUX']
+            np.testing.assert_allclose(total, budget['NET'])
+
+    def test_net_without_qflux(self):
+        with netCDF4.Dataset(self.fname) as ds:
+            dsvar = ds.variables
+            area = np.where(dsvar['KMT'][:] > 0, dsvar['TAREA'][:] * 1e-4, 0.)
+            expected = ((dsvar['SFWF'][:] - dsvar['QFLUX'][:] / dsvar['latent_heat_fusion'][:] / 1e4)
+                    * area).sum(axis=(1, 2))
+        for components in [ssf.budget_components, ['PREC_F'], ['SFWF']]:
+            df = ssf.get_surface_fw_budget([self.fname], components=components)
+            np.testing.assert_allclose(df['Global']['NET'], expected)
+
+    def test_derived_components(self):
+        df = ssf.get_surface_fw_budget([self.fname], components=['SALT_F', 'SALT_F_FW'])
+        np.testing.assert_allclose(df['Global']['SALT_F_FW'], df['Global']['SALT_F'])
+        # not a surface field
+        with self.assertRaises(ValueError):
+            ssf.get_surface_fw_budget([self.fname], components=['FRESHWATER'])
+
+    def test_region_mask_unchanged(self):
+        mask = np.ones((4, 5), bool)
+        with netCDF4.Dataset(self.fname) as ds:
+            names, weights = ssf.get_region_weights(ds, {'Box': mask})
+        self.assertTrue(mask.all())
+        self.assertEqual((weights[0] > 0).sum(), mask.size - 2)
+
+if __name__ == '__main__':
+    unittest.main()